@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""
+:mod:`acceptance_tester.abstract_testsuite_runner.async_test_runner` -- Abstract asyncio test runner
+===================================================================================================
+
+===========================
+Async Test Runner Interface
+===========================
+
+This abstract test runner should be implemented by test runners that
+spend most of their time waiting on services. The framework runs many
+tests of such a runner concurrently on one event loop in each worker
+process, instead of one test per process.
+
+The interface is the same as
+:class:`acceptance_tester.abstract_testsuite_runner.test_runner.TestRunner`,
+except that :meth:`AsyncTestRunner.run_test` is a coroutine. The
+parser and setup functions may be either plain functions or
+coroutine functions; :meth:`AsyncTestRunner.parse` awaits the results
+that are awaitable. The same goes for shutdown hooks.
+
+The tests share the event loop, so test runners must not block in
+their parser or setup functions. Blocking work should be handed to
+an executor with ``loop.run_in_executor``.
+"""
+import asyncio
+import inspect
+import logging
+from nose.tools import nottest
+
+from acceptance_tester.abstract_testsuite_runner.test_runner import TestRunner
+
+
+class NullHandler( logging.Handler ):
+    """ Nullhandler for logging.
+    """
+
+    def emit( self, record ):
+        pass
+
+### define logger
+logger = logging.getLogger( "dbc." + __name__ )
+logger.addHandler( NullHandler() )
+
+
+async def _resolve( value ):
+    """ Awaits value if it is awaitable, and returns the result. """
+    if inspect.isawaitable( value ):
+        return await value
+    return value
+
+
+class AsyncTestRunner( TestRunner ):
+    """
+    Abstract asyncio testrunner. Should be implemented by a testrunner handler.
+    """
+
+    @nottest
+    async def run_test( self, test_xml, build_folder, resource_manager ):
+        """
+        Runs test.
+
+        :param test_xml:
+            The test xml node
+        :type test_xml:
+            lxml.etree.Element
+        :param build_folder:
+            Path to build folder for this test.
+        :type build_folder:
+            string
+        :param resource_manager:
+            A reference to this tests resource_manager.
+        :type resource_manager:
+           class
+
+        """
+        raise NotImplementedError( "Should be implemented by inheriter." )
+
+    async def parse( self, test_xml ):
+        """
+        Parses and executes the test xml, awaiting parser, setup and
+        shutdown functions that return awaitables.
+        """
+        suite_node = test_xml.xpath( "/wrapping/*", namespaces=dict( [self.suite.namespace] ) )
+        setup_node = test_xml.xpath( "/wrapping/ts:setup/*", namespaces=dict( [self.suite.namespace] ) )
+        test_node = test_xml.xpath( "/wrapping/ts:test/*", namespaces=dict( [self.suite.namespace] ) )
+
+        async def parse_type( nodes ):
+            for node in nodes:
+                logger.debug( "Evaluation Node '%s'"%node.tag )
+                if node.tag in self.setup_functions:
+                    self.shutdown_hooks.append( [ self.setup_functions[node.tag]["shutdown"], self.save_logfile] )
+                    await _resolve( self.setup_functions[node.tag]["setup"]( node ) )
+                else:
+                    self.failures.append( "Tag '%s' is not known."%node.tag )
+
+        try:
+            if not self.keep_setup:
+                await parse_type( suite_node )
+                await parse_type( setup_node )
+                await self._setup_complete()
+            else:
+                setup_tag = "{%s}setup"%self.suite.ns
+                if not self.setup_done:
+                    await parse_type( [x for x in suite_node if x.tag == setup_tag] )
+                    await parse_type( setup_node )
+                    await self._setup_complete()
+                    self.setup_shutdown_hooks = self.shutdown_hooks
+                    self.shutdown_hooks = []
+                    self.setup_done = True
+                await parse_type( [x for x in suite_node if x.tag != setup_tag] )
+
+            for node in test_node:
+
+                if node.tag in self.parser_functions:
+                    logger.debug( "Evaluation Node '%s'"%node.tag )
+                    self._update_out( *await _resolve( self.parser_functions[node.tag]( node ) ) )
+                else:
+                    self.failures.append( "Tag '%s' is not known."%node.tag )
+
+        except:
+            await self.shutdown()
+            raise
+
+        await self.shutdown()
+
+    async def _setup_complete( self ):
+        """ Lets the framework snapshot the build folder, if the setup went well.
+        The snapshot is taken in an executor, so the event loop is not blocked.
+        """
+        snapshot = self.setup_snapshot
+        self.setup_snapshot = None
+        if snapshot == None or self.errors or self.failures:
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor( None, snapshot )
+        except Exception as err:
+            logger.warning( "Could not snapshot build folder after setup: %s"%err )
+
+    async def shutdown( self ):
+        """ Runs all functions added to 'self.shutdown_hooks'
+        """
+        await self._run_hooks( self.shutdown_hooks )
+
+    async def shutdown_setup( self ):
+        """ Runs the shutdown hooks deferred by the setup when **keep_setup** is set.
+        """
+        hooks = self.setup_shutdown_hooks
+        self.setup_shutdown_hooks = []
+        self.setup_done = False
+        await self._run_hooks( hooks )
+
+    async def _run_hooks( self, hooks ):
+        for hook in hooks:
+            args = ()
+            if len( hook ) > 1:
+                args = tuple( hook[1:] )
+            self._update_out( *await _resolve( hook[0]( *args ) ) )
+
+    def _update_out( self, output, failures, errors ):
+        self.output += output
+        self.failures += failures
+        self.errors += errors
@@ -48,6 +48,27 @@ The following fields are provided by the constructor:
 
 The method :meth:`TestRunner.save_logfile` is also provided. The
 logfiles picked up by this method are archived by the framework.
+
+Setup reuse
+-----------
+
+When the framework runs with setup affinity, a single runner instance
+is used for several tests from the same testsuite. The framework sets
+**keep_setup** to True, and calls :meth:`TestRunner.prepare_test`
+before each test. The setup node is then only parsed for the first
+test, and the shutdown hooks registered by the setup are deferred
+until :meth:`TestRunner.shutdown_setup` is called after the last
+test. Runners that keep state from the setup on the instance work
+unchanged, as long as the test nodes do not depend on a fresh setup.
+
+Setup snapshots
+---------------
+
+When the framework runs with a setup cache, the build folder of a
+test may be populated from a snapshot taken after an identical setup
+ran for an earlier test. In that case **setup_restored** is True when
+the setup functions are called, and they may skip creating fixtures
+that are already present in the build folder.
 """
 import logging
 import os
@@ -118,6 +139,11 @@ class TestRunner( object ):
         self.base_folder = os.path.dirname( test_path )
         self.logfolder = logfolder
         self.shutdown_hooks = []
+        self.keep_setup = False
+        self.setup_done = False
+        self.setup_shutdown_hooks = []
+        self.setup_restored = False
+        self.setup_snapshot = None
         self.parser_functions = {}
         self.setup_functions = {}
 
@@ -126,6 +152,28 @@ class TestRunner( object ):
         self.parser_functions.update( self.suite.parser_functions )
         self.setup_functions.update( self.suite.setup_functions )
 
+    def prepare_test( self, id, logfolder ):
+        """
+        Prepares a runner that has already run a test for the next test
+        from the same testsuite. Results from the previous test are
+        cleared, while the state created by the setup is kept.
+
+        :param id:
+            A unique test identifier.
+        :type id:
+            int
+        :param logfolder:
+            Folder to place logfiles in for arvhival.
+        :type logfolder:
+            string
+        """
+        self.id = id
+        self.logfolder = logfolder
+        self.errors = []
+        self.failures = []
+        self.output = []
+        self.shutdown_hooks = []
+
     def save_service_logfiles(self, service, name):
         logger.debug("Getting %s logfiles"%name)
         logFiles = service.get_logfiles()
@@ -191,8 +239,22 @@ class TestRunner( object ):
                     self.failures.append( "Tag '%s' is not known."%node.tag )
 
         try:
-            parse_type( suite_node )
-            parse_type( setup_node )
+            if not self.keep_setup:
+                parse_type( suite_node )
+                parse_type( setup_node )
+                self.__setup_complete()
+            else:
+                setup_tag = "{%s}setup"%self.suite.ns
+                if not self.setup_done:
+                    parse_type( [x for x in suite_node if x.tag == setup_tag] )
+                    parse_type( setup_node )
+                    self.__setup_complete()
+                    ### a failed setup is shut down with this test, so the next test sets up again
+                    if not ( self.errors or self.failures ):
+                        self.setup_shutdown_hooks = self.shutdown_hooks
+                        self.shutdown_hooks = []
+                        self.setup_done = True
+                parse_type( [x for x in suite_node if x.tag != setup_tag] )
 
             for node in test_node:
 
@@ -208,6 +270,18 @@ class TestRunner( object ):
 
         self.shutdown()
 
+    def __setup_complete( self ):
+        """ Lets the framework snapshot the build folder, if the setup went well.
+        """
+        snapshot = self.setup_snapshot
+        self.setup_snapshot = None
+        if snapshot == None or self.errors or self.failures:
+            return
+        try:
+            snapshot()
+        except Exception as err:
+            logger.warning( "Could not snapshot build folder after setup: %s"%err )
+
     def shutdown( self ):
         """ Runs all functions added to 'self.shutdown_hooks'
         """
@@ -217,6 +291,18 @@ class TestRunner( object ):
                 args = tuple( hook[1:] )
             self.__update_out( *hook[0]( *args ) )
 
+    def shutdown_setup( self ):
+        """ Runs the shutdown hooks deferred by the setup when **keep_setup** is set.
+        """
+        hooks = self.setup_shutdown_hooks
+        self.setup_shutdown_hooks = []
+        self.setup_done = False
+        for hook in hooks:
+            args = ()
+            if len( hook ) > 1:
+                args = tuple( hook[1:] )
+            self.__update_out( *hook[0]( *args ) )
+
     def __update_out( self, output, failures, errors ):
         self.output += output
         self.failures += failures
@@ -12,7 +12,9 @@ Commandline Interface
 The **suite_test** script must be provided with a testfolder as the
 first (and only) argument.  The testfolder is looked through
 recursively for testsuite files, which are used to run the tests. The
-acceptance tester can only test of one test type on each run.
+testsuite files may be of several test types. The tests of all types
+share the workers and the capacity, and are reported together, while
+each test type gets its own resource manager.
 
 
 Commandline options
@@ -38,7 +40,240 @@ None of the options are mandatory, they all have sane default values.
 
 .. cmdoption:: --pool-size <pool-size>
 
-   Number of concurrent tests to run.
+   Number of concurrent tests to run. If 'auto', the number is adjusted
+   during the run: it starts at ``--pool-size-floor``, and grows
+   towards ``--pool-size-ceiling`` while the load average is below the
+   number of CPUs and enough memory is available. It shrinks when the
+   host is overloaded or memory gets scarce.
+
+.. cmdoption:: --pool-size-floor <number>
+
+   Smallest pool size when the pool size is 'auto'. Default is 1.
+
+.. cmdoption:: --pool-size-ceiling <number>
+
+   Largest pool size when the pool size is 'auto'. Default is the
+   number of CPUs.
+
+.. cmdoption:: --memory-headroom <megabytes>
+
+   Memory to keep available on the host when the pool size is 'auto'.
+   Default is 1024.
+
+.. cmdoption:: --capacity-cpus <number>
+
+   CPU slots available to concurrent tests. Tests declare the slots
+   they use with a ``cpus`` attribute on their ``<test>`` or
+   ``<testsuite>`` node, the default is 1. Tests are only started while
+   their slots fit in the capacity. Default is the pool size, or the
+   largest pool size when the pool size is 'auto', so tests that
+   declare no cpus are only limited by the number of workers.
+
+.. cmdoption:: --capacity-memory <megabytes>
+
+   Memory available to concurrent tests. Tests declare their memory use
+   in megabytes with a ``memory`` attribute on their ``<test>`` or
+   ``<testsuite>`` node. Default is the memory available when the run
+   starts.
+
+   Tests declaring the same token in an ``exclusive`` attribute, such
+   as ``exclusive="database"``, never run at the same time. Several
+   tokens are separated by commas.
+
+.. cmdoption:: --type-concurrency <name=number>
+
+   Largest number of tests of the test type name running at the same
+   time, for instance ``holdings=2``. May be given several times.
+   Test types without a limit are only limited by the capacity.
+
+.. cmdoption:: --include <pattern>
+
+   Glob pattern of the files in the test folders that may be testsuite
+   files, for instance ``*_suite.xml``. May be given several times.
+   A pattern without a slash matches file names at any depth, a pattern
+   with a slash matches the path relative to the test folder. Default
+   is ``*.xml``.
+
+.. cmdoption:: --exclude <pattern>
+
+   Glob pattern of files and folders in the test folders to skip, for
+   instance ``data/``. A pattern ending in a slash only matches folders.
+   Excluded folders are not searched. May be given several times.
+   Patterns may also be listed, one on each line, in a file named
+   ``.acceptance-tester-ignore`` in a test folder. Hidden folders are
+   always skipped.
+
+.. cmdoption:: --start-method <method>
+
+   How worker processes are started: 'fork', 'spawn' or 'forkserver'.
+   With 'forkserver' workers are forked from a small server process
+   that has already imported the framework, lxml and the test runner
+   and resource manager modules of the test type. New and replaced
+   workers then start quickly, and do not inherit the memory of the
+   main process. Default is the platform default.
+
+.. cmdoption:: --watch
+
+   Keeps the workers and the resource manager after the run, and
+   watches the testsuite files and the testrunner configuration for
+   changes. When a testsuite file changes, its new and changed tests
+   are run again. When the testrunner configuration changes, the
+   workers are restarted and all tests are run again. After each run
+   the tests whose status changed are listed. Stop watching with
+   Ctrl-C. Changes are noticed at once if the inotify_simple module is
+   installed, otherwise the files are checked every
+   :option:`--watch-interval` seconds.
+
+.. cmdoption:: --watch-interval <seconds>
+
+   Seconds between checks for changes when watching. Default is 1.
+
+.. cmdoption:: --state-folder <state-folder>
+
+   Folder to keep information between runs in, such as the durations
+   of tests used to start the longest tests first, and an index of the
+   testsuite files, so files unchanged since the last run are not
+   parsed again. By default nothing is kept between runs. The setup
+   cache, the result cache and :option:`--changed-only` need a state
+   folder.
+
+.. cmdoption:: --setup-affinity
+
+   Runs tests from the same testsuite on the same worker, so the setup
+   of the testsuite is only run once per worker. Shutdown of the setup
+   is deferred until the last of these tests is done.
+
+.. cmdoption:: --setup-cache-size <megabytes>
+
+   Keeps snapshots of build folders taken right after the setup has
+   run, in the state folder. Later tests with identical setup start
+   from a copy of the snapshot. Least recently used snapshots are
+   removed when the cache grows beyond this size. Needs
+   :option:`--state-folder`. Default is 0, which disables the cache.
+
+.. cmdoption:: --setup-cache-hardlinks
+
+   Allows snapshot files to be hardlinked into build folders when the
+   filesystem does not support reflinks.
+
+.. cmdoption:: --async-concurrency <number>
+
+   Number of tests each worker runs concurrently on its event loop,
+   when the test runner of the test type is an asyncio test runner.
+   Ignored for other test runners.
+
+.. cmdoption:: --coordinator <host:port>
+
+   Serves the tests found in testfolder to workers connecting to
+   host:port, instead of running them locally. The report file, test
+   results and log archive are written by the coordinator. The
+   coordinator exits when all tests are done.
+
+.. cmdoption:: --worker <host:port>
+
+   Runs tests served by the coordinator at host:port, with
+   ``--pool-size`` tests at a time. No testfolder is given to a
+   worker, but the testsuites must be found at the same paths as on
+   the coordinator.
+
+.. cmdoption:: --authkey <key>
+
+   Key shared by coordinator and workers. If not given, the key is read
+   from the environment variable ``ACCEPTANCE_TESTER_AUTHKEY``.
+
+.. cmdoption:: --shard <index/total>
+
+   Runs only one of total shards of the tests, counting from 1. The
+   tests are split so the shards have roughly the same total duration,
+   as recorded in ``test-timings.json`` in the state folder. Shards only
+   read this file, and record their durations in a timings file with
+   the shard suffix, so the split is the same in every run of the same
+   tests. To rebalance the shards, replace ``test-timings.json`` with
+   the timings of a full run. Without recorded durations, the tests are
+   split evenly by count. The report file, log archive and result files
+   are named with a shard suffix.
+
+.. cmdoption:: --test-timeout <seconds>
+
+   Seconds a test may run before its worker is killed and replaced,
+   and the test is reported as an error. A test can override the
+   timeout with a ``timeout`` attribute on its test node. Default is 0,
+   which means no timeout. Tests run together with setup affinity
+   share the sum of their timeouts.
+
+.. cmdoption:: --global-timeout <seconds>
+
+   Seconds all tests may run in total. When exceeded, the running
+   tests are stopped, the remaining tests are not started, and all of
+   them are reported as errors. The reports are still written.
+   Default is 0, which means no limit.
+
+.. cmdoption:: --fail-fast
+
+   Cancels the run when the first test fails or causes an error. The
+   same as ``--max-failures 1``.
+
+.. cmdoption:: --max-failures <number>
+
+   Cancels the run when this number of tests have failed or caused
+   errors. Tests that are not run are reported as skipped, and the
+   reports are written as usual. Default is 0, which never cancels.
+
+.. cmdoption:: --cancel-grace <seconds>
+
+   Seconds running tests may continue after the run is cancelled,
+   before they are stopped and reported as skipped. By default running
+   tests are allowed to finish.
+
+.. cmdoption:: --retries <number>
+
+   Number of times a test that fails or causes an error is run again,
+   each time on a newly started worker process. The report lists every
+   attempt. A test that succeeds after failing is reported as flaky in
+   the summary and in the properties of its xUnit testcase. The rate of
+   runs in which each test was flaky is kept in the state folder.
+   Default is 0.
+
+.. cmdoption:: --changed-only
+
+   Runs only the tests whose xml, including the setup of their
+   testsuite, changed since the last run, and the tests that did not
+   succeed in the last run. The results of the other tests are carried
+   over into the reports. The results are kept in the state folder.
+
+.. cmdoption:: --rerun-failed <test-results-folder>
+
+   Runs only the tests that failed or caused errors in an earlier run,
+   as found in the xUnit files in the test result folder of that run.
+   Only the testsuite files of these tests are read, so no testfolder
+   is given.
+
+.. cmdoption:: -k <expression>, --keyword <expression>
+
+   Runs only the tests selected by the expression. Terms are regular
+   expressions, searched for case insensitively in the test name and
+   the testsuite path relative to the test folder, or in a single
+   field when prefixed by ``name:``, ``suite:``, ``description:``,
+   ``given:``, ``when:`` or ``then:``.
+   Terms are combined with ``and``, ``or``, ``not`` and parentheses,
+   for instance ``-k "login and not when:'times out'"``. Terms with
+   white space or parentheses are quoted. Tests are selected before
+   anything is prepared for them.
+
+.. cmdoption:: --result-cache-size <number>
+
+   Number of successful results to keep in a cache in the state folder.
+   A test is reported from the cache without running, if it succeeded
+   before with the same xml, test runner version, testrunner
+   configuration and cache artifacts. The least recently used results
+   are removed when the cache is full. Needs :option:`--state-folder`.
+   Default is 0, which disables the cache.
+
+.. cmdoption:: --cache-artifact <path>
+
+   File or folder the tests run against, such as a jar under test. The
+   content is part of the key of cached results, so results are only
+   reused for identical artifacts. May be given several times.
 
 .. cmdoption:: --verbose <verbose>
 
@@ -83,6 +318,8 @@ import os
 
 import os_python.common.utils.basic_logger as basic_logger
 import acceptance_tester.framework.suite_tester as suite_tester
+import acceptance_tester.framework.distributed as distributed
+import acceptance_tester.framework.rerun as rerun
 
 
 def parse_testfile_file( file ):
@@ -134,7 +371,98 @@ def cli():
 
     parser.add_option("--pool-size", type="string", action="store", dest="pool_size",
                       default=default_pool_size,
-                      help="Number of concurrent tests to run. Default is '%s'"% default_pool_size )
+                      help="Number of concurrent tests to run, or 'auto'. Default is '%s'"% default_pool_size )
+
+    parser.add_option("--pool-size-floor", type="int", action="store", dest="pool_size_floor", default=1,
+                      help="Smallest pool size when pool size is 'auto'. Default is '%s'"%1 )
+
+    parser.add_option("--pool-size-ceiling", type="int", action="store", dest="pool_size_ceiling", default=os.cpu_count(),
+                      help="Largest pool size when pool size is 'auto'. Default is the number of CPUs" )
+
+    parser.add_option("--memory-headroom", type="int", action="store", dest="memory_headroom", default=1024,
+                      help="Megabytes of memory to keep available when pool size is 'auto'. Default is '%s'"%1024 )
+
+    parser.add_option("--capacity-cpus", type="float", action="store", dest="capacity_cpus", default=None,
+                      help="CPU slots available to concurrent tests. Default is the pool size" )
+
+    parser.add_option("--capacity-memory", type="float", action="store", dest="capacity_memory", default=None,
+                      help="Megabytes of memory available to concurrent tests. Default is the available memory" )
+
+    parser.add_option("--type-concurrency", type="string", action="append", dest="type_concurrency", default=[],
+                      help="Largest number of tests of a test type running at the same time, on the form name=number. May be given several times." )
+    parser.add_option("--include", type="string", action="append", dest="include", default=[],
+                      help="Glob pattern of the files that may be testsuite files. May be given several times. Default is '*.xml'" )
+    parser.add_option("--exclude", type="string", action="append", dest="exclude", default=[],
+                      help="Glob pattern of files and folders to skip in the test folders, such as 'data/'. May be given several times." )
+    parser.add_option("--start-method", type="choice", action="store", dest="start_method", default=None,
+                      choices=[ "fork", "spawn", "forkserver" ],
+                      help="How worker processes are started: fork, spawn or forkserver. Default is the platform default" )
+
+    parser.add_option("--watch", action="store_true", dest="watch", default=False,
+                      help="Reruns tests affected by changes to testsuite files or the testrunner configuration, until interrupted" )
+
+    parser.add_option("--watch-interval", type="float", action="store", dest="watch_interval", default=1.0,
+                      help="Seconds between checks for changes when watching. Default is '%s'"%1.0 )
+
+    parser.add_option("--state-folder", type="string", action="store", dest="state_folder", default=None,
+                      help="Folder to keep information between runs in, such as test durations. Default is to keep nothing" )
+
+    parser.add_option("--setup-affinity", action="store_true", dest="setup_affinity", default=False,
+                      help="Runs tests from the same testsuite on the same worker, reusing the setup." )
+
+    parser.add_option("--setup-cache-size", type="int", action="store", dest="setup_cache_size", default=0,
+                      help="Size in megabytes of the cache with build folder snapshots taken after setup. Default is 0 (disabled)" )
+
+    parser.add_option("--setup-cache-hardlinks", action="store_true", dest="setup_cache_hardlinks", default=False,
+                      help="Allows hardlinking snapshot files into build folders." )
+
+    parser.add_option("--async-concurrency", type="int", action="store", dest="async_concurrency", default=50,
+                      help="Number of concurrent tests per worker for asyncio test runners. Default is '%s'"%50 )
+
+    parser.add_option("--coordinator", type="string", action="store", dest="coordinator", default=None,
+                      help="Serves tests to workers on host:port instead of running them locally." )
+
+    parser.add_option("--worker", type="string", action="store", dest="worker", default=None,
+                      help="Runs tests served by the coordinator at host:port." )
+
+    parser.add_option("--authkey", type="string", action="store", dest="authkey", default=None,
+                      help="Key shared by coordinator and workers. Default is read from %s"%distributed.AUTHKEY_VARIABLE )
+
+    parser.add_option("--shard", type="string", action="store", dest="shard", default=None,
+                      help="Runs only shard index of total shards of the tests, given as index/total." )
+
+    parser.add_option("--test-timeout", type="float", action="store", dest="test_timeout", default=0,
+                      help="Seconds a test may run before it is stopped. Default is 0 (no timeout)" )
+
+    parser.add_option("--global-timeout", type="float", action="store", dest="global_timeout", default=0,
+                      help="Seconds all tests may run in total. Default is 0 (no limit)" )
+
+    parser.add_option("--fail-fast", action="store_true", dest="fail_fast", default=False,
+                      help="Cancels the run when the first test fails." )
+
+    parser.add_option("--max-failures", type="int", action="store", dest="max_failures", default=0,
+                      help="Cancels the run when this number of tests have failed. Default is 0 (never)" )
+
+    parser.add_option("--cancel-grace", type="float", action="store", dest="cancel_grace", default=None,
+                      help="Seconds running tests may continue after the run is cancelled. Default is to let them finish" )
+
+    parser.add_option("--retries", type="int", action="store", dest="retries", default=0,
+                      help="Number of times a failed test is run again on a new worker. Default is 0" )
+
+    parser.add_option("--changed-only", action="store_true", dest="changed_only", default=False,
+                      help="Runs only tests that changed or did not succeed in the last run." )
+
+    parser.add_option("--rerun-failed", type="string", action="store", dest="rerun_failed", default=None,
+                      help="Runs only the tests that failed in the xUnit files in this test result folder." )
+
+    parser.add_option("-k", "--keyword", type="string", action="store", dest="keyword", default=None,
+                      help="Runs only the tests selected by this expression of regular expressions, and, or, not and parentheses." )
+
+    parser.add_option("--result-cache-size", type="int", action="store", dest="result_cache_size", default=0,
+                      help="Number of successful results to keep in the result cache. Default is 0 (disabled)" )
+
+    parser.add_option("--cache-artifact", type="string", action="append", dest="cache_artifacts", default=[],
+                      help="File or folder whose content is part of the key of cached results. May be given several times." )
 
     parser.add_option("--verbose", action="store_true", dest="verbose",
                       default=default_verbose,
@@ -187,6 +515,23 @@ def cli():
                                file_mode = options.filemode,
                                console = False )
 
+    if options.worker != None:
+        pool_size = options.pool_size
+        if pool_size == "auto":
+            pool_size = options.pool_size_ceiling
+        distributed.run_worker( distributed.parse_address( options.worker ),
+                                distributed.get_authkey( options.authkey ),
+                                options.build_folder,
+                                options.resource_folder,
+                                int( pool_size ),
+                                options.use_preloaded_resources,
+                                options.configured_resources,
+                                tuple( [ int( x ) for x in options.port_range.split( "-" ) ] ) )
+        return
+
+    if options.fail_fast:
+        options.max_failures = 1
+
     test_targets = []
     if options.file != None:
         print("Additional options from: ", options.file)
@@ -194,6 +539,16 @@ def cli():
 
     test_targets += args
 
+    selection = None
+    if options.rerun_failed != None:
+        if len( test_targets ) > 0:
+            raise RuntimeError( "Tests to rerun are found in the test results, no testfile or testfolder may be given." )
+        selection = rerun.failed_tests( options.rerun_failed )
+        if len( selection ) == 0:
+            print( "Found no failed tests in '%s'"%options.rerun_failed )
+            return
+        test_targets = sorted( selection )
+
     if len( test_targets ) == 0:
         err_msg = "Please supply a testfile or testfolder."
         raise RuntimeError( err_msg )
@@ -211,4 +566,32 @@ def cli():
                       options.configured_resources,
                       options.port_range,
                       options.color,
-                      options.no_clean)
+                      options.no_clean,
+                      state_folder=options.state_folder,
+                      setup_affinity=options.setup_affinity,
+                      setup_cache_size=options.setup_cache_size,
+                      setup_cache_hardlinks=options.setup_cache_hardlinks,
+                      async_concurrency=options.async_concurrency,
+                      coordinator=options.coordinator,
+                      authkey=options.authkey,
+                      shard=options.shard,
+                      test_timeout=options.test_timeout,
+                      global_timeout=options.global_timeout,
+                      max_failures=options.max_failures,
+                      cancel_grace=options.cancel_grace,
+                      pool_size_range=( options.pool_size_floor, options.pool_size_ceiling ),
+                      memory_headroom=options.memory_headroom,
+                      capacity_cpus=options.capacity_cpus,
+                      capacity_memory=options.capacity_memory,
+                      changed_only=options.changed_only,
+                      result_cache_size=options.result_cache_size,
+                      cache_artifacts=options.cache_artifacts,
+                      selection=selection,
+                      retries=options.retries,
+                      start_method=options.start_method,
+                      watch=options.watch,
+                      watch_interval=options.watch_interval,
+                      type_concurrency=options.type_concurrency,
+                      include=options.include,
+                      exclude=options.exclude,
+                      keyword=options.keyword )
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""
+:mod:`acceptance_tester.framework.discovery_index` -- Discovery results of earlier runs
+======================================================================================
+
+===============
+Discovery Index
+===============
+
+This module contains the class :class:`DiscoveryIndex`, which keeps
+the result of discovering each xml file found in the test folders:
+whether the file is a testsuite file, the type of the testsuite, and
+the tests extracted from it by
+:func:`acceptance_tester.framework.find_tests.find_valid_tests`.
+
+An entry is used as long as the size and modification time of the
+file are unchanged, so unchanged files are not parsed again. Files
+modified in the last few seconds are not indexed, since a change made
+within the resolution of the modification time could go unnoticed.
+
+The index is discarded when the version of the index format or of
+acceptance-tester changes, since the extracted tests depend on both.
+"""
+import logging
+import os
+import time
+
+from acceptance_tester._version import __version__
+from . import state_file
+from .xml_slice import XmlSlice
+
+
+class NullHandler( logging.Handler ):
+    """
+    Nullhandler for logging.
+    """
+
+    def emit( self, record ):
+        pass
+
+### define logger
+logger = logging.getLogger( "dbc."+__name__ )
+logger.addHandler( NullHandler() )
+
+INDEX_VERSION = 2
+
+### files modified more recently than this many seconds are not indexed
+RACY_SECONDS = 2.0
+
+
+class DiscoveryIndex( object ):
+    """
+    Discovery results of xml files, by path.
+    """
+
+    def __init__( self, path=None ):
+        """
+        Initializes the index.
+
+        :param path:
+            Path to the file holding the index. If None the index is
+            neither read nor written.
+        :type path:
+            string
+        """
+        self.path = path
+        self.entries = {}
+        content = state_file.read( self.path, INDEX_VERSION, "discovery index", { 'acceptance-tester': __version__ } )
+        if content != None:
+            self.entries = content['files']
+
+    def save( self ):
+        """
+        Writes the index to file. Entries of files that no longer exist
+        are removed.
+        """
+        if self.path == None:
+            return
+        self.entries = dict( [ x for x in self.entries.items() if os.path.exists( x[0] ) ] )
+        state_file.write( self.path, INDEX_VERSION, { 'files': self.entries }, { 'acceptance-tester': __version__ } )
+
+    def lookup( self, filename ):
+        """
+        Returns the entry of a file, if the file is unchanged since it
+        was indexed. Otherwise None is returned, and the file must be
+        parsed.
+
+        The entry is a dictionary with the key 'type', holding the type
+        of the testsuite, or None if the file is not a testsuite file,
+        and the key 'schemas' if the file has been validated against
+        schemas, see :meth:`record_schema`.
+
+        :param filename:
+            Path to the xml file.
+        :type filename:
+            string
+        """
+        entry = self.entries.get( filename )
+        if entry == None:
+            return None
+        try:
+            stat = os.stat( filename )
+        except OSError:
+            return None
+        if entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+            return None
+        return entry
+
+    def record( self, filename, stat, type_name, tests ):
+        """
+        Records the discovery result of a file.
+
+        :param filename:
+            Path to the xml file.
+        :type filename:
+            string
+        :param stat:
+            The result of os.stat for the file, taken before the file
+            was read.
+        :type stat:
+            os.stat_result
+        :param type_name:
+            The type of the testsuite, or None if the file is not a
+            testsuite file.
+        :type type_name:
+            string
+        :param tests:
+            The tests of the testsuite, as tuples with the testsuite
+            path, the test name, the wrapped xml, the documentation, the
+            attributes of the testsuite node and the attributes of the
+            test node.
+        :type tests:
+            list
+        """
+        if time.time() - stat.st_mtime < RACY_SECONDS:
+            self.entries.pop( filename, None )
+            return
+        self.entries[filename] = { 'size': stat.st_size,
+                                   'mtime': stat.st_mtime_ns,
+                                   'type': type_name,
+                                   'tests': [ [ x[1], self._xml_value( x[2] ), x[3], x[4], x[5] ] for x in tests ] }
+
+    def record_schema( self, filename, key, valid ):
+        """
+        Records whether a file validates against a schema. The result
+        is kept until the file changes.
+
+        :param filename:
+            Path to the xml file.
+        :type filename:
+            string
+        :param key:
+            Key identifying the schema.
+        :type key:
+            string
+        :param valid:
+            True if the file validates against the schema.
+        :type valid:
+            bool
+        """
+        entry = self.lookup( filename )
+        if entry != None:
+            entry.setdefault( 'schemas', {} )[key] = valid
+
+    def _xml_value( self, xml ):
+        """ Returns the wrapped xml of a test in a form that can be written as json. """
+        if isinstance( xml, XmlSlice ):
+            return { 'slice': xml.to_list() }
+        return xml
+
+    def tests( self, filename ):
+        """
+        Returns the recorded tests of a file, in the form given to
+        :meth:`record`.
+        """
+        tests = []
+        for name, xml, doc, suite_attributes, attributes in self.entries[filename]['tests']:
+            if isinstance( xml, dict ):
+                xml = XmlSlice.from_list( xml['slice'] )
+            tests.append( ( filename, name, xml, doc, suite_attributes, attributes ) )
+        return tests
@@ -0,0 +1,599 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""
+:mod:`acceptance_tester.framework.distributed` -- Runs tests on several machines
+================================================================================
+
+===================
+Distributed testing
+===================
+
+This module contains the :class:`Coordinator` class, which serves
+tests over TCP, and the :func:`run_worker` function, which pulls
+tests from a coordinator and runs them in a local process pool.
+
+The coordinator discovers the tests, and produces the report file,
+the xUnit files, the log archive and the sphinx-rst documentation,
+exactly as a local run does. Any number of workers can connect while
+the coordinator is running. Each worker keeps as many tests in flight
+as its pool size, and sends each result back together with the
+report text and the zipped log folder of the test.
+
+Workers must have the testsuites and the test runners available at
+the same paths as the coordinator, since setup nodes commonly refer to
+files relative to the testsuite. Each worker starts its own resource
+manager.
+
+Connections are authenticated with a shared key (see
+:mod:`multiprocessing.connection`). Messages are pickled, so the key
+must only be known to trusted machines.
+
+If a worker disconnects while running tests, the tests are reported
+as errors instead of being run again, so a test crashing its worker
+can not stall the run.
+
+Protocol
+--------
+
+All messages are tuples, where the first entry names the message.
+
+#. The worker sends ``( 'hello', hostname, pool_size )``.
+#. The coordinator replies ``( 'setup', settings )``, where settings
+   is a dictionary with the tests, the test type name, the testrunner
+   config and the color flag.
+#. The worker sends ``( 'next', )`` whenever it has room for another
+   test. The coordinator replies ``( 'test', id )``, ``( 'retry', id )``
+   for a test to run again on a new process, ``( 'wait', )`` when there
+   is no test to run yet, but failed tests may still be retried, or
+   ``( 'done', )``. A worker told to wait asks again after its next
+   result, or after :data:`POLL_INTERVAL` seconds when it is idle.
+#. The worker sends ``( 'result', result, report, logs )`` when a test
+   is done. The coordinator replies ``( 'ok', )``, or
+   ``( 'cancel', grace )`` when the run is cancelled.
+
+Workers run the tests in a
+:class:`acceptance_tester.framework.worker_pool.WorkerPool`, so tests
+are stopped at their timeout and at the time limit of the run, exactly
+as in a local run. Failed tests are retried by the coordinator, which
+hands them to the next worker asking for a test. When the run is
+cancelled, tests running on workers are given the cancel grace period
+to finish, after which the coordinator reports them as skipped.
+"""
+import collections
+import datetime
+import io
+import logging
+import os
+import queue
+import shutil
+import socket
+import threading
+import time
+import zipfile
+from multiprocessing.connection import Client
+from multiprocessing.connection import Listener
+
+from . import job
+from . import worker_pool
+from .load_testrunner import load_testrunner
+from acceptance_tester.supported_test_types import TYPES
+from acceptance_tester.abstract_testsuite_runner.async_test_runner import AsyncTestRunner
+
+
+class NullHandler( logging.Handler ):
+    """
+    Nullhandler for logging.
+    """
+
+    def emit( self, record ):
+        pass
+
+### define logger
+logger = logging.getLogger( "dbc."+__name__ )
+logger.addHandler( NullHandler() )
+
+AUTHKEY_VARIABLE = "ACCEPTANCE_TESTER_AUTHKEY"
+
+### seconds an idle worker waits before asking for a test again
+POLL_INTERVAL = 0.5
+
+
+def parse_address( address ):
+    """
+    Parses an address on the form host:port.
+
+    :param address:
+        The address to parse.
+    :type address:
+        string
+    :return:
+        Tuple with host and port.
+
+    :raise RuntimeError:
+        If the address is not on the form host:port.
+    """
+    host, sep, port = address.rpartition( ":" )
+    if sep == "" or not port.isdigit():
+        err_str = "Unknown address format in string '%s', format is: host:port"%address
+        logger.error( err_str )
+        raise RuntimeError( err_str )
+    return ( host, int( port ) )
+
+
+def get_authkey( authkey=None ):
+    """
+    Returns authkey as bytes. If authkey is None the key is read from
+    the environment variable named by :data:`AUTHKEY_VARIABLE`.
+
+    :raise RuntimeError:
+        If no key is given.
+    """
+    if authkey == None:
+        authkey = os.environ.get( AUTHKEY_VARIABLE )
+    if authkey == None or authkey == "":
+        err_str = "A shared key is needed for distributed testing. Use --authkey or set %s"%AUTHKEY_VARIABLE
+        logger.error( err_str )
+        raise RuntimeError( err_str )
+    if isinstance( authkey, str ):
+        authkey = authkey.encode( 'UTF-8' )
+    return authkey
+
+
+def _zip_folder( folder ):
+    """ Returns the content of folder as zip archive bytes. """
+    data = io.BytesIO()
+    zfile = zipfile.ZipFile( data, 'w', zipfile.ZIP_DEFLATED )
+    for root, dirs, files in os.walk( folder ):
+        for f in files:
+            path = os.path.join( root, f )
+            zfile.write( path, os.path.relpath( path, folder ) )
+    zfile.close()
+    return data.getvalue()
+
+
+class Coordinator( object ):
+    """
+    Serves tests to workers, and collects their results.
+    """
+
+    def __init__( self, tests, test_type_name, testrunner_config, color, address, authkey, log_folder, deadline=None ):
+        """
+        Initializes the coordinator and starts listening for workers.
+
+        :param tests:
+            Test argument dictionaries in scheduling order, as created
+            by :class:`acceptance_tester.framework.suite_tester.SuiteTester`.
+        :type tests:
+            list
+        :param test_type_name:
+            Name of the test type in
+            :data:`acceptance_tester.supported_test_types.TYPES`.
+        :type test_type_name:
+            string
+        :param testrunner_config:
+            file used to configure testrunner
+        :type testrunner_config:
+            string
+        :param color:
+            If true, workers colorize their output.
+        :type color:
+            Boolean
+        :param address:
+            Tuple with host and port to listen on. If port is 0 a free
+            port is chosen, see **address**.
+        :type address:
+            tuple
+        :param authkey:
+            Key shared with the workers.
+        :type authkey:
+            bytes
+        :param log_folder:
+            Folder to unpack the logs of the tests into.
+        :type log_folder:
+            string
+        :param deadline:
+            If not None, the :func:`time.monotonic` time after which no
+            tests are started. Workers stop their running tests at the
+            deadline.
+        :type deadline:
+            float
+        """
+        self.tests = dict( [ ( test['id'], test ) for test in tests ] )
+        self.log_folder = log_folder
+        self.deadline = deadline
+        self.settings = { 'tests': [ job.worker_test( dict( [ ( k, v ) for k, v in test.items() if k != 'resource-manager' ] ) ) for test in tests ],
+                          'type-name': test_type_name,
+                          'testrunner-config': testrunner_config,
+                          'color': color }
+
+        self.lock = threading.Lock()
+        self.pending = collections.deque( [ ( 'test', test['id'] ) for test in tests ] )
+        self.outstanding = set( self.tests )
+        self.completed = queue.Queue()
+        self.cancelled = None
+        self.cancel_deadline = None
+        self.expired = False
+        self.finished = False
+
+        self.authkey = authkey
+        self.listener = Listener( address, authkey=authkey )
+        self.address = self.listener.address
+        self.accept_thread = threading.Thread( target=self._accept )
+        self.accept_thread.daemon = True
+        self.accept_thread.start()
+        logger.info( "Waiting for workers on %s:%s"%self.address )
+
+    def results( self ):
+        """
+        Yields the results of the tests as they are completed. The
+        coordinator stops listening when all results are yielded.
+        """
+        try:
+            while len( self.outstanding ) > 0:
+                result = self._next_result()
+                ### a test stopped waiting for may report later
+                if not result['id'] in self.outstanding:
+                    continue
+                self.outstanding.discard( result['id'] )
+                yield result
+        finally:
+            self.close()
+
+    def _next_result( self ):
+        """
+        Returns the next completed result. Tests not yet handed to a
+        worker are reported as errors when the deadline passes, and
+        tests running on workers are reported as skipped when the
+        cancel grace period ends.
+        """
+        while True:
+            deadlines = []
+            if self.deadline != None and not self.expired:
+                deadlines.append( self.deadline )
+            if self.cancel_deadline != None:
+                deadlines.append( self.cancel_deadline )
+            timeout = None
+            if len( deadlines ) > 0:
+                timeout = max( 0, min( deadlines ) - time.monotonic() )
+            try:
+                return self.completed.get( timeout=timeout )
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            if self.deadline != None and not self.expired and now >= self.deadline:
+                self.expired = True
+                self._stop_pending( self._expired_result )
+            if self.cancel_deadline != None and now >= self.cancel_deadline:
+                self.cancel_deadline = None
+                logger.warning( "Stopped waiting for %s tests running on workers, since the run was cancelled"%len( self.outstanding ) )
+                for test_id in list( self.outstanding ):
+                    self.completed.put( job.skipped_result( self.tests[test_id], "Test stopped, since the run was cancelled" ) )
+
+    def _stop_pending( self, make_result ):
+        """ Reports the tests not yet handed to a worker with the results made by make_result. """
+        with self.lock:
+            stopped = [ test_id for kind, test_id in self.pending ]
+            self.pending.clear()
+        for test_id in stopped:
+            self.completed.put( make_result( self.tests[test_id] ) )
+
+    def cancel( self, grace=None ):
+        """
+        Reports the tests not yet handed to a worker as skipped, and
+        cancels the runs on the workers.
+
+        :param grace:
+            Seconds tests running on workers may continue before they
+            are stopped. If None they are allowed to finish.
+        :type grace:
+            float
+        """
+        self.cancelled = ( 'cancel', grace )
+        if grace != None:
+            self.cancel_deadline = time.monotonic() + grace
+        self._stop_pending( self._cancelled_result )
+
+    def retry( self, task ):
+        """
+        Runs the tests in a task again. The tests are handed to the
+        next workers asking for a test, before the other tests, and
+        are run on new processes.
+
+        :param task:
+            A test id, or a list of test ids.
+        :type task:
+            int or list
+        """
+        if not isinstance( task, list ):
+            task = [ task ]
+        for test_id in task:
+            self.outstanding.add( test_id )
+        with self.lock:
+            self.pending.extendleft( [ ( 'retry', x ) for x in reversed( task ) ] )
+        ### no worker asks for the tests after the run is stopped
+        if self.expired:
+            self._stop_pending( self._expired_result )
+        elif self.cancelled != None:
+            self._stop_pending( self._cancelled_result )
+
+    def _expired_result( self, test ):
+        return job.error_result( test, "Test not run, since the time limit for the run was exceeded", datetime.timedelta() )
+
+    def _cancelled_result( self, test ):
+        return job.skipped_result( test, "Test not run, since the run was cancelled" )
+
+    def close( self ):
+        """ Stops listening for workers. """
+        if self.finished:
+            return
+        self.finished = True
+        ### wake up the accepting thread
+        try:
+            Client( self.address, authkey=self.authkey ).close()
+        except Exception as err:
+            logger.debug( "Could not wake up accepting thread: %s"%err )
+        self.accept_thread.join()
+
+    def _accept( self ):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except Exception as err:
+                if self.finished:
+                    break
+                logger.warning( "Rejected worker connection: %s"%err )
+                continue
+            if self.finished:
+                conn.close()
+                break
+            thread = threading.Thread( target=self._serve, args=( conn, ) )
+            thread.daemon = True
+            thread.start()
+        self.listener.close()
+
+    def _serve( self, conn ):
+        """ Serves a single worker until it disconnects. """
+        running = set()
+        worker = "unknown"
+        try:
+            message = conn.recv()
+            if message[0] != 'hello':
+                raise RuntimeError( "Expected hello from worker, got '%s'"%message[0] )
+            worker = message[1]
+            logger.info( "Worker '%s' connected with pool size %s"%( worker, message[2] ) )
+            settings = dict( self.settings )
+            if self.deadline != None:
+                settings['time-left'] = max( 0, self.deadline - time.monotonic() )
+            conn.send( ( 'setup', settings ) )
+
+            while True:
+                message = conn.recv()
+                if message[0] == 'next':
+                    with self.lock:
+                        task = None
+                        if len( self.pending ) > 0:
+                            task = self.pending.popleft()
+                    if task == None:
+                        ### a result is only settled once results() moved past
+                        ### it, since a failed test may still be retried
+                        if self.finished or self.cancelled != None or self.expired:
+                            conn.send( ( 'done', ) )
+                        else:
+                            conn.send( ( 'wait', ) )
+                        continue
+                    running.add( task[1] )
+                    conn.send( task )
+                elif message[0] == 'result':
+                    result, report, logs = message[1:]
+                    self._store_logs( result, logs )
+                    job._sync_file_append( self.tests[result['id']]['report-file'], report )
+                    running.discard( result['id'] )
+                    self.completed.put( result )
+                    conn.send( self.cancelled or ( 'ok', ) )
+                else:
+                    raise RuntimeError( "Unknown message '%s' from worker"%message[0] )
+        except EOFError:
+            logger.info( "Worker '%s' disconnected"%worker )
+        except Exception as err:
+            logger.error( "Lost worker '%s': %s"%( worker, err ) )
+        finally:
+            conn.close()
+
+        for test_id in running:
+            test = self.tests[test_id]
+            self.completed.put( job.error_result( test, "Worker '%s' disconnected while running the test"%worker,
+                                                  datetime.timedelta() ) )
+
+    def _store_logs( self, result, logs ):
+        """ Unpacks the zipped log folder of a test into the log folder. """
+        folder = os.path.join( self.log_folder, os.path.basename( result['build-folder'] ) )
+        if not os.path.exists( folder ):
+            os.mkdir( folder )
+        zfile = zipfile.ZipFile( io.BytesIO( logs ) )
+        zfile.extractall( folder )
+        zfile.close()
+
+
+def _next_test( conn ):
+    """ Asks the coordinator for a test, and returns the reply, or None if there are no more tests. """
+    try:
+        conn.send( ( 'next', ) )
+        message = conn.recv()
+    except ( EOFError, OSError ) as err:
+        ### the coordinator may be gone before an idle worker asks again
+        logger.info( "Coordinator closed the connection: %s"%err )
+        return None
+    if message[0] == 'done':
+        return None
+    return message
+
+
+def _run_async_id( test_id ):
+    """ Runs a single test with an asyncio test runner in a pool worker. """
+    return job.run_async_ids( [ test_id ], 1 )[0]
+
+
+def run_worker( address, authkey, build_folder, resource_folder, pool_size,
+                use_preloaded_resources=False, use_configured_resources=None, port_range=( 12000, 13000 ) ):
+    """
+    Connects to a coordinator and runs tests until the coordinator
+    has no more tests.
+
+    :param address:
+        Tuple with host and port of the coordinator.
+    :type address:
+        tuple
+    :param authkey:
+        Key shared with the coordinator.
+    :type authkey:
+        bytes
+    :param build_folder:
+        The folder to to use for test builds.
+        This is created if it does not exist.
+    :type build_folder:
+        string
+    :param resource_folder:
+        The folder used by the resource-manager.
+        This is created if it does not exist.
+    :type resource_folder:
+        string
+    :param pool_size:
+        The size of the local process pool.
+    :type pool_size:
+        int
+    :param use_preloaded_resources:
+        If true allows resource manager to use preloaded resources
+    :type use_preloaded_resources:
+        boolean
+    :param use_configured_resources:
+        None or path to configuration file containing paths to resources.
+    :type use_configured_resources:
+        string
+    :param port_range:
+        The range the resource manager allocates ports in.
+    :type port_range:
+        tuple with two int elements
+    :return:
+        The number of tests run by this worker.
+    """
+    build_folder = os.path.abspath( build_folder )
+    log_folder = os.path.join( build_folder, 'logs' )
+    report_folder = os.path.join( build_folder, 'reports' )
+    for folder in [ build_folder, log_folder, report_folder, resource_folder ]:
+        if not os.path.exists( folder ):
+            os.makedirs( folder )
+
+    conn = Client( address, authkey=authkey )
+    conn.send( ( 'hello', socket.gethostname(), pool_size ) )
+    message = conn.recv()
+    settings = message[1]
+    logger.info( "Connected to coordinator %s:%s"%address )
+
+    tests = settings['tests']
+    for test in tests:
+        test['build-folder'] = os.path.join( build_folder, os.path.basename( test['build-folder'] ) )
+        test['log-folder'] = log_folder
+        test['report-file'] = os.path.join( report_folder, "%s.txt"%test['id'] )
+
+    definition = TYPES[settings['type-name']]
+    test_type = load_testrunner( definition, settings['testrunner-config'] )
+    resource_manager = None
+    count = 0
+    try:
+        if 'resource-manager' in test_type:
+            resource_manager = test_type['resource-manager']( os.path.abspath( resource_folder ),
+                                                              tests,
+                                                              use_preloaded_resources,
+                                                              use_configured_resources,
+                                                              port_range )
+        for test in tests:
+            test['resource-manager'] = resource_manager
+
+        run_id = job.run_test_id
+        runner = test_type['test-runner']
+        if isinstance( runner, type ) and issubclass( runner, AsyncTestRunner ):
+            run_id = _run_async_id
+
+        tests_by_id = dict( [ ( test['id'], test ) for test in tests ] )
+        deadline = None
+        if 'time-left' in settings:
+            deadline = time.monotonic() + settings['time-left']
+        supervise = dict( timeout=lambda task: tests_by_id[task]['timeout'],
+                          on_lost=lambda task, elapsed, message: job.error_result( tests_by_id[task], message, elapsed ),
+                          deadline=deadline,
+                          on_cancelled=lambda task, elapsed, message: job.skipped_result( tests_by_id[task], message, elapsed ) )
+
+        pool_args = ( tests, definition, settings['testrunner-config'], settings['color'] )
+        pool = worker_pool.WorkerPool( pool_size, job.init_worker, pool_args )
+        try:
+            fresh = True
+            exhausted = False
+            while not exhausted:
+                tasks = []
+                while len( tasks ) < pool_size:
+                    task = _next_test( conn )
+                    if task == None:
+                        exhausted = True
+                        break
+                    if task[0] == 'wait':
+                        break
+                    tasks.append( task )
+                if len( tasks ) == 0:
+                    if not exhausted:
+                        time.sleep( POLL_INTERVAL )
+                    continue
+
+                ### retried tests must not share a process with the tests run before
+                if not fresh and any( [ kind == 'retry' for kind, test_id in tasks ] ):
+                    pool.terminate()
+                    pool.join()
+                    pool = worker_pool.WorkerPool( pool_size, job.init_worker, pool_args )
+                fresh = False
+
+                ### each completed test makes room for the next one
+                for result in pool.imap_unordered( run_id, [ test_id for kind, test_id in tasks ], **supervise ):
+                    conn.send( ( 'result', result ) + _collect_test_output( result, log_folder, report_folder ) )
+                    count += 1
+                    reply = conn.recv()
+                    if reply[0] == 'cancel':
+                        pool.cancel( reply[1] )
+                        exhausted = True
+                    if exhausted:
+                        continue
+                    task = _next_test( conn )
+                    if task == None:
+                        exhausted = True
+                    elif task[0] == 'retry':
+                        pool.retry( task[1] )
+                    elif task[0] == 'test':
+                        pool.add( task[1] )
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        conn.close()
+        if resource_manager != None:
+            resource_manager.shutdown()
+
+    logger.info( "Worker done after running %s tests"%count )
+    return count
+
+
+def _collect_test_output( result, log_folder, report_folder ):
+    """
+    Returns the report text and the zipped logs of a test, and removes
+    them from the worker.
+    """
+    report_file = os.path.join( report_folder, "%s.txt"%result['id'] )
+    report = ""
+    if os.path.exists( report_file ):
+        fh = open( report_file )
+        report = fh.read()
+        fh.close()
+        os.remove( report_file )
+
+    test_log_folder = os.path.join( log_folder, os.path.basename( result['build-folder'] ) )
+    logs = _zip_folder( test_log_folder )
+    shutil.rmtree( test_log_folder, ignore_errors=True )
+    return ( report, logs )
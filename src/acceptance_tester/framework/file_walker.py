@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""
+:mod:`acceptance_tester.framework.file_walker` -- Finds candidate testsuite files
+================================================================================
+
+===========
+File Walker
+===========
+
+This module contains the class :class:`FileFilter`, which walks the
+test folders and returns the files that may be testsuite files.
+
+Files are included if their name matches one of the include patterns,
+which by default is ``*.xml``, and none of the exclude patterns.
+Folders matching an exclude pattern are pruned, so no file below them
+is opened or even listed. Hidden folders are always pruned.
+
+Patterns are shell style globs. A pattern without a slash matches the
+name of a file or folder at any depth, while a pattern with a slash
+matches the path relative to the test folder. A pattern ending in a
+slash only matches folders, e.g. ``data/``.
+
+A test folder may hold an ignore file, named by :data:`IGNORE_FILE`,
+with an exclude pattern on each line. Empty lines and lines starting
+with # are skipped.
+"""
+import fnmatch
+import logging
+import os
+
+
+class NullHandler( logging.Handler ):
+    """
+    Nullhandler for logging.
+    """
+
+    def emit( self, record ):
+        pass
+
+### define logger
+logger = logging.getLogger( "dbc."+__name__ )
+logger.addHandler( NullHandler() )
+
+IGNORE_FILE = ".acceptance-tester-ignore"
+
+DEFAULT_INCLUDE = [ "*.xml" ]
+
+
+def read_ignore_file( folder ):
+    """
+    Returns the exclude patterns in the ignore file of folder, or an
+    empty list if there is no ignore file.
+
+    :param folder:
+        The test folder.
+    :type folder:
+        string
+    """
+    path = os.path.join( folder, IGNORE_FILE )
+    if not os.path.isfile( path ):
+        return []
+    fh = open( path )
+    lines = [ x.strip() for x in fh.readlines() ]
+    fh.close()
+    return [ x for x in lines if x != "" and not x.startswith( "#" ) ]
+
+
+def _matches( patterns, relative, is_folder ):
+    """ Returns True if the path relative to the test folder matches one of patterns. """
+    name = relative.rsplit( "/", 1 )[-1]
+    for pattern in patterns:
+        if pattern.endswith( "/" ):
+            if not is_folder:
+                continue
+            pattern = pattern.rstrip( "/" )
+        if "/" in pattern:
+            if fnmatch.fnmatchcase( relative, pattern.lstrip( "/" ) ):
+                return True
+        elif fnmatch.fnmatchcase( name, pattern ):
+            return True
+    return False
+
+
+class FileFilter( object ):
+    """
+    Include and exclude patterns for the files found in test folders.
+    """
+
+    def __init__( self, include=(), exclude=() ):
+        """
+        Initializes the filter.
+
+        :param include:
+            Patterns of files to include. If empty, files ending in
+            .xml are included.
+        :type include:
+            list of strings
+        :param exclude:
+            Patterns of files and folders to exclude.
+        :type exclude:
+            list of strings
+        """
+        self.include = list( include ) or list( DEFAULT_INCLUDE )
+        self.exclude = list( exclude )
+
+    def includes( self, relative, exclude=None ):
+        """
+        Returns True if the file at the path relative to its test
+        folder is included.
+
+        :param exclude:
+            The exclude patterns to use, by default those of the filter.
+        :type exclude:
+            list of strings
+        """
+        if exclude == None:
+            exclude = self.exclude
+        return _matches( self.include, relative, False ) and not _matches( exclude, relative, False )
+
+    def walk( self, path ):
+        """
+        Returns the absolute paths of the included files at or below
+        path, in the order of a top down walk with sorted folders.
+        Excluded and hidden folders are not entered.
+
+        :param path:
+            A test folder, or a single file.
+        :type path:
+            string
+        """
+        path = os.path.abspath( path )
+        if os.path.isfile( path ):
+            if self.includes( os.path.basename( path ) ):
+                return [ path ]
+            return []
+        if not os.path.isdir( path ):
+            return []
+
+        exclude = self.exclude + read_ignore_file( path )
+        found = []
+        pending = [ ( path, "" ) ]
+        while len( pending ) > 0:
+            folder, relative = pending.pop()
+            try:
+                entries = sorted( os.scandir( folder ), key=lambda x: x.name )
+            except OSError as err:
+                logger.warning( "Could not read folder '%s': %s"%( folder, err ) )
+                continue
+
+            folders = []
+            for entry in entries:
+                entry_relative = relative + entry.name
+                ### like os.walk, symbolic links to folders are not followed
+                if entry.is_dir( follow_symlinks=False ):
+                    if not entry.name.startswith( "." ) and not _matches( exclude, entry_relative, True ):
+                        folders.append( ( entry.path, entry_relative + "/" ) )
+                elif entry.is_file() and self.includes( entry_relative, exclude ):
+                    found.append( entry.path )
+            pending += reversed( folders )
+        return found
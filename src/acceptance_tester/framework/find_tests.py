@@ -10,20 +10,25 @@ Find tests
 ==========
 
 This module provides functionality for finding and validating
-acceptance testsuites. The main function of this module is
-find_valid_tests.
+acceptance testsuites. The main functions of this module are
+find_valid_tests, which finds tests of a single test type, and
+find_typed_tests, which finds tests of several test types.
 
 Baseclass for retrieving documentation fields for test-reports.
 
 The return type for get_fields must be upheld.
 """
+import functools
 import logging
+import multiprocessing
 import os
 import pkg_resources
 from lxml import etree
 from nose.tools import nottest
 
+from . import file_walker
 from . import validate_testsuite
+from . import xml_slice
 from acceptance_tester.supported_test_types import TYPES as TYPES
 import acceptance_tester.framework.load_testrunner
 
@@ -39,68 +44,184 @@ logger = logging.getLogger( "dbc."+__name__ )
 
 logger.addHandler( NullHandler() )
 
+### files are validated against the xsd of their test type in a process
+### pool when there are at least this many
+POOL_THRESHOLD = 16
+
+### compiled schemas of this process, by package path
+_schemas = {}
+
 
 @nottest
-def find_valid_tests( test_folders, testrunner_config ):
+def find_valid_tests( test_folders, testrunner_config, index=None, file_filter=None ):
     """
     Find all valid tests in test_folder, and returns a tuple with
     three entrys: test type, test type name, and a list of tests.
+    All testsuites must be of the same test type.
 
     :param test_folder:
         Folder containing testsuite files
     :type test_folder:
         string
+    :param index:
+        If given, files that are unchanged since they were recorded in
+        the index are not parsed, and the index is updated and saved
+        with the files that were parsed.
+    :type index:
+        :class:`acceptance_tester.framework.discovery_index.DiscoveryIndex`
+    :param file_filter:
+        Selects the files in test_folders that may be testsuite files,
+        by default all xml files outside hidden folders.
+    :type file_filter:
+        :class:`acceptance_tester.framework.file_walker.FileFilter`
 
     :returns:
         tuple with with test_type, test_type_name, and a list of tests.
     """
+    found = find_typed_tests( test_folders, testrunner_config, index, file_filter )
+    if len( found ) == 0:
+        return (None, None, None )
+
+    if len( found ) > 1:
+        err_msg = "Found multiple test types in tests"
+        logger.error( err_msg )
+        raise RuntimeError( err_msg )
+    return found[0]
+
+
+@nottest
+def find_typed_tests( test_folders, testrunner_config, index=None, file_filter=None ):
+    """
+    Find all valid tests in test_folders, which may be of several test
+    types, and returns a list with a tuple for each test type, as
+    returned by :func:`find_valid_tests`, ordered by test type name.
+    The list is empty if no testsuites are found.
+
+    :param test_folder:
+        Folder containing testsuite files
+    :type test_folder:
+        string
+    :param index:
+        If given, files that are unchanged since they were recorded in
+        the index are not parsed, see :func:`find_valid_tests`.
+    :type index:
+        :class:`acceptance_tester.framework.discovery_index.DiscoveryIndex`
+    :param file_filter:
+        Selects the candidate files, see :func:`find_valid_tests`.
+    :type file_filter:
+        :class:`acceptance_tester.framework.file_walker.FileFilter`
+    """
+    if index != None:
+        return _find_indexed_tests( test_folders, testrunner_config, index, file_filter )
+
     # ### Find valid test suites
     test_suites = []
 
     for folder in test_folders:
-        test_suites += _find_testsuites( folder )
-
-    #test_suites = _find_testsuites( test_folder )
-    if len( test_suites ) == 0:
-        return (None, None, None )
-
-    test_type_name, test_type = _get_test_type( [x[1] for x in test_suites], testrunner_config )
+        test_suites += _find_testsuites( folder, file_filter )
 
-    if not 'test-runner' in test_type:
-        err_msg = "Type '%s' is missing a 'test-runner' entry."%test_type_name
-        logger.error( err_msg )
-        raise RuntimeError( err_msg )
+    found = []
+    for test_type_name in _type_names( [x[1].getroot().get( "type" ) for x in test_suites] ):
+        typed_suites = [ x for x in test_suites if x[1].getroot().get( "type" ) == test_type_name ]
+        test_type_name, test_type = _get_test_type( test_type_name, testrunner_config )
 
-    if 'xsd' in test_type:
-        test_suites = _filter_non_valid_suites( test_suites, test_type )
+        if test_type.get( 'xsd' ) != None:
+            typed_suites = _filter_non_valid_suites( typed_suites, test_type )
 
-    retrieved_tests = _get_tests( test_suites )
-    return ( test_type, test_type_name, retrieved_tests )
+        found.append( ( test_type, test_type_name, _get_tests( typed_suites ) ) )
+    return found
 
 
-@nottest
-def _find_testsuites( path ):
+def _find_indexed_tests( test_folders, testrunner_config, index, file_filter=None ):
     """
-    Find all testsuites files recursively in path.
-    A testsuite file is defined as a xml file that can be
-    validated against the testsuite xsd.
+    Finds all valid tests in test_folders like :func:`find_typed_tests`,
+    parsing only the files that changed since they were recorded in
+    index.
     """
     xml_files = []
-    if os.path.isfile( path ) and path.endswith( '.xml' ) :
-        xml_files.append( os.path.abspath( path ) )
-    for root, dirs, files in os.walk( path ):
-        for dir in dirs:
-            if dir.startswith( '.' ):
-                dirs.remove( dir )
-        for f in [x for x in files if x.endswith( '.xml' )]:
-            xml_files.append( os.path.abspath( os.path.join( root, f ) ) )
+    for folder in test_folders:
+        xml_files += _find_xml_files( folder, file_filter )
+
+    entries = dict( [ ( x, index.lookup( x ) ) for x in xml_files ] )
+    changed = [ x for x in xml_files if entries[x] == None ]
+    extracted = dict()
+    logger.debug( "Parsing %s of %s xml files changed since they were indexed"%( len( changed ), len( xml_files ) ) )
+    if len( changed ) > 0:
+        stats = dict( [ ( x, os.stat( x ) ) for x in changed ] )
+        parsed = dict( _parse_testsuites( changed ) )
+        for xml_file in changed:
+            entries[xml_file] = { 'type': None }
+            extracted[xml_file] = []
+            if xml_file in parsed:
+                entries[xml_file]['type'] = parsed[xml_file].getroot().get( "type" )
+                extracted[xml_file] = _get_suite_tests( ( xml_file, parsed[xml_file] ) )
+            index.record( xml_file, stats[xml_file], entries[xml_file]['type'], extracted[xml_file] )
+    test_suites = [ x for x in xml_files if entries[x]['type'] != None ]
+
+    try:
+        typed_suites = []
+        for test_type_name in _type_names( [entries[x]['type'] for x in test_suites] ):
+            suites = [ x for x in test_suites if entries[x]['type'] == test_type_name ]
+            test_type_name, test_type = _get_test_type( test_type_name, testrunner_config )
+
+            if test_type.get( 'xsd' ) != None:
+                suites = [ x[0] for x in _filter_non_valid_suites( [ ( x, None ) for x in suites ], test_type, index ) ]
+            typed_suites.append( ( test_type, test_type_name, suites ) )
+    finally:
+        index.save()
+
+    found = []
+    for test_type, test_type_name, suites in typed_suites:
+        retrieved_tests = []
+        for suite in suites:
+            if suite in extracted:
+                retrieved_tests += extracted[suite]
+            else:
+                retrieved_tests += index.tests( suite )
+        if len( retrieved_tests ) < 1:
+            err_msg = "Found no tests in testsuite files '%s'"%suites
+            logger.error( err_msg )
+            raise RuntimeError( err_msg )
+        found.append( ( test_type, test_type_name, retrieved_tests ) )
+    return found
+
+
+def _find_xml_files( path, file_filter=None ):
+    """
+    Find all files recursively in path that are selected by
+    file_filter, by default all xml files outside hidden folders.
+    """
+    if file_filter == None:
+        file_filter = file_walker.FileFilter()
+    return file_filter.walk( path )
 
+
+def _parse_testsuites( xml_files ):
+    """
+    Returns a list of tuples with the path and the parsed xml of the
+    valid testsuite files in xml_files.
+
+    The files are parsed in this process, since parsed xml cannot be
+    sent between processes. Files without a testsuite root node are
+    skipped after reading their first bytes.
+    """
     test_suites = []
     for xml_file in xml_files:
         xml = validate_testsuite.validate_testsuite_file( xml_file )
 
         if xml:
             test_suites.append( ( xml_file, xml ) )
+    return test_suites
+
+
+@nottest
+def _find_testsuites( path, file_filter=None ):
+    """
+    Find all testsuites files recursively in path.
+    A testsuite file is defined as a xml file that can be
+    validated against the testsuite xsd.
+    """
+    test_suites = _parse_testsuites( _find_xml_files( path, file_filter ) )
 
     if len( test_suites ) < 1:
         err_msg = "Found no testsuite files in path '%s'"%path
@@ -113,37 +234,83 @@ def _find_testsuites( path ):
     return test_suites
 
 
+def _use_pool( xml_files ):
+    """ Returns True if xml_files are many enough to be handled in a process pool. """
+    return len( xml_files ) >= POOL_THRESHOLD and not multiprocessing.current_process().daemon
+
+
+def _pool_map( func, xml_files ):
+    """ Returns the results of func for each of xml_files, computed in a process pool. """
+    processes = min( os.cpu_count() or 1, len( xml_files ) // POOL_THRESHOLD + 1 )
+    pool = multiprocessing.Pool( processes )
+    try:
+        return pool.map( func, xml_files, chunksize=POOL_THRESHOLD // 2 )
+    finally:
+        pool.close()
+        pool.join()
+
+
 @nottest
-def _get_test_type( test_suites, testrunner_config ):
-    """ Returns the test type of the test suites
+def _type_names( type_names ):
+    """ Returns the distinct type attributes of the root nodes of test suites, in sorted order
     """
-    types = set()
-    for suite in test_suites:
-        root = suite.getroot()
-        types.add( root.get( "type" ) )
+    return sorted( set( type_names ) )
 
-    if len( types ) > 1:
-        err_msg = "Found multiple test types in tests"
+
+def _get_test_type( type_name, testrunner_config ):
+    """ Returns a tuple with the name and the loaded test type, given the type attribute of the root node of test suites
+    """
+    if not type_name in TYPES:
+        err_msg = "Unknown test type '%s'"%type_name
         logger.error( err_msg )
         raise RuntimeError( err_msg )
 
-    type_name = types.pop()
-    return ( type_name, acceptance_tester.framework.load_testrunner.load_testrunner( TYPES[type_name], testrunner_config ) )
-
+    test_type = acceptance_tester.framework.load_testrunner.load_testrunner( TYPES[type_name], testrunner_config )
+    if not 'test-runner' in test_type:
+        err_msg = "Type '%s' is missing a 'test-runner' entry."%type_name
+        logger.error( err_msg )
+        raise RuntimeError( err_msg )
+    return ( type_name, test_type )
 
-def _filter_non_valid_suites( test_suites, test_type ):
-    """ Filters tests that does not validate against the test_type xsd """
-    test_type_schema = _get_schema( test_type['xsd'] )
 
-    def _validate( schema, test_suite ):
-        result = schema.validate( test_suite[1] )
+def _filter_non_valid_suites( test_suites, test_type, index=None ):
+    """
+    Filters tests that does not validate against the test_type xsd.
 
-        if not result:
+    Test suites are given as tuples with the path and the parsed xml,
+    which may be None if the file is not parsed. If an index is given,
+    the results recorded for unchanged files are used, and new results
+    are recorded. Many files are validated in a process pool.
+    """
+    xsd = test_type['xsd']
+    ### compiled before the pool is forked, so the workers share it
+    _get_schema( xsd )
+    key = _schema_key( xsd )
+
+    results = dict()
+    unknown = []
+    for test_suite in test_suites:
+        entry = None
+        if index != None:
+            entry = index.lookup( test_suite[0] )
+        if entry != None and key in entry.get( 'schemas', {} ):
+            results[test_suite[0]] = entry['schemas'][key]
+        else:
+            unknown.append( test_suite )
+
+    if _use_pool( unknown ):
+        validated = _pool_map( functools.partial( _validate_schema, xsd ), [ x[0] for x in unknown ] )
+    else:
+        validated = [ _validate_schema( xsd, x[0], x[1] ) for x in unknown ]
+    for test_suite, result in zip( unknown, validated ):
+        results[test_suite[0]] = result
+        if index != None:
+            index.record_schema( test_suite[0], key, result )
+
+    for test_suite in test_suites:
+        if not results[test_suite[0]]:
             logger.info( "Could not validate testsuite file '%s'"%test_suite[0] )
-            return False
-        return True
-
-    test_suites = [x for x in test_suites if _validate( test_type_schema, x )]
+    test_suites = [x for x in test_suites if results[x[0]]]
 
     if len( test_suites ) < 1:
         err_msg = "Found no valid testsuite files in path"
@@ -152,12 +319,32 @@ def _filter_non_valid_suites( test_suites, test_type ):
     return test_suites
 
 
-def _get_schema( self, package_path ):
+def _validate_schema( package_path, xml_file, xml=None ):
+    """ Returns True if xml_file validates against the schema at package_path. """
+    if xml == None:
+        xml = validate_testsuite.validate_testsuite_file( xml_file )
+        if xml == None:
+            return False
+    return _get_schema( package_path ).validate( xml )
+
+
+def _schema_key( package_path ):
+    """ Returns the key of validation results against a schema, which changes when the schema file changes. """
+    path = pkg_resources.resource_filename( 'acceptance_tester', package_path )
+    return "%s@%s"%( package_path, os.stat( path ).st_mtime_ns )
+
+
+def _get_schema( package_path ):
     """
     Returns schema file using pkg_resources. This works when the
     code called in the source tree, and when it is packaged in an
     egg file.
+
+    Each schema is compiled once in a process.
     """
+    if package_path in _schemas:
+        return _schemas[package_path]
+
     if not pkg_resources.resource_exists( 'acceptance_tester', package_path ):
         err_msg = "Could not find xsd file at package path '%s'"%package_path
         logger.error( err_msg )
@@ -165,69 +352,114 @@ def _get_schema( self, package_path ):
 
     path = pkg_resources.resource_filename( 'acceptance_tester', package_path )
     schema = etree.XMLSchema( etree.parse( path ) )
+    _schemas[package_path] = schema
     return schema
 
 
 @nottest
 def _get_tests( test_suites ):
-    """ isolates all test nodes and wraps them with a 'wrapping' node with the tests setup node. """
+    """
+    isolates all test nodes and wraps them with a 'wrapping' node with the tests setup node.
+
+    Each test is returned as a tuple with the testsuite path, the test
+    name, the wrapped xml, the documentation of the test, the
+    attributes of the testsuite node, and the attributes of the test
+    node.
+    """
+    tests = []
+    for suite in test_suites:
+        tests += _get_suite_tests( suite )
+
+    if len( tests ) < 1:
+        err_msg = "Found no tests in testsuite files '%s'"%[x[0] for x in test_suites]
+        logger.error( err_msg )
+        raise RuntimeError( err_msg )
+    return tests
+
 
+@nottest
+def test_documentation( test_node ):
+    """
+    Returns the documentation of a test, a dictionary with the text of
+    the description, given, when and then nodes of the test node by
+    node name.
+
+    :param test_node:
+        The test node.
+    :type test_node:
+        lxml.etree.Element
+    """
     namespace = "{info:testsuite#}"
     doc_names = ["description", "given", "then", "when"]
     doc_names = [namespace + x for x in doc_names]
+    doc = {}
+    for node in test_node:
+        if node.tag in doc_names:
+            text = " ".join( [x.strip() for x in [x for x in node.text.split( "\n" ) if x != '']] )
+            doc[node.tag[len(namespace):]] = text
+    return doc
+
+
+@nottest
+def _get_suite_tests( suite ):
+    """
+    Returns the tests of a single testsuite, see :func:`_get_tests`.
+
+    The wrapped xml of a test is an
+    :class:`acceptance_tester.framework.xml_slice.XmlSlice`, which
+    refers to the setup and test nodes in the testsuite file, or a
+    string if the file cannot be sliced.
+    """
+
+    namespace = "{info:testsuite#}"
     tests = []
 
     ### These characters cannot be present in the name, as this
     ### value is used as xml node names and file paths
     banned_chars = [ '/', '.', '*', '@', ':', '(', ')', '[', ']', '+', ','  ]
 
-    for suite in test_suites:
-        root = suite[1].getroot()
-        nodes = [x for x in root if x.tag != etree.Comment]
-        test_nodes = [x for x in nodes if x.tag == "%stest"%namespace]
+    root = suite[1].getroot()
+    nodes = [x for x in root if x.tag != etree.Comment]
+    test_nodes = [x for x in nodes if x.tag == "%stest"%namespace]
 
-        #setup_node = filter( lambda x: x.tag == "%ssetup"%namespace, nodes )[0]
-        #setup_str = etree.tostring( setup_nodes, pretty_print=True, encoding="unicode" )
+    #setup_node = filter( lambda x: x.tag == "%ssetup"%namespace, nodes )[0]
+    #setup_str = etree.tostring( setup_nodes, pretty_print=True, encoding="unicode" )
 
-        setup_nodes = [x for x in nodes if x.tag == "%ssetup"%namespace]
+    setup_nodes = [x for x in nodes if x.tag == "%ssetup"%namespace]
 
-        setup_str = None
-        if len( setup_nodes ) > 0:
+    slices = xml_slice.slice_suite( suite[0], suite[1] )
+    setup_str = None
+    if len( setup_nodes ) > 0 and slices == None:
 
-            setup_str = etree.tostring( setup_nodes[0], pretty_print=True, encoding="unicode" )
+        setup_str = etree.tostring( setup_nodes[0], pretty_print=True, encoding="unicode" )
 
-        for test in test_nodes:
+    for position, test in enumerate( test_nodes ):
 
-            doc = {}
-            for node in test:
-                if node.tag in doc_names:
-                    text = " ".join( [x.strip() for x in [x for x in node.text.split( "\n" ) if x != '']] )
-                    doc[node.tag[len(namespace):]] = text
+        doc = test_documentation( test )
 
-            banned = None
-            for char in banned_chars:
-                if char in test.get( 'name' ):
-                    banned = char
-                    break
-            if banned != None:
+        banned = None
+        for char in banned_chars:
+            if char in test.get( 'name' ):
+                banned = char
+                break
+        if banned != None:
 
-                err_msg = "'%s' cannot be used in test names (%s), because this "%( str( banned ), test.get('name') ) + \
-                          "is also used as filenames/xml-nodes. Please rename test and try again."
-                logger.error( err_msg )
-                raise RuntimeError( err_msg )
+            err_msg = "'%s' cannot be used in test names (%s), because this "%( str( banned ), test.get('name') ) + \
+                      "is also used as filenames/xml-nodes. Please rename test and try again."
+            logger.error( err_msg )
+            raise RuntimeError( err_msg )
 
 
-            test_str = etree.tostring( test, pretty_print=True, encoding="unicode" )
+        if slices != None:
+            tests.append( ( suite[0], test.get( "name" ), slices[position], doc, dict( root.attrib ), dict( test.attrib ) ) )
+            continue
 
-            xml = "".join( [ "<wrapping name=\"%s\">" % test.get( "name" ), test_str, "</wrapping>" ] )
-            if setup_str:
-                xml = "".join( [ "<wrapping name=\"%s\">" % test.get( "name" ),
-                                 setup_str, test_str, "</wrapping>" ] )
+        test_str = etree.tostring( test, pretty_print=True, encoding="unicode" )
 
-            tests.append( ( suite[0], test.get( "name" ), xml, doc ) )
+        xml = "".join( [ "<wrapping name=\"%s\">" % test.get( "name" ), test_str, "</wrapping>" ] )
+        if setup_str:
+            xml = "".join( [ "<wrapping name=\"%s\">" % test.get( "name" ),
+                             setup_str, test_str, "</wrapping>" ] )
 
-    if len( tests ) < 1:
-        err_msg = "Found no tests in testsuite files '%s'"%[x[0] for x in test_suites]
-        logger.error( err_msg )
-        raise RuntimeError( err_msg )
+        tests.append( ( suite[0], test.get( "name" ), xml, doc, dict( root.attrib ), dict( test.attrib ) ) )
     return tests
@@ -13,10 +13,27 @@ This module contains the :func:`job` functions which is used to
 wrap each test. The wrapper provides timming and reporting of test
 run, and any errors thrown by the individual test is handled.
 
+When run in a process pool, :func:`init_worker` should be used as
+pool initializer. It loads the test types, the xml parser and colorama
+once per worker process, and keeps the tests in the worker, so each
+task only needs to carry the test id given to :func:`run_test_id`.
+The tests of a run may be of several test types, each with its own
+test runner and resource manager.
+
+With setup affinity, :func:`run_suite_ids` runs several tests from the
+same testsuite with a single test runner, so the setup of the
+testsuite is only run once.
+
+Test runners implementing
+:class:`acceptance_tester.abstract_testsuite_runner.async_test_runner.AsyncTestRunner`
+are run with :func:`async_job`. :func:`run_async_ids` runs a batch of
+such tests concurrently on one event loop in the worker.
+
 The test is executed with the
 :class:`acceptance_tester.abstract_testsuite_runner.test_runner` compliant
 class pointed to by the test type.
 """
+import asyncio
 import fcntl
 import threading
 import logging
@@ -24,7 +41,9 @@ import os
 import shutil
 import sys
 import time
+import types
 from datetime import datetime
+from datetime import timedelta
 from lxml import etree
 
 sys.path.insert( 0, os.path.split( os.path.dirname( os.path.realpath( sys.argv[0] ) ) )[0] )
@@ -33,6 +52,11 @@ sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.dirname( os.path.d
 from .aux import delta_str
 from .aux import datetime_str
 from .aux import format_description
+from .find_tests import test_documentation
+from .load_testrunner import load_testrunner
+from acceptance_tester.abstract_testsuite_runner.async_test_runner import AsyncTestRunner
+from . import setup_cache
+from . import xml_slice
 
 
 class NullHandler( logging.Handler ):
@@ -49,6 +73,9 @@ logger.addHandler( NullHandler() )
 
 stdout_lock = threading.Lock()
 
+### per process state, filled by init_worker
+_worker_state = {}
+
 
 def _sync_file_append( path, string ):
     """
@@ -115,7 +142,7 @@ def _make_folder( candidate_name ):
     return name
 
 
-def _generate_summary( filename, testname, testcase, delta ):
+def _generate_summary( filename, testname, testcase, delta, skip_message=None ):
     """
     Generates test summary for the result of the test.
 
@@ -135,6 +162,10 @@ def _generate_summary( filename, testname, testcase, delta ):
         running time of the test.
     :type delta:
         datetime.delta
+    :param skip_message:
+        If not None, the test was skipped for the reason given.
+    :type skip_message:
+        string
 
     :return:
         Tuple with two elements:
@@ -148,7 +179,12 @@ def _generate_summary( filename, testname, testcase, delta ):
     summary.append( "  testfile: '%s'"%filename)
     summary.append( "  testname: '%s'"%testname )
 
-    if len( testcase.errors ) > 0:
+    if skip_message != None:
+        summary.append( "  status: SKIPPED" )
+        summary += [""] + [ skip_message ] + [""]
+        status_msg = "Test '%s' status: SKIPPED."%testname
+        status = "SKIPPED"
+    elif len( testcase.errors ) > 0:
         summary.append( "  status: ERROR" )
         summary += [""] + testcase.errors + [""]
         status_msg = "Test '%s' status: ERROR."%testname
@@ -214,7 +250,277 @@ def _remove_build_folder( folder ):
         shutil.rmtree( folder )
 
 
-def job( test ):
+def init_worker( tests, testrunner_definition, testrunner_config, color, snapshot_cache=None ):
+    """
+    Initializes a worker process. Used as initializer for the process
+    pool.
+
+    :param tests:
+        The test dictionaries as returned by :func:`worker_test`. The
+        type is loaded in this worker.
+    :type tests:
+        list
+    :param testrunner_definition:
+        The definition of the test type, as found in
+        :data:`acceptance_tester.supported_test_types.TYPES`, or a
+        dictionary with the definitions of the test types of the
+        tests by type name.
+    :type testrunner_definition:
+        dict
+    :param testrunner_config:
+        file used to configure testrunner
+    :type testrunner_config:
+        string
+    :param color:
+        If true colorama is loaded for colorized output.
+    :type color:
+        boolean
+    :param snapshot_cache:
+        If given, a tuple with folder, maximum size and hardlinks flag
+        for the :class:`acceptance_tester.framework.setup_cache.SetupSnapshotCache`
+        used by the tests.
+    :type snapshot_cache:
+        tuple
+    """
+    _worker_state.clear()
+    _worker_state['tests'] = dict( [ ( test['id'], test ) for test in tests ] )
+    ### all tests of a test type share the same resource manager
+    _worker_state['resource-managers'] = dict( [ ( test['type-name'], test.get( 'resource-manager' ) ) for test in tests ] )
+    definitions = testrunner_definition
+    if 'test-runner' in testrunner_definition:
+        definitions = dict( [ ( test['type-name'], testrunner_definition ) for test in tests ] )
+        definitions.setdefault( None, testrunner_definition )
+    _worker_state['types'] = dict( [ ( name, load_testrunner( definition, testrunner_config ) )
+                                     for name, definition in definitions.items() ] )
+    _worker_state['tests-run'] = 0
+    if snapshot_cache != None:
+        _worker_state['setup-cache'] = setup_cache.SetupSnapshotCache( *snapshot_cache )
+    _get_parser()
+    if color:
+        _get_colorama()
+    logger.debug( "Initialized worker with %s tests"%len( tests ) )
+
+
+def worker_test( test ):
+    """
+    Returns the part of a test handed to the workers, see
+    :func:`init_worker`. The documentation is left out, since the
+    worker reads it from the xml of the test when the test is run, and
+    so is the type, which is loaded in the worker. The xml of a test in
+    a sliced testsuite file is an
+    :class:`acceptance_tester.framework.xml_slice.XmlSlice`, which is
+    only read when the test is run.
+
+    :param test:
+        The test dictionary, see :func:`job`.
+    :type test:
+        dict
+    """
+    return dict( [ x for x in test.items() if not x[0] in [ 'documentation', 'type' ] ] )
+
+
+def _worker_test( test_id ):
+    """ Returns a copy of the test with test_id, with the type loaded in this worker. """
+    test = dict( _worker_state['tests'][test_id] )
+    types = _worker_state['types']
+    test['type'] = types.get( test['type-name'], types.get( None ) )
+    return test
+
+
+def _is_async( test ):
+    """ Returns True if the test runner of a test is an asyncio test runner. """
+    runner = test['type']['test-runner']
+    return isinstance( runner, type ) and issubclass( runner, AsyncTestRunner )
+
+
+def run_test_id( test_id ):
+    """
+    Runs the test with test_id in a worker initialized with
+    :func:`init_worker`.
+
+    :param test_id:
+        The id of the test to run.
+    :type test_id:
+        int
+    :return:
+        The result of :func:`job`.
+    """
+    test = _worker_test( test_id )
+    _worker_state['tests-run'] += 1
+    return job( test )
+
+
+def run_with_tests( tests, func, task ):
+    """
+    Adds tests to the tests known by a worker initialized with
+    :func:`init_worker`, and runs task with func. Used for tests found
+    after the worker was started, such as tests changed while watching.
+
+    :param tests:
+        The test dictionaries as returned by :func:`worker_test`,
+        without the resource manager, which is taken from this worker.
+    :type tests:
+        list
+    :param func:
+        The function running the task, such as :func:`run_test_id`.
+    :type func:
+        callable
+    :param task:
+        The task given to func.
+    :return:
+        The result of func.
+    """
+    for test in tests:
+        test = dict( test )
+        test['resource-manager'] = _worker_state['resource-managers'].get( test['type-name'] )
+        _worker_state['tests'][test['id']] = test
+    return func( task )
+
+
+def run_suite_ids( test_ids ):
+    """
+    Runs tests from a single testsuite in a worker initialized with
+    :func:`init_worker`, using the same test runner for all of them.
+
+    The setup of the testsuite is run by the first test, and its
+    shutdown hooks are run when the last test is done.
+
+    :param test_ids:
+        The ids of the tests to run.
+    :type test_ids:
+        list
+    :return:
+        List with the result of each test.
+    """
+    testcase_runner = None
+    results = []
+    created = []
+    clean = False
+    for position, test_id in enumerate( test_ids ):
+        test = _worker_test( test_id )
+        if testcase_runner == None:
+            testcase_runner = test['type']['test-runner']( test['test-suite'], test['id'], test['log-folder'] )
+            testcase_runner.keep_setup = True
+
+        ### The setup may have placed files in the build folder of the
+        ### first test, so build folders are kept until the setup is shut down
+        clean = not 'no_clean' in test or not test['no_clean']
+        test['no_clean'] = True
+
+        ### a test that could not be read reports the candidate name of
+        ### its build folder, which may be the folder of another test
+        candidate = test['build-folder']
+        taken = os.path.exists( candidate )
+
+        _worker_state['tests-run'] += 1
+        result = job( test, testcase_runner, position == len( test_ids ) - 1 )
+        results.append( result )
+        if os.path.exists( result['build-folder'] ) and ( result['build-folder'] != candidate or not taken ):
+            created.append( result['build-folder'] )
+
+    if clean:
+        for folder in created:
+            _remove_build_folder( folder )
+    return results
+
+
+def run_async_ids( test_ids, concurrency ):
+    """
+    Runs tests with an asyncio test runner concurrently on one event
+    loop, in a worker initialized with :func:`init_worker`.
+
+    :param test_ids:
+        The ids of the tests to run.
+    :type test_ids:
+        list
+    :param concurrency:
+        The maximum number of tests running at the same time.
+    :type concurrency:
+        int
+    :return:
+        List with the result of each test.
+    """
+    async def _run_all():
+        semaphore = asyncio.Semaphore( concurrency )
+
+        async def _run( test_id ):
+            async with semaphore:
+                test = _worker_test( test_id )
+                _worker_state['tests-run'] += 1
+                return await async_job( test )
+
+        return await asyncio.gather( *[ _run( x ) for x in test_ids ] )
+
+    return list( asyncio.run( _run_all() ) )
+
+
+def run_task( task, concurrency ):
+    """
+    Runs a task in a worker initialized with :func:`init_worker`. Used
+    when the tests of a run are of several test types, so the tasks
+    given to the pool differ.
+
+    :param task:
+        A test id, which is run with :func:`run_test_id`, or a list of
+        test ids of the same test type. A list of tests with an asyncio
+        test runner is run with :func:`run_async_ids`, other lists with
+        :func:`run_suite_ids`.
+    :param concurrency:
+        The maximum number of async tests running at the same time.
+    :type concurrency:
+        int
+    :return:
+        The result of the function running the task.
+    """
+    if not isinstance( task, list ):
+        return run_test_id( task )
+    if len( task ) > 0 and _is_async( _worker_test( task[0] ) ):
+        return run_async_ids( task, concurrency )
+    return run_suite_ids( task )
+
+
+def _get_parser():
+    """ Returns the xml parser of this process. """
+    if not 'parser' in _worker_state:
+        _worker_state['parser'] = etree.XMLParser( remove_blank_text=True, encoding="UTF-8" )
+    return _worker_state['parser']
+
+
+def _get_colorama():
+    """ Returns the colorama module, or None if it could not be loaded. """
+    if not 'colorama' in _worker_state:
+        try:
+            import colorama
+        except ImportError:
+            logger.error( "Could not load colorama module. Colorized output disabled" )
+            colorama = None
+        _worker_state['colorama'] = colorama
+    return _worker_state['colorama']
+
+
+def _use_setup_cache( cache, test, xml, testcase_runner ):
+    """
+    Populates the build folder of the test from a setup snapshot if one
+    exists. Otherwise the test runner is told how to store a snapshot,
+    once the setup has run.
+    """
+    setup_nodes = xml.xpath( '/wrapping/ts:setup', namespaces={ 'ts': 'info:testsuite#' } )
+    if len( setup_nodes ) == 0:
+        return
+
+    key = setup_cache.setup_key( setup_nodes[0], test['type-name'], os.path.dirname( test['test-suite'] ), cache.fingerprint )
+    build_folder = test['build-folder']
+    try:
+        testcase_runner.setup_restored = cache.restore( key, build_folder )
+    except Exception as err:
+        logger.warning( "Could not restore setup snapshot: %s"%err )
+        testcase_runner.setup_restored = False
+
+    if not testcase_runner.setup_restored:
+        testcase_runner.setup_snapshot = lambda: cache.store( key, build_folder )
+
+
+def job( test, testcase_runner=None, release_setup=True ):
     """
     Wraps a testcase run.
 
@@ -265,11 +571,22 @@ def job( test ):
         #. **xml**
 
            The test xml as a string (etree.lxml.Element is not
-           picklable).
+           picklable), or an
+           :class:`acceptance_tester.framework.xml_slice.XmlSlice`
+           read by the worker.
 
     :type test:
         dict
-
+    :param testcase_runner:
+        Test runner to reuse from an earlier test in the same
+        testsuite. If None a new test runner is created.
+    :type testcase_runner:
+        :class:`acceptance_tester.abstract_testsuite_runner.test_runner.TestRunner`
+    :param release_setup:
+        If the reused test runner keeps its setup, the setup is shut
+        down after this test if release_setup is true.
+    :type release_setup:
+        boolean
 
     :return:
 
@@ -310,40 +627,139 @@ def job( test ):
     :rtype:
        dict
     """
+    try:
+        xml = _read_xml( test )
+    except ( IOError, RuntimeError ) as err:
+        ### the setup kept for the tests of the testsuite is shut down with the last of them
+        if testcase_runner != None and testcase_runner.keep_setup and release_setup:
+            try:
+                testcase_runner.shutdown_setup()
+            except Exception as shutdown_err:
+                logger.error( "Could not shut down the setup of '%s': %s"%( test['test-suite'], shutdown_err ) )
+        return error_result( test, str( err ), timedelta() )
+
+    run = _start_job( test, testcase_runner, xml )
+    testcase_runner = run['runner']
+
+    ### run test
+
+    try:
+        testcase_runner.run_test( run['xml'],
+                                  test['build-folder'],
+                                  test['resource-manager']  )
+    except Exception as err:
+        _append_traceback( testcase_runner, err )
+
+    if testcase_runner.keep_setup and release_setup:
+        try:
+            testcase_runner.shutdown_setup()
+        except Exception as err:
+            _append_traceback( testcase_runner, err )
+
+    return _finish_job( test, run )
+
+
+async def async_job( test ):
+    """
+    Wraps a testcase run with an asyncio test runner. The test
+    dictionary and the returned result are the same as for :func:`job`.
+
+    :param test:
+        The test to run, see :func:`job`.
+    :type test:
+        dict
+    :return:
+        The result of the test, see :func:`job`.
+    :rtype:
+       dict
+    """
+    try:
+        xml = _read_xml( test )
+    except ( IOError, RuntimeError ) as err:
+        return error_result( test, str( err ), timedelta() )
+
+    run = _start_job( test, None, xml )
+    testcase_runner = run['runner']
+
+    ### run test
+
+    try:
+        await testcase_runner.run_test( run['xml'],
+                                        test['build-folder'],
+                                        test['resource-manager'] )
+    except Exception as err:
+        _append_traceback( testcase_runner, err )
+
+    return _finish_job( test, run )
+
+
+def _append_traceback( testcase_runner, err ):
+    """ Adds the traceback of the exception being handled to the errors of the test. """
+    exc_info = sys.exc_info()
+    tb = _format_traceback( exc_info, err )
+    testcase_runner.errors.append( tb )
+    logger.error( tb )
+
+
+def _read_xml( test ):
+    """
+    Returns the parsed wrapped xml of a test.
+
+    :raise RuntimeError:
+        If the testsuite file of a sliced test changed since the test
+        was found.
+    :raise IOError:
+        If the testsuite file cannot be read.
+    """
+    return etree.fromstring( xml_slice.wrapped_xml( test['xml'] ), _get_parser() )
+
+
+def _start_job( test, testcase_runner, xml ):
+    """
+    Prepares folders and test runner for a test with the parsed xml,
+    and writes the start of the test to stdout.
+
+    :return:
+        Dictionary with the state of the running test, used by
+        :func:`_finish_job`.
+    """
     color = test['color']
+    colorama = None
     if color:
-        try:
-            import colorama
-        except ImportError:
-            logger.error( "Could not load colorama module. Colorized output disabled" )
-            color = False
+        colorama = _get_colorama()
+        color = colorama != None
 
     # setup
     start = datetime.now()
-    test_output = []
     test['build-folder'] = _make_folder( test['build-folder'] )
     logfolder = os.path.join( test['log-folder'], os.path.split( test['build-folder'] )[-1] )
     if not os.path.exists( logfolder ):
         os.mkdir( logfolder )
-    parser = etree.XMLParser( remove_blank_text=True, encoding="UTF-8" )
-    xml = etree.fromstring( test['xml'], parser )
+    if not 'documentation' in test:
+        test['documentation'] = {}
+        test_node = xml.find( "{info:testsuite#}test" )
+        if test_node != None:
+            test['documentation'] = test_documentation( test_node )
 
     _sync_stdout_write( "Starting Test '%s'"%test['name'] )
 
     logger.info( "Starting Test '%s'."%test['name'] )
     logger.debug( "Initializing testcase runner" )
 
-    testcase_runner = test['type']['test-runner']( test['test-suite'], test['id'], logfolder )
+    if testcase_runner == None:
+        testcase_runner = test['type']['test-runner']( test['test-suite'], test['id'], logfolder )
+    else:
+        testcase_runner.prepare_test( test['id'], logfolder )
+
+    if 'setup-cache' in _worker_state and not testcase_runner.setup_done:
+        _use_setup_cache( _worker_state['setup-cache'], test, xml, testcase_runner )
 
     desc = ""
     if 'documentation' in test and 'description' in test['documentation']:
         try:
             desc = format_description( test['documentation']['description'] )
         except Exception as err:
-            exc_info = sys.exc_info()
-            tb = _format_traceback( exc_info, err )
-            testcase_runner.errors.append( tb )
-            logger.error( tb )
+            _append_traceback( testcase_runner, err )
 
     prec = postc = ""
     if color:
@@ -354,17 +770,28 @@ def job( test ):
     if desc:
         output += "%s\n"%desc
 
-    ### run test
+    return { 'start': start,
+             'xml': xml,
+             'runner': testcase_runner,
+             'output': output,
+             'color': color }
 
-    try:
-        testcase_runner.run_test( xml,
-                                  test['build-folder'],
-                                  test['resource-manager']  )
-    except Exception as err:
-        exc_info = sys.exc_info()
-        tb = _format_traceback( exc_info, err )
-        testcase_runner.errors.append( tb )
-        logger.error( tb )
+
+def _finish_job( test, run ):
+    """
+    Cleans up after a test has run, writes output and summary, and
+    returns the result of the test.
+
+    :param run:
+        The dictionary returned by :func:`_start_job`.
+    :type run:
+        dict
+    :return:
+        The result dictionary described in :func:`job`.
+    """
+    testcase_runner = run['runner']
+    output = run['output']
+    test_output = []
 
     if testcase_runner.errors:
         testcase_runner.errors.insert(0, "Testname : '%s'" % test['name'])
@@ -375,7 +802,7 @@ def job( test ):
         _remove_build_folder( test['build-folder'] )
 
     # write output and summary
-    delta = datetime.now() - start
+    delta = datetime.now() - run['start']
     test_output += [""] + testcase_runner.output
     ( status, status_msg, summary ) = _generate_summary( test['test-suite'], test['name'], testcase_runner, delta )
     test_output += summary + [""]
@@ -386,13 +813,13 @@ def job( test ):
     if test['verbose']:
         output += "\n".join( test_output )
 
-    if color:
+    if run['color']:
         output = colorize( output )
         summary = list(map( colorize, summary ))
 
     _sync_stdout_write( output )
 
-    xml_str = etree.tostring( xml, pretty_print=True, encoding="UTF-8" )
+    xml_str = etree.tostring( run['xml'], pretty_print=True, encoding="UTF-8" )
     #xml_str = xml_str.decode( 'UTF-8' )
     return { 'name': test['name'],
              'documentation': test['documentation'],
@@ -409,12 +836,120 @@ def job( test ):
              'xml': xml_str }
 
 
+def error_result( test, message, delta ):
+    """
+    Creates the result of a test that did not complete, such as a test
+    stopped by a timeout, and writes its summary to the report file.
+
+    :param test:
+        The test, see :func:`job`.
+    :type test:
+        dict
+    :param message:
+        Error message explaining why the test did not complete.
+    :type message:
+        string
+    :param delta:
+        The time the test ran before it was stopped.
+    :type delta:
+        datetime.timedelta
+    :return:
+        The result dictionary described in :func:`job`.
+    """
+    testcase = types.SimpleNamespace( errors=[ "Testname : '%s'"%test['name'], message ], failures=[] )
+    return _stopped_result( test, testcase, delta )
+
+
+def skipped_result( test, message, delta=None ):
+    """
+    Creates the result of a test that was cancelled, and writes its
+    summary to the report file. The status of the result is SKIPPED.
+
+    :param test:
+        The test, see :func:`job`.
+    :type test:
+        dict
+    :param message:
+        Message explaining why the test was skipped.
+    :type message:
+        string
+    :param delta:
+        The time the test ran before it was stopped, if it was started.
+    :type delta:
+        datetime.timedelta
+    :return:
+        The result dictionary described in :func:`job`.
+    """
+    if delta == None:
+        delta = timedelta()
+    testcase = types.SimpleNamespace( errors=[], failures=[] )
+    return _stopped_result( test, testcase, delta, message )
+
+
+def carried_result( test, delta, reason="unchanged since the last run" ):
+    """
+    Creates the result of a test that is not run, since it succeeded in
+    an earlier run, and writes its summary to the report file. The
+    result is marked with the key 'carried-over'.
+
+    :param test:
+        The test, see :func:`job`.
+    :type test:
+        dict
+    :param delta:
+        The time the test ran in the earlier run.
+    :type delta:
+        datetime.timedelta
+    :param reason:
+        Why the earlier result is used, shown with the status.
+    :type reason:
+        string
+    :return:
+        The result dictionary described in :func:`job`.
+    """
+    testcase = types.SimpleNamespace( errors=[], failures=[] )
+    result = _stopped_result( test, testcase, delta, status_note=reason )
+    result['carried-over'] = True
+    return result
+
+
+def _stopped_result( test, testcase, delta, skip_message=None, status_note=None ):
+    """ Creates the result of a test stopped, skipped or carried over by the framework. """
+    ( status, status_msg, summary ) = _generate_summary( test['test-suite'], test['name'], testcase, delta, skip_message )
+    if status_note != None:
+        status_msg = "%s (%s)."%( status_msg.rstrip( "." ), status_note )
+    _sync_file_append( test['report-file'], "\n".join( [""] + summary + [""] ) )
+    _sync_stdout_write( status_msg )
+
+    try:
+        xml = xml_slice.wrapped_xml( test['xml'] )
+    except ( IOError, RuntimeError ) as err:
+        logger.warning( "Could not read test '%s': %s"%( test['name'], err ) )
+        xml = "<wrapping name=\"%s\"/>"%test['name']
+    if isinstance( xml, str ):
+        xml = xml.encode( 'UTF-8' )
+    return { 'name': test['name'],
+             'documentation': test.get( 'documentation', {} ),
+             'test-suite': test['test-suite'],
+             'failures': testcase.failures,
+             'errors': testcase.errors,
+             'time': delta,
+             'id': test['id'],
+             'summary': summary,
+             'status-msg': status_msg,
+             'status': status,
+             'build-folder': test['build-folder'],
+             'type-name': test['type-name'],
+             'xml': xml }
+
+
 def colorize( string ):
 
-    import colorama
+    colorama = _get_colorama()
     patterns = { 'ERROR': [ colorama.Fore.RED+colorama.Style.BRIGHT, colorama.Fore.RESET+colorama.Style.RESET_ALL ],
                  'FAILED': [ colorama.Fore.YELLOW+colorama.Style.BRIGHT, colorama.Fore.RESET+colorama.Style.RESET_ALL ],
-                 'SUCCESS': [ colorama.Fore.GREEN+colorama.Style.BRIGHT, colorama.Fore.RESET+colorama.Style.RESET_ALL ] }
+                 'SUCCESS': [ colorama.Fore.GREEN+colorama.Style.BRIGHT, colorama.Fore.RESET+colorama.Style.RESET_ALL ],
+                'SKIPPED': [ colorama.Fore.CYAN+colorama.Style.BRIGHT, colorama.Fore.RESET+colorama.Style.RESET_ALL ] }
 
     for pattern, codes in patterns.items():
         string = string.replace( pattern, codes[0] + pattern + codes[1] )
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""
+:mod:`acceptance_tester.framework.manifest` -- Results of earlier runs
+======================================================================
+
+========
+Manifest
+========
+
+This module contains the class :class:`ResultManifest`, which keeps
+a hash of the wrapped xml of each test together with the result of the
+last run of the test.
+
+The manifest is used to rerun only the tests that changed since the
+last run, or that did not succeed. The wrapped xml contains both the
+test and the setup of its testsuite, so a change to either causes the
+test to be run again. The results of the other tests are carried over
+from the manifest.
+
+The manifest may be shared by several runs, such as the shards of a
+test run, so only the results recorded by a run are merged into the
+file holding it, under a file lock, see
+:func:`acceptance_tester.framework.state_file.update`.
+
+The class :class:`FlakinessHistory` counts, for each test, the runs in
+which the test failed and then succeeded when it was retried. The rate
+of such runs points out tests that fail intermittently.
+"""
+import hashlib
+import logging
+
+from . import state_file
+from .scheduler import history_key
+from .xml_slice import XmlSlice
+
+
+class NullHandler( logging.Handler ):
+    """
+    Nullhandler for logging.
+    """
+
+    def emit( self, record ):
+        pass
+
+### define logger
+logger = logging.getLogger( "dbc."+__name__ )
+logger.addHandler( NullHandler() )
+
+MANIFEST_VERSION = 1
+
+
+def xml_hash( xml ):
+    """
+    Returns the hash of the wrapped xml of a test.
+
+    :param xml:
+        The wrapped xml, as found by
+        :func:`acceptance_tester.framework.find_tests.find_valid_tests`.
+    :type xml:
+        string or :class:`acceptance_tester.framework.xml_slice.XmlSlice`
+    """
+    if isinstance( xml, XmlSlice ):
+        return xml.digest
+    if isinstance( xml, str ):
+        xml = xml.encode( 'UTF-8' )
+    return hashlib.sha1( xml ).hexdigest()
+
+
+class ResultManifest( object ):
+    """
+    Hashes and results of tests recorded in earlier runs.
+    """
+
+    def __init__( self, path=None ):
+        """
+        Initializes the manifest.
+
+        :param path:
+            Path to the file holding the manifest. If None the manifest
+            is neither read nor written.
+        :type path:
+            string
+        """
+        self.path = path
+        self.entries = {}
+        self.updates = {}
+        self._load()
+
+    def _load( self ):
+        content = state_file.read( self.path, MANIFEST_VERSION, "result manifest" )
+        if content != None:
+            self.entries = content['tests']
+
+    def save( self ):
+        """
+        Merges the results recorded by this run into the file holding
+        the manifest.
+        """
+        if self.path == None:
+            return
+
+        def _merge( content ):
+            entries = {}
+            if content != None:
+                entries = content['tests']
+            entries.update( self.updates )
+            return { 'tests': entries }
+
+        self.entries = state_file.update( self.path, MANIFEST_VERSION, "result manifest", _merge )['tests']
+        self.updates = {}
+
+    def previous( self, test ):
+        """
+        Returns the recorded result of a test, if the test succeeded in
+        the last run and its xml is unchanged. Otherwise None is
+        returned, and the test should be run.
+
+        :param test:
+            The test, see :func:`acceptance_tester.framework.job.job`.
+        :type test:
+            dict
+        """
+        entry = self.entries.get( history_key( test['test-suite'], test['name'] ) )
+        if entry == None or entry['hash'] != xml_hash( test['xml'] ) or entry['status'] != "SUCCESS":
+            return None
+        return entry
+
+    def record_results( self, results, tests_by_id ):
+        """
+        Records the results of a run, as returned by
+        :func:`acceptance_tester.framework.job.job`. Tests not in the
+        run, and tests whose results were carried over, keep their
+        recorded results.
+
+        :param results:
+            The results of the run.
+        :type results:
+            list
+        :param tests_by_id:
+            The tests of the run by id, holding the xml that is hashed.
+        :type tests_by_id:
+            dict
+        """
+        for result in results:
+            if result.get( 'carried-over' ):
+                continue
+            test = tests_by_id[result['id']]
+            self.updates[history_key( result['test-suite'], result['name'] )] = {
+                'hash': xml_hash( test['xml'] ),
+                'status': result['status'],
+                'time': result['time'].total_seconds() }
+        self.entries.update( self.updates )
+
+
+class FlakinessHistory( object ):
+    """
+    Number of runs of each test, and the number of runs in which it was flaky.
+    """
+
+    def __init__( self, path=None ):
+        """
+        Initializes the history.
+
+        :param path:
+            Path to the file holding the history. If None the history
+            is neither read nor written.
+        :type path:
+            string
+        """
+        self.path = path
+        self.entries = {}
+        self.counts = {}
+        self._load()
+
+    def _load( self ):
+        content = state_file.read( self.path, MANIFEST_VERSION, "flakiness history" )
+        if content != None:
+            self.entries = content['tests']
+
+    def save( self ):
+        """
+        Adds the runs counted by this run to the counts in the file
+        holding the history.
+        """
+        if self.path == None:
+            return
+
+        def _merge( content ):
+            entries = {}
+            if content != None:
+                entries = content['tests']
+            for key, counts in self.counts.items():
+                _count( entries, key, counts['runs'], counts['flaky'] )
+            return { 'tests': entries }
+
+        self.entries = state_file.update( self.path, MANIFEST_VERSION, "flakiness history", _merge )['tests']
+        self.counts = {}
+
+    def record_results( self, results ):
+        """
+        Records the results of a run with retries, as returned by
+        :func:`acceptance_tester.framework.job.job`. A result with the
+        key 'flaky' set failed before it succeeded. Skipped and carried
+        over results are not recorded.
+        """
+        for result in results:
+            if result['status'] == "SKIPPED" or result.get( 'carried-over' ):
+                continue
+            key = history_key( result['test-suite'], result['name'] )
+            flaky = 0
+            if result.get( 'flaky' ):
+                flaky = 1
+            for entries in [ self.entries, self.counts ]:
+                _count( entries, key, 1, flaky )
+
+    def rate( self, suite, name ):
+        """
+        Returns a tuple with the number of runs in which a test was
+        flaky, and the number of recorded runs of the test.
+        """
+        entry = self.entries.get( history_key( suite, name ), { 'runs': 0, 'flaky': 0 } )
+        return ( entry['flaky'], entry['runs'] )
+
+
+def _count( entries, key, runs, flaky ):
+    """ Adds runs and flaky runs to the counts of a test in entries. """
+    entry = entries.setdefault( key, { 'runs': 0, 'flaky': 0 } )
+    entry['runs'] += runs
+    entry['flaky'] += flaky
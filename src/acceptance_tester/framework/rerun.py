@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""
+:mod:`acceptance_tester.framework.rerun` -- Finds failed tests in earlier results
+=================================================================================
+
+=====
+Rerun
+=====
+
+This module reads the xUnit files written by
+:class:`acceptance_tester.framework.suite_tester.SuiteTester`, and
+finds the tests that failed or caused errors, so they can be run
+again.
+
+An xUnit file is named after the path of its testsuite file, with the
+folders separated by dots, and its testcases are named after the tests
+(see :func:`junit_test_name`). The function :func:`failed_tests` maps
+these names back to the testsuite files, and the names of the failed
+tests.
+"""
+import glob
+import logging
+import os
+import re
+from lxml import etree
+
+
+class NullHandler( logging.Handler ):
+    """
+    Nullhandler for logging.
+    """
+
+    def emit( self, record ):
+        pass
+
+### define logger
+logger = logging.getLogger( "dbc."+__name__ )
+logger.addHandler( NullHandler() )
+
+
+def junit_test_name( name ):
+    """
+    Returns the name of a test as used for testcases in xUnit files,
+    without the index prefix.
+
+    :param name:
+        The name of the test.
+    :type name:
+        string
+    """
+    return name.replace( ' ', '_' ).replace( '-', '_' ).replace( ',', '_' )
+
+
+def _resolve_suite( folder, parts ):
+    """
+    Returns the path of the testsuite file in folder named by parts,
+    which are the dot separated parts of an xUnit testsuite name. Parts
+    may belong to the same folder or file name, if the name contains
+    dots. None is returned if no file is found.
+    """
+    for count in range( 1, len( parts ) + 1 ):
+        name = ".".join( parts[:count] )
+        if count == len( parts ):
+            candidate = os.path.join( folder, name + ".xml" )
+            if os.path.isfile( candidate ):
+                return candidate
+        elif os.path.isdir( os.path.join( folder, name ) ):
+            found = _resolve_suite( os.path.join( folder, name ), parts[count:] )
+            if found != None:
+                return found
+    return None
+
+
+def failed_tests( test_results_folder ):
+    """
+    Finds the failed tests in the xUnit files of earlier runs.
+
+    :param test_results_folder:
+        The test result folder of the earlier runs, containing the
+        xUnit folder.
+    :type test_results_folder:
+        string
+    :return:
+        Dictionary with the paths of testsuite files as keys, and sets
+        of the names of failed tests, as returned by
+        :func:`junit_test_name`, as values. Tests of testsuite files
+        that no longer exist are left out.
+    """
+    failed = dict()
+    parser = etree.XMLParser( remove_blank_text=True, encoding="UTF-8" )
+    for filename in sorted( glob.glob( os.path.join( test_results_folder, "xUnit", "TEST-*.xml" ) ) ):
+        try:
+            xml = etree.parse( filename, parser )
+        except etree.XMLSyntaxError as err:
+            logger.warning( "Could not read xUnit file '%s': %s"%( filename, err ) )
+            continue
+        suite_name = xml.getroot().get( "name" )
+        names = set()
+        for testcase in xml.iter( 'testcase' ):
+            if len( testcase.findall( 'failure' ) + testcase.findall( 'error' ) ) > 0:
+                ### strip the index prefix
+                names.add( re.sub( r"^\d+_", "", testcase.get( "name" ) ) )
+        if len( names ) == 0:
+            continue
+
+        suite = _resolve_suite( os.sep, suite_name.split( "." ) )
+        if suite == None:
+            logger.warning( "Could not find testsuite file for '%s', skipping %s failed tests"%( suite_name, len( names ) ) )
+            continue
+        failed.setdefault( suite, set() ).update( names )
+    return failed
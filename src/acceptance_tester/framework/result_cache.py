@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""
+:mod:`acceptance_tester.framework.result_cache` -- Cached results of successful tests
+=====================================================================================
+
+============
+Result Cache
+============
+
+This module contains the class :class:`ResultCache`, which keeps the
+successful results of tests, so an identical test run against
+identical artifacts can be reported without running it.
+
+A result is addressed by a hash of the wrapped xml of the test and a
+salt (see :func:`cache_salt`). The salt covers the version of the test
+runner and the content of the artifacts the tests run against, such as
+the testrunner configuration. Changing any of these changes all keys,
+so no stale results are reported.
+
+The format of the testrunner configuration is up to the test runner,
+so the files it refers to are not found automatically. If the
+configuration is a file its content is part of the salt, otherwise only
+its value is. Other artifacts, such as the jars under test, must be
+given explicitly.
+
+The cache may be shared by several runs, such as the shards of a test
+run. It is merged into the file holding it under a file lock, see
+:func:`acceptance_tester.framework.state_file.update`, and the least
+recently used results are removed when the cache holds more than
+its limit.
+"""
+import hashlib
+import importlib
+import logging
+import os
+import sys
+import time
+
+from acceptance_tester._version import __version__
+from . import state_file
+from .manifest import xml_hash
+
+
+class NullHandler( logging.Handler ):
+    """
+    Nullhandler for logging.
+    """
+
+    def emit( self, record ):
+        pass
+
+### define logger
+logger = logging.getLogger( "dbc."+__name__ )
+logger.addHandler( NullHandler() )
+
+CACHE_VERSION = 1
+
+### bytes read at a time when hashing artifacts
+BLOCK_SIZE = 1024 * 1024
+
+
+def runner_version( runner_class ):
+    """
+    Returns the version of the module defining a test runner class.
+
+    The version is the __version__ attribute of the module, or of the
+    closest package containing it, either in the package itself or in
+    its _version module. If no version is found, the name of the class
+    is returned.
+
+    :param runner_class:
+        The test runner class.
+    :type runner_class:
+        type
+    """
+    parts = runner_class.__module__.split( "." )
+    while len( parts ) > 0:
+        name = ".".join( parts )
+        version = getattr( sys.modules.get( name ), '__version__', None )
+        if version == None:
+            try:
+                version = getattr( importlib.import_module( name + "._version" ), '__version__', None )
+            except ImportError:
+                pass
+        if version != None:
+            return "%s %s"%( name, version )
+        parts.pop()
+    return "%s.%s"%( runner_class.__module__, runner_class.__name__ )
+
+
+def _hash_file( digest, path ):
+    fh = open( path, 'rb' )
+    try:
+        block = fh.read( BLOCK_SIZE )
+        while len( block ) > 0:
+            digest.update( block )
+            block = fh.read( BLOCK_SIZE )
+    finally:
+        fh.close()
+
+
+def fingerprint( paths ):
+    """
+    Returns a hash of the content of artifact files. Folders are
+    hashed with all files below them, and paths that do not exist are
+    hashed by name only.
+
+    :param paths:
+        Paths to artifact files or folders.
+    :type paths:
+        list of strings
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update( path.encode( 'UTF-8' ) + b"\0" )
+        if os.path.isfile( path ):
+            _hash_file( digest, path )
+        elif os.path.isdir( path ):
+            for root, dirs, files in os.walk( path ):
+                dirs.sort()
+                for name in sorted( files ):
+                    filename = os.path.join( root, name )
+                    if os.path.isfile( filename ):
+                        digest.update( os.path.relpath( filename, path ).encode( 'UTF-8' ) + b"\0" )
+                        _hash_file( digest, filename )
+    return digest.hexdigest()
+
+
+def cache_salt( type_name, runner_class, testrunner_config, artifacts ):
+    """
+    Returns the part of the cache keys shared by all tests of a run.
+
+    :param type_name:
+        Name of the test type.
+    :type type_name:
+        string
+    :param runner_class:
+        The test runner class.
+    :type runner_class:
+        type
+    :param testrunner_config:
+        The testrunner configuration, or None.
+    :type testrunner_config:
+        string
+    :param artifacts:
+        Paths to the artifacts the tests run against.
+    :type artifacts:
+        list of strings
+    """
+    if testrunner_config != None and os.path.isfile( testrunner_config ):
+        artifacts = [ testrunner_config ] + list( artifacts )
+    parts = [ __version__, type_name, runner_version( runner_class ), str( testrunner_config ), fingerprint( artifacts ) ]
+    return "\0".join( parts )
+
+
+def result_key( salt, xml ):
+    """
+    Returns the cache key of a test.
+
+    :param salt:
+        Salt as returned by :func:`cache_salt`.
+    :type salt:
+        string
+    :param xml:
+        The wrapped xml of the test.
+    :type xml:
+        string or :class:`acceptance_tester.framework.xml_slice.XmlSlice`
+    """
+    digest = hashlib.sha1()
+    digest.update( salt.encode( 'UTF-8' ) + b"\0" )
+    digest.update( xml_hash( xml ).encode( 'UTF-8' ) )
+    return digest.hexdigest()
+
+
+class ResultCache( object ):
+    """
+    Size limited cache of successful test results.
+    """
+
+    def __init__( self, path, max_entries ):
+        """
+        Initializes the cache, and reads the cached results.
+
+        :param path:
+            Path to the file holding the cache.
+        :type path:
+            string
+        :param max_entries:
+            Maximum number of cached results.
+        :type max_entries:
+            int
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = self._entries( state_file.read( self.path, CACHE_VERSION, "result cache" ) )
+        self.updates = {}
+
+    def _entries( self, content ):
+        if content == None:
+            return {}
+        return content['results']
+
+    def get( self, key ):
+        """
+        Returns the duration in seconds of the cached successful run
+        of a test, or None if no result is cached for key.
+
+        :param key:
+            Key as returned by :func:`result_key`.
+        :type key:
+            string
+        """
+        if not key in self.entries:
+            return None
+        entry = dict( self.entries[key] )
+        entry['last-used'] = time.time()
+        self.updates[key] = entry
+        return entry['time']
+
+    def put( self, key, seconds ):
+        """
+        Caches the successful result of a test.
+
+        :param key:
+            Key as returned by :func:`result_key`.
+        :type key:
+            string
+        :param seconds:
+            The duration of the test.
+        :type seconds:
+            float
+        """
+        self.updates[key] = { 'time': seconds, 'last-used': time.time() }
+
+    def save( self ):
+        """
+        Merges the results cached and used by this run into the file
+        holding the cache, and removes the least recently used results
+        if the cache holds too many.
+        """
+        def _merge( content ):
+            entries = self._entries( content )
+            entries.update( self.updates )
+            if len( entries ) > self.max_entries:
+                keep = sorted( entries, key=lambda x: entries[x]['last-used'], reverse=True )[:self.max_entries]
+                logger.debug( "Evicting %s results from the result cache"%( len( entries ) - len( keep ) ) )
+                entries = dict( [ ( key, entries[key] ) for key in keep ] )
+            return { 'results': entries }
+
+        self.entries = state_file.update( self.path, CACHE_VERSION, "result cache", _merge )['results']
+        self.updates = {}
@@ -16,6 +16,9 @@ A Rst file is created for each test consisting of commentary fields
 and raw xml.  Furthermore a index tree is created and written. The
 index uses the sphinxs directive 'doc', and the created files are
 designed to be part of a sphinx document structure.
+
+The class :class:`RstDocumentation` creates the same documentation
+incrementally, writing the file for each test as its result arrives.
 """
 import logging
 import io
@@ -201,6 +204,88 @@ def _create_index( rst, type_name, start, delta ):
     return "\n".join( index )
 
 
+def _write_file( fname, content ):
+    fh = open( fname, 'w' )
+    fh.write( content )
+    fh.close()
+
+
+class RstDocumentation( object ):
+    """
+    Builds rst documentation incrementally as test results arrive.
+
+    The rst file for a test is written when the result is added, so
+    the result does not have to be kept in memory afterwards. The
+    index and views are written by :meth:`finish`.
+    """
+
+    def __init__( self, folder ):
+        """
+        Initializes the documentation.
+
+        :param folder:
+            Folder to place files in. This is created if it does not
+            exist.
+        :type folder:
+            string
+        """
+        self.folder = folder
+        self.parser = etree.XMLParser( remove_blank_text=True, encoding="UTF-8" )
+        self.nsmap = { 'ts': "info:testsuite#" }
+        self.type_names = []
+        self.entries = dict()
+        self.order = dict()
+
+        if not os.path.exists( self.folder ):
+            os.mkdir( self.folder )
+
+    def add( self, test ):
+        """
+        Writes the rst file for a single test result.
+
+        :param test:
+            test result to document.
+        :type test:
+            dict
+        """
+        ( name, string ) = _create_rst( test, self.parser, self.nsmap )
+        key = ( test['test-suite'], name )
+        filename = os.path.split( test['build-folder'] )[-1]
+
+        _write_file( os.path.join( self.folder, filename + '.rst' ), string )
+        self.entries[key] = ( filename, None )
+        self.order[key] = test.get( 'id', len( self.order ) )
+        if not test['type-name'] in self.type_names:
+            self.type_names.append( test['type-name'] )
+
+    def finish( self, start_time, delta ):
+        """
+        Writes index and views for the added test results.
+
+        :param start_time:
+            Build time for test
+        :type start_time:
+            datetime.datetime
+        :param delta:
+            Build duration
+        :type delta:
+            datetime.delta
+        """
+        rst = dict( [ ( key, self.entries[key] ) for key in sorted( self.entries, key=lambda x: self.order[x] ) ] )
+
+        fname = os.path.join( self.folder, 'treeview.rst' )
+        _write_file( fname, _create_treeview( rst, 'Tree View' ) )
+
+        fname = os.path.join( self.folder, 'flatview.rst' )
+        _write_file( fname, _create_flatview( rst, 'Flat View' ) )
+
+        fname = os.path.join( self.folder, 'index.rst' )
+        type_name = None
+        if len( self.type_names ) > 0:
+            type_name = ", ".join( self.type_names )
+        _write_file( fname, _create_index( rst, type_name, start_time, delta ) )
+
+
 def create_test_documentation( test_results, folder, start_time, delta ):
     """
     Creates rst report based on test_results and places files in folder.
@@ -220,34 +305,7 @@ def create_test_documentation( test_results, folder, start_time, delta ):
     """
     logger.debug( "Creating test documentation" )
 
-    def write_file( fname, content ):
-        fh = open( fname, 'w' )
-        fh.write( content )
-        fh.close()
-
-    parser = etree.XMLParser( remove_blank_text=True, encoding="UTF-8" )
-    nsmap = { 'ts': "info:testsuite#" }
-
-    rst = dict()
-
+    documentation = RstDocumentation( folder )
     for test in test_results:
-
-        ( name, string ) = _create_rst( test, parser, nsmap )
-        rst[ ( test['test-suite'], name ) ] = ( os.path.split( test['build-folder'] )[-1], string )
-
-    if not os.path.exists( folder ):
-        os.mkdir( folder )
-
-    for key, value in rst.items():
-        fname = os.path.join( folder, value[0] + '.rst' )
-        write_file( fname, value[1] )
-
-    fname = os.path.join( folder, 'treeview.rst' )
-    write_file( fname, _create_treeview( rst, 'Tree View' ) )
-
-    fname = os.path.join( folder, 'flatview.rst' )
-    write_file( fname, _create_flatview( rst, 'Flat View' ) )
-
-    fname = os.path.join( folder, 'index.rst' )
-
-    write_file( fname, _create_index( rst, test_results[0]['type-name'], start_time, delta ) )
+        documentation.add( test )
+    documentation.finish( start_time, delta )
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""
+:mod:`acceptance_tester.framework.scheduler` -- Orders tests for execution
+==========================================================================
+
+=========
+Scheduler
+=========
+
+This module contains the :class:`TimingHistory` class, which keeps
+the durations of tests from earlier runs, and the function
+:func:`longest_first` which uses these durations to order tests so
+the longest running tests are started first.
+
+Starting the longest tests first, and handing out tests one at a
+time, minimizes the period at the end of a run where only a single
+worker is busy.
+
+The class :class:`ResourceBudget` decides which tests may run at the
+same time, from the resources the tests declare and the capacity of
+the machine.
+
+The function :func:`shard` splits the tests into shards with
+roughly equal total predicted duration, so separate invocations can
+each run a part of the tests.
+
+Tests without a recorded duration are predicted using the average
+duration of the other tests in the same testsuite file. If no tests
+from the testsuite have been recorded, the average of all recorded
+tests is used.
+"""
+import logging
+
+from . import state_file
+
+
+class NullHandler( logging.Handler ):
+    """
+    Nullhandler for logging.
+    """
+
+    def emit( self, record ):
+        pass
+
+### define logger
+logger = logging.getLogger( "dbc."+__name__ )
+logger.addHandler( NullHandler() )
+
+HISTORY_VERSION = 1
+
+
+def history_key( suite, name ):
+    """
+    Returns the key used to identify a test across runs.
+
+    :param suite:
+        Path to the testsuite file containing the test.
+    :type suite:
+        string
+    :param name:
+        The name of the test.
+    :type name:
+        string
+    """
+    return "%s::%s"%( suite, name )
+
+
+class TimingHistory( object ):
+    """
+    Durations of tests recorded in earlier runs.
+    """
+
+    def __init__( self, path=None, smoothing=0.5 ):
+        """
+        Initializes the timing history.
+
+        :param path:
+            Path to the file holding the history. If None the history
+            is neither read nor written.
+        :type path:
+            string
+        :param smoothing:
+            Weight of a new measurement when it is merged with the
+            recorded duration of a test.
+        :type smoothing:
+            float
+        """
+        self.path = path
+        self.smoothing = smoothing
+        self.durations = {}
+        self.suites = {}
+        self._averages = None
+        self._load()
+
+    def _load( self ):
+        content = state_file.read( self.path, HISTORY_VERSION, "timing history" )
+        if content == None:
+            return
+        for key, entry in content['tests'].items():
+            self.durations[key] = entry['duration']
+            self.suites[key] = entry['suite']
+
+    def save( self ):
+        """
+        Writes the history to file.
+        """
+        tests = dict( [ ( key, { 'duration': self.durations[key], 'suite': self.suites[key] } ) for key in self.durations ] )
+        state_file.write( self.path, HISTORY_VERSION, { 'tests': tests } )
+
+    def record( self, suite, name, duration ):
+        """
+        Records a measured duration for a test.
+
+        :param suite:
+            Path to the testsuite file containing the test.
+        :type suite:
+            string
+        :param name:
+            The name of the test.
+        :type name:
+            string
+        :param duration:
+            Duration of the test in seconds.
+        :type duration:
+            float
+        """
+        key = history_key( suite, name )
+        if key in self.durations:
+            duration = self.smoothing * duration + ( 1 - self.smoothing ) * self.durations[key]
+        self.durations[key] = duration
+        self.suites[key] = suite
+        self._averages = None
+
+    def record_results( self, results ):
+        """
+        Records the durations of a list of test results, as returned
+        by :func:`acceptance_tester.framework.job.job`. Skipped tests,
+        and tests whose results were carried over from an earlier run,
+        are not recorded.
+        """
+        for result in results:
+            if result.get( 'status' ) == "SKIPPED" or result.get( 'carried-over' ):
+                continue
+            self.record( result['test-suite'], result['name'], result['time'].total_seconds() )
+
+    def predict( self, suite, name ):
+        """
+        Returns the predicted duration of a test in seconds. None is
+        returned if nothing is known about the test.
+        """
+        key = history_key( suite, name )
+        if key in self.durations:
+            return self.durations[key]
+
+        if self._averages == None:
+            self._averages = self._suite_averages()
+        if suite in self._averages:
+            return self._averages[suite]
+        return self._averages.get( None )
+
+    def _suite_averages( self ):
+        """
+        Returns dictionary with the average recorded duration of each
+        testsuite. The average of all tests is stored with the key None.
+        """
+        totals = {}
+        if len( self.durations ) > 0:
+            totals[None] = [ sum( self.durations.values() ), len( self.durations ) ]
+        for key, duration in self.durations.items():
+            total = totals.setdefault( self.suites[key], [0.0, 0] )
+            total[0] += duration
+            total[1] += 1
+        return dict( [ ( suite, total[0] / total[1] ) for suite, total in totals.items() ] )
+
+
+def longest_first( tests, history ):
+    """
+    Returns tests ordered by predicted duration, longest first.
+    Tests with equal prediction keep their original order.
+
+    :param tests:
+        Test argument dictionaries as created by
+        :class:`acceptance_tester.framework.suite_tester.SuiteTester`.
+    :type tests:
+        list
+    :param history:
+        History to predict durations from.
+    :type history:
+        TimingHistory
+    :return:
+        New list with the tests in scheduling order.
+    """
+    def _predicted( test ):
+        prediction = history.predict( test['test-suite'], test['name'] )
+        if prediction == None:
+            return 0.0
+        return prediction
+
+    return sorted( tests, key=lambda test: -_predicted( test ) )
+
+
+def suite_groups( tests, history, pool_size ):
+    """
+    Groups tests by testsuite, so all tests in a group can be run by
+    the same worker with a single setup. The groups are ordered by
+    their total predicted duration, longest first.
+
+    If there are fewer testsuites than workers, each testsuite is split
+    into several groups so all workers are used.
+
+    :param tests:
+        Test argument dictionaries as created by
+        :class:`acceptance_tester.framework.suite_tester.SuiteTester`.
+    :type tests:
+        list
+    :param history:
+        History to predict durations from.
+    :type history:
+        TimingHistory
+    :param pool_size:
+        Number of workers.
+    :type pool_size:
+        int
+    :return:
+        List of lists with test ids.
+    """
+    suites = []
+    grouped = dict()
+    for test in tests:
+        if not test['test-suite'] in grouped:
+            suites.append( test['test-suite'] )
+            grouped[test['test-suite']] = []
+        grouped[test['test-suite']].append( test )
+
+    splits = 1
+    if len( suites ) > 0 and len( suites ) < pool_size:
+        splits = -( -pool_size // len( suites ) )
+
+    groups = []
+    for suite in suites:
+        suite_tests = grouped[suite]
+        size = -( -len( suite_tests ) // splits )
+        for i in range( 0, len( suite_tests ), size ):
+            groups.append( suite_tests[i:i + size] )
+
+    def _predicted( group ):
+        predictions = [ history.predict( x['test-suite'], x['name'] ) for x in group ]
+        return sum( [ x for x in predictions if x != None ] )
+
+    groups.sort( key=lambda group: -_predicted( group ) )
+    return [ [ x['id'] for x in group ] for group in groups ]
+
+
+def batches( tests, count ):
+    """
+    Deals tests into count batches, so each batch gets a share of the
+    long and the short tests. The order of tests is kept within each
+    batch.
+
+    :param tests:
+        Test argument dictionaries in scheduling order.
+    :type tests:
+        list
+    :param count:
+        The number of batches.
+    :type count:
+        int
+    :return:
+        List of lists with test ids. Empty batches are left out.
+    """
+    batches = [ [ x['id'] for x in tests[i::count] ] for i in range( count ) ]
+    return [ x for x in batches if len( x ) > 0 ]
+
+
+def shard( tests, history, index, total ):
+    """
+    Returns the tests belonging to shard index of total shards.
+
+    The tests are assigned longest first to the shard with the lowest
+    total predicted duration. Ties are broken by the name of the test
+    and the shard number, so the split only depends on the tests and
+    the timing history, not on the order the tests were found in. All
+    shards must therefore use the same timing history. Without any
+    recorded durations, each test counts as one, and the tests are
+    split evenly by count.
+
+    :param tests:
+        Test argument dictionaries as created by
+        :class:`acceptance_tester.framework.suite_tester.SuiteTester`.
+    :type tests:
+        list
+    :param history:
+        History to predict durations from.
+    :type history:
+        TimingHistory
+    :param index:
+        The shard to return, counting from 1.
+    :type index:
+        int
+    :param total:
+        The number of shards.
+    :type total:
+        int
+    :return:
+        The tests of the shard, in their original order.
+    """
+    def _predicted( test ):
+        prediction = history.predict( test['test-suite'], test['name'] )
+        if prediction == None:
+            return 1.0
+        return prediction
+
+    keyed = sorted( [ ( -_predicted( test ), history_key( test['test-suite'], test['name'] ), i )
+                      for i, test in enumerate( tests ) ] )
+    loads = [ 0.0 ] * total
+    selected = set()
+    for duration, key, i in keyed:
+        target = min( range( total ), key=lambda x: ( loads[x], x ) )
+        loads[target] -= duration
+        if target == index - 1:
+            selected.add( i )
+    return [ test for i, test in enumerate( tests ) if i in selected ]
+
+
+class ResourceBudget( object ):
+    """
+    Keeps track of the resources used by running tasks.
+
+    A task fits in the budget if its exclusive tokens are not held by a
+    running task, and if the amounts it needs fit within the remaining
+    capacity. A task always fits when nothing else is running, so tasks
+    needing more than the capacity still run, one at a time.
+    """
+
+    def __init__( self, capacity, demand ):
+        """
+        :param capacity:
+            Dictionary with the available amount of each resource, e.g.
+            cpus and memory.
+        :type capacity:
+            dict
+        :param demand:
+            Function returning the demand of a task as a dictionary
+            with amounts of resources, and a set of exclusive tokens
+            under the key 'exclusive'.
+        :type demand:
+            function
+        """
+        self.capacity = capacity
+        self.demand = demand
+        self.used = dict( [ ( key, 0.0 ) for key in capacity ] )
+        self.tokens = set()
+        self.running = 0
+
+    def fits( self, task ):
+        """ Returns True if task can be started now. """
+        demand = self.demand( task )
+        if len( self.tokens & demand['exclusive'] ) > 0:
+            return False
+        if self.running == 0:
+            return True
+        for key, amount in self.capacity.items():
+            if self.used[key] + demand.get( key, 0.0 ) > amount:
+                return False
+        return True
+
+    def acquire( self, task ):
+        """ Reserves the resources of a task that is started. """
+        demand = self.demand( task )
+        for key in self.capacity:
+            self.used[key] += demand.get( key, 0.0 )
+        self.tokens |= demand['exclusive']
+        self.running += 1
+
+    def release( self, task ):
+        """ Returns the resources of a task that is done. """
+        demand = self.demand( task )
+        for key in self.capacity:
+            self.used[key] -= demand.get( key, 0.0 )
+        self.tokens -= demand['exclusive']
+        self.running -= 1
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""
+:mod:`acceptance_tester.framework.selection` -- Selects tests with an expression
+===============================================================================
+
+=========
+Selection
+=========
+
+This module contains the class :class:`SelectionExpression`, which
+selects tests by their name, the path of their testsuite file and
+their documentation.
+
+An expression is made of terms combined with ``and``, ``or``, ``not``
+and parentheses, for instance::
+
+    login and not slow
+    suite:holdings/ and (when:'a record is deleted' or name:^delete_)
+
+A term is a regular expression, which is searched for case
+insensitively. A term prefixed by a field name and a colon is searched
+for in that field, see :data:`FIELDS`. A term without a field selects
+tests whose name or testsuite path it is found in. The testsuite path
+is relative to the test folder it was found in, see
+:func:`relative_suite_path`, so terms do not match the folders above
+the test folder. Terms containing white space or parentheses are
+quoted with single or double quotes.
+
+Expressions are evaluated on the tests found by
+:func:`acceptance_tester.framework.find_tests.find_typed_tests`, before
+anything else is done for the tests.
+"""
+import logging
+import os
+import re
+
+
+class NullHandler( logging.Handler ):
+    """
+    Nullhandler for logging.
+    """
+
+    def emit( self, record ):
+        pass
+
+### define logger
+logger = logging.getLogger( "dbc."+__name__ )
+logger.addHandler( NullHandler() )
+
+### fields a term may be prefixed with
+FIELDS = [ "name", "suite", "description", "given", "when", "then" ]
+
+### fields searched by a term without a field
+DEFAULT_FIELDS = [ "name", "suite" ]
+
+OPERATORS = [ "and", "or", "not" ]
+
+def relative_suite_path( suite_path, test_paths ):
+    """
+    Returns the path of a testsuite file relative to the innermost of
+    the test folders containing it. A testsuite file given as a test
+    path is returned by its name. If no test path contains the file,
+    the path is returned unchanged.
+
+    :param suite_path:
+        Absolute path of the testsuite file.
+    :type suite_path:
+        string
+    :param test_paths:
+        Absolute paths of the test folders and files searched for
+        testsuites.
+    :type test_paths:
+        list of strings
+    """
+    relative = suite_path
+    for path in test_paths:
+        if path == suite_path:
+            return os.path.basename( suite_path )
+        if suite_path.startswith( path.rstrip( os.sep ) + os.sep ):
+            candidate = os.path.relpath( suite_path, path )
+            if len( candidate ) < len( relative ):
+                relative = candidate
+    return relative
+
+
+_TOKEN = re.compile( r"""\s*(?:(?P<paren>[()])|(?:(?P<field>[a-z]+):)?(?:"(?P<double>[^"]*)"|'(?P<single>[^']*)'|(?P<plain>[^\s()]+)))""" )
+
+
+class SelectionExpression( object ):
+    """
+    A parsed selection expression.
+    """
+
+    def __init__( self, expression ):
+        """
+        Parses the expression.
+
+        :param expression:
+            The selection expression.
+        :type expression:
+            string
+
+        :raise RuntimeError:
+            If the expression cannot be parsed, or a term is not a
+            valid regular expression.
+        """
+        self.expression = expression
+        self.tokens = self._tokenize( expression.strip() )
+        self.position = 0
+        if len( self.tokens ) == 0:
+            self._error( "the expression is empty" )
+        self.evaluate = self._parse_or()
+        if self.position < len( self.tokens ):
+            self._error( "unexpected '%s'"%self._token_text( self.tokens[self.position] ) )
+
+    def _error( self, reason ):
+        err_msg = "Invalid selection expression '%s': %s"%( self.expression, reason )
+        logger.error( err_msg )
+        raise RuntimeError( err_msg )
+
+    def _tokenize( self, expression ):
+        """ Returns a list of tuples with the kind and the value of each token. """
+        tokens = []
+        position = 0
+        while position < len( expression ):
+            match = _TOKEN.match( expression, position )
+            if match == None:
+                self._error( "cannot read '%s'"%expression[position:] )
+            position = match.end()
+            if match.group( 'paren' ) != None:
+                tokens.append( ( match.group( 'paren' ), None ) )
+                continue
+            field = match.group( 'field' )
+            pattern = [ x for x in match.group( 'double', 'single', 'plain' ) if x != None ][0]
+            if field == None and match.group( 'plain' ) in OPERATORS:
+                tokens.append( ( pattern, None ) )
+            else:
+                tokens.append( ( 'term', ( field, pattern ) ) )
+        return tokens
+
+    def _token_text( self, token ):
+        if token[0] == 'term':
+            return token[1][1]
+        return token[0]
+
+    def _next( self, kind ):
+        """ Skips the next token, and returns True, if it is of kind. """
+        if self.position < len( self.tokens ) and self.tokens[self.position][0] == kind:
+            self.position += 1
+            return True
+        return False
+
+    def _parse_or( self ):
+        operands = [ self._parse_and() ]
+        while self._next( "or" ):
+            operands.append( self._parse_and() )
+        if len( operands ) == 1:
+            return operands[0]
+        return lambda fields: any( x( fields ) for x in operands )
+
+    def _parse_and( self ):
+        operands = [ self._parse_not() ]
+        while self._next( "and" ):
+            operands.append( self._parse_not() )
+        if len( operands ) == 1:
+            return operands[0]
+        return lambda fields: all( x( fields ) for x in operands )
+
+    def _parse_not( self ):
+        if self._next( "not" ):
+            operand = self._parse_not()
+            return lambda fields: not operand( fields )
+        if self._next( "(" ):
+            operand = self._parse_or()
+            if not self._next( ")" ):
+                self._error( "missing ')'" )
+            return operand
+        if self.position >= len( self.tokens ):
+            self._error( "the expression ends too early" )
+        kind, value = self.tokens[self.position]
+        if kind != 'term':
+            self._error( "unexpected '%s'"%kind )
+        self.position += 1
+        return self._term( *value )
+
+    def _term( self, field, pattern ):
+        """ Returns a function, which is True if pattern is found in field. """
+        if field != None and not field in FIELDS:
+            self._error( "unknown field '%s', use one of %s"%( field, ", ".join( FIELDS ) ) )
+        try:
+            regex = re.compile( pattern, re.IGNORECASE )
+        except re.error as err:
+            self._error( "'%s' is not a valid regular expression: %s"%( pattern, err ) )
+        names = DEFAULT_FIELDS
+        if field != None:
+            names = [ field ]
+        return lambda fields: any( regex.search( fields.get( x ) or "" ) != None for x in names )
+
+    def matches( self, case, test_paths=() ):
+        """
+        Returns True if a test is selected by the expression.
+
+        :param case:
+            A test as returned by
+            :func:`acceptance_tester.framework.find_tests.find_typed_tests`,
+            a tuple with the testsuite path, the test name, the xml and
+            the documentation of the test first.
+        :type case:
+            tuple
+        :param test_paths:
+            Absolute paths of the test folders and files the test was
+            found in. The testsuite path is matched relative to these,
+            see :func:`relative_suite_path`.
+        :type test_paths:
+            list of strings
+        """
+        fields = dict( case[3] )
+        fields['name'] = case[1]
+        fields['suite'] = relative_suite_path( case[0], test_paths )
+        return self.evaluate( fields )
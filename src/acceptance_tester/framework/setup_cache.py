@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""
+:mod:`acceptance_tester.framework.setup_cache` -- Snapshots of build folders after setup
+========================================================================================
+
+====================
+Setup Snapshot Cache
+====================
+
+This module contains the class :class:`SetupSnapshotCache`, which
+keeps copies of build folders as they look right after the setup of a
+test has run.
+
+The snapshots are addressed by a hash of the serialized setup node
+(see :func:`setup_key`), so tests from different testsuites with
+identical setup share the snapshot. The size and modification time of
+the fixture files the setup node refers to, and of the files in the
+resource folder, are part of the hash, so a snapshot is not restored
+after its fixtures have changed. When a later test with the same
+setup starts, its build folder is populated from the snapshot, and the
+test runner is told so through the **setup_restored** flag. Test
+runners can use this flag to skip building fixtures that are already
+present. Running services are not part of the snapshot, so setup
+functions starting services must still do so.
+
+Files are copied with reflinks where the filesystem supports it. If
+hardlinks are allowed they are used as fallback, otherwise the files
+are copied. Hardlinked files are shared with the snapshot, so they must
+not be modified in place by the tests.
+
+The cache is shared by all worker processes. The index of the cache
+is protected with a file lock, and the least recently used snapshots
+are removed when the total size of the cache exceeds its limit. The
+lock is only held while the index is updated. Snapshots are copied
+into a temporary folder, and renamed into place while the lock is
+held, so workers copy snapshots at the same time.
+"""
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from lxml import etree
+
+
+class NullHandler( logging.Handler ):
+    """
+    Nullhandler for logging.
+    """
+
+    def emit( self, record ):
+        pass
+
+### define logger
+logger = logging.getLogger( "dbc."+__name__ )
+logger.addHandler( NullHandler() )
+
+### ioctl request for cloning a file (linux/fs.h)
+FICLONE = 0x40049409
+
+
+def paths_fingerprint( paths ):
+    """
+    Returns a hex digest of the names, sizes and modification times of
+    the files at or below paths. Paths that do not exist are skipped.
+
+    :param paths:
+        Paths to files or folders.
+    :type paths:
+        list of strings
+    """
+    digest = hashlib.sha1()
+    for path in sorted( set( paths ) ):
+        found = [ path ]
+        if os.path.isdir( path ):
+            found = []
+            for root, dirs, files in os.walk( path ):
+                dirs.sort()
+                found += [ os.path.join( root, x ) for x in sorted( files ) ]
+        for filename in found:
+            try:
+                stat = os.stat( filename )
+            except OSError:
+                continue
+            digest.update( ( "%s\0%s\0%s\0"%( filename, stat.st_size, stat.st_mtime_ns ) ).encode( 'UTF-8' ) )
+    return digest.hexdigest()
+
+
+def fixture_paths( setup_node, suite_folder ):
+    """
+    Returns the existing files and folders that attribute values and
+    texts in the setup node refer to, relative to the suite folder or
+    as absolute paths. The folder of the testsuite and its parent
+    folders are left out.
+    """
+    values = []
+    for node in setup_node.iter():
+        values += list( node.attrib.values() )
+        if isinstance( node.text, str ):
+            values.append( node.text.strip() )
+    suite_folder = os.path.normpath( suite_folder )
+    paths = []
+    for value in values:
+        if value == "" or "\0" in value or "\n" in value:
+            continue
+        path = os.path.normpath( os.path.join( suite_folder, value ) )
+        ### the folder of the testsuite and its parents are not fixtures
+        if path == suite_folder or suite_folder.startswith( path.rstrip( os.sep ) + os.sep ):
+            continue
+        if os.path.exists( path ):
+            paths.append( path )
+    return paths
+
+
+def setup_key( setup_node, type_name, suite_folder, fingerprint="" ):
+    """
+    Returns the cache key for a setup node.
+
+    The folder of the testsuite is part of the key, since setup nodes
+    commonly refer to fixtures with paths relative to the testsuite.
+    So is a fingerprint of the fixture files the setup node refers to,
+    see :func:`fixture_paths`, so a changed fixture gives a new key.
+
+    :param setup_node:
+        The setup node of the test.
+    :type setup_node:
+        lxml.etree.Element
+    :param type_name:
+        Name of the test type.
+    :type type_name:
+        string
+    :param suite_folder:
+        The folder containing the testsuite file.
+    :type suite_folder:
+        string
+    :param fingerprint:
+        Fingerprint of other files the setup depends on, such as the
+        resource folder, see :func:`paths_fingerprint`.
+    :type fingerprint:
+        string
+    :return:
+        Hex digest identifying the setup.
+    """
+    digest = hashlib.sha1()
+    digest.update( type_name.encode( 'UTF-8' ) + b"\0" )
+    digest.update( suite_folder.encode( 'UTF-8' ) + b"\0" )
+    digest.update( fingerprint.encode( 'UTF-8' ) + b"\0" )
+    digest.update( paths_fingerprint( fixture_paths( setup_node, suite_folder ) ).encode( 'UTF-8' ) + b"\0" )
+    digest.update( etree.tostring( setup_node, method="c14n" ) )
+    return digest.hexdigest()
+
+
+def _clone_file( src, dst, hardlinks ):
+    """
+    Copies file from src to dst, using a reflink if possible, a
+    hardlink if allowed, and a regular copy otherwise.
+    """
+    try:
+        with open( src, 'rb' ) as src_fh:
+            with open( dst, 'wb' ) as dst_fh:
+                fcntl.ioctl( dst_fh.fileno(), FICLONE, src_fh.fileno() )
+        shutil.copystat( src, dst )
+        return
+    except ( IOError, OSError ):
+        if os.path.exists( dst ):
+            os.remove( dst )
+
+    if hardlinks:
+        try:
+            os.link( src, dst )
+            return
+        except OSError:
+            pass
+    shutil.copy2( src, dst )
+
+
+def _copy_tree( src, dst, hardlinks ):
+    """ Copies the content of folder src into the existing folder dst. """
+    for name in os.listdir( src ):
+        src_path = os.path.join( src, name )
+        dst_path = os.path.join( dst, name )
+        if os.path.islink( src_path ):
+            os.symlink( os.readlink( src_path ), dst_path )
+        elif os.path.isdir( src_path ):
+            os.mkdir( dst_path )
+            _copy_tree( src_path, dst_path, hardlinks )
+        else:
+            _clone_file( src_path, dst_path, hardlinks )
+
+
+def _folder_size( folder ):
+    """ Returns the total size in bytes of the files in folder. """
+    size = 0
+    for root, dirs, files in os.walk( folder ):
+        for f in files:
+            path = os.path.join( root, f )
+            if not os.path.islink( path ):
+                size += os.path.getsize( path )
+    return size
+
+
+class SetupSnapshotCache( object ):
+    """
+    Size limited cache of build folder snapshots, keyed by setup.
+    """
+
+    def __init__( self, folder, max_size, hardlinks=False, fingerprint="" ):
+        """
+        Initializes the cache.
+
+        :param folder:
+            Folder holding the snapshots. This is created if it does not
+            exist.
+        :type folder:
+            string
+        :param max_size:
+            Maximum total size of the snapshots in bytes.
+        :type max_size:
+            int
+        :param hardlinks:
+            If true, files are hardlinked into build folders when the
+            filesystem does not support reflinks.
+        :type hardlinks:
+            boolean
+        :param fingerprint:
+            Fingerprint of files all setups depend on, which is given
+            to :func:`setup_key` for the keys of this cache.
+        :type fingerprint:
+            string
+        """
+        self.folder = os.path.abspath( folder )
+        self.max_size = max_size
+        self.hardlinks = hardlinks
+        self.fingerprint = fingerprint
+        self.index_file = os.path.join( self.folder, "index.json" )
+        if not os.path.exists( self.folder ):
+            try:
+                os.makedirs( self.folder )
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+
+    def _snapshot_folder( self, key ):
+        return os.path.join( self.folder, key )
+
+    def _temporary_folder( self ):
+        return os.path.join( self.folder, "tmp-%s"%uuid.uuid4().hex )
+
+    def _locked_index( self, update ):
+        """
+        Calls update with the index while holding the lock on the index
+        file. The index is written back afterwards.
+        """
+        fh = open( self.index_file, 'a+' )
+        fcntl.lockf( fh.fileno(), fcntl.LOCK_EX )
+        try:
+            fh.seek( 0 )
+            content = fh.read()
+            index = {}
+            if content != '':
+                try:
+                    index = json.loads( content )
+                except ValueError:
+                    logger.warning( "Discarding unreadable setup cache index '%s'"%self.index_file )
+            retval = update( index )
+            fh.seek( 0 )
+            fh.truncate()
+            fh.write( json.dumps( index ) )
+            fh.flush()
+            return retval
+        finally:
+            fcntl.lockf( fh.fileno(), fcntl.LOCK_UN )
+            fh.close()
+
+    def restore( self, key, build_folder ):
+        """
+        Populates build_folder from the snapshot for key.
+
+        :param key:
+            Key as returned by :func:`setup_key`.
+        :type key:
+            string
+        :param build_folder:
+            The existing, empty, build folder of the test.
+        :type build_folder:
+            string
+        :return:
+            True if a snapshot was found and copied, False otherwise.
+        """
+        def _restore( index ):
+            if not key in index:
+                return False
+            index[key]['last-used'] = time.time()
+            return True
+
+        if not self._locked_index( _restore ):
+            return False
+        try:
+            _copy_tree( self._snapshot_folder( key ), build_folder, self.hardlinks )
+        except ( IOError, OSError ) as err:
+            ### the snapshot was evicted while it was copied
+            logger.debug( "Could not restore setup snapshot '%s': %s"%( key, err ) )
+            for name in os.listdir( build_folder ):
+                path = os.path.join( build_folder, name )
+                if os.path.isdir( path ) and not os.path.islink( path ):
+                    shutil.rmtree( path )
+                else:
+                    os.remove( path )
+            return False
+        logger.debug( "Restored setup snapshot '%s' into '%s'"%( key, build_folder ) )
+        return True
+
+    def store( self, key, build_folder ):
+        """
+        Stores a snapshot of build_folder for key, unless a snapshot
+        already exists. Least recently used snapshots are removed if
+        the cache grows beyond its size limit.
+
+        :param key:
+            Key as returned by :func:`setup_key`.
+        :type key:
+            string
+        :param build_folder:
+            The build folder of the test, right after its setup has run.
+        :type build_folder:
+            string
+        """
+        size = _folder_size( build_folder )
+        if size > self.max_size:
+            logger.debug( "Build folder '%s' is too large for the setup cache"%build_folder )
+            return
+
+        if self._locked_index( lambda index: key in index ):
+            return
+        temporary = self._temporary_folder()
+        os.mkdir( temporary )
+        try:
+            ### the snapshot must never share inodes with a build folder
+            _copy_tree( build_folder, temporary, False )
+        except:
+            shutil.rmtree( temporary, ignore_errors=True )
+            raise
+
+        def _store( index ):
+            removed = []
+            if key in index:
+                return [ temporary ]
+            snapshot = self._snapshot_folder( key )
+            if os.path.exists( snapshot ):
+                removed.append( self._discard( snapshot ) )
+            os.rename( temporary, snapshot )
+            index[key] = { 'size': size, 'last-used': time.time() }
+            return removed + self._evict( index )
+
+        for folder in self._locked_index( _store ):
+            shutil.rmtree( folder, ignore_errors=True )
+        logger.debug( "Stored setup snapshot '%s' from '%s'"%( key, build_folder ) )
+
+    def _discard( self, snapshot ):
+        """ Renames snapshot to a temporary folder, which is returned, so it can be removed without the lock. """
+        temporary = self._temporary_folder()
+        os.rename( snapshot, temporary )
+        return temporary
+
+    def _evict( self, index ):
+        """
+        Evicts least recently used snapshots until the cache is within
+        its size limit, and returns the folders to remove.
+        """
+        removed = []
+        total = sum( [ x['size'] for x in index.values() ] )
+        for key in sorted( index, key=lambda x: index[x]['last-used'] ):
+            if total <= self.max_size:
+                break
+            logger.debug( "Evicting setup snapshot '%s'"%key )
+            if os.path.exists( self._snapshot_folder( key ) ):
+                removed.append( self._discard( self._snapshot_folder( key ) ) )
+            total -= index[key]['size']
+            del index[key]
+        return removed
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""
+:mod:`acceptance_tester.framework.state_file` -- JSON files kept between runs
+=============================================================================
+
+==========
+State File
+==========
+
+This module contains the functions reading and writing the JSON files
+kept in the state folder, such as the timing history, the result
+manifest and the discovery index.
+
+Each file holds a dictionary with the version of its format under the
+key 'version', and optionally other entries that must match, such as
+the version of acceptance-tester. A file that cannot be read or parsed
+is discarded with a warning, and a file with another version is
+discarded silently, so a damaged or outdated file never stops a run.
+
+Files are written to a temporary file, which is renamed into place,
+so readers never see a partly written file. Files shared by
+concurrent runs are updated with :func:`update`, which holds a lock
+while the file is read, changed and written.
+"""
+import fcntl
+import json
+import logging
+import os
+
+
+class NullHandler( logging.Handler ):
+    """
+    Nullhandler for logging.
+    """
+
+    def emit( self, record ):
+        pass
+
+### define logger
+logger = logging.getLogger( "dbc."+__name__ )
+logger.addHandler( NullHandler() )
+
+
+def read( path, version, description, stamp=None ):
+    """
+    Returns the content of a state file, or None if the file does not
+    exist, cannot be read, or has another version or stamp.
+
+    :param path:
+        Path to the file. If None, None is returned.
+    :type path:
+        string
+    :param version:
+        The version of the format of the file.
+    :type version:
+        int
+    :param description:
+        Description of the file used in log messages, such as
+        "timing history".
+    :type description:
+        string
+    :param stamp:
+        Other entries the file must have, such as the version of
+        acceptance-tester.
+    :type stamp:
+        dict
+    :return:
+        The dictionary held by the file.
+    """
+    if path == None or not os.path.exists( path ):
+        return None
+    try:
+        fh = open( path )
+        try:
+            content = json.load( fh )
+        finally:
+            fh.close()
+    except ( IOError, ValueError ) as err:
+        logger.warning( "Discarding unreadable %s '%s': %s"%( description, path, err ) )
+        return None
+
+    if not isinstance( content, dict ):
+        logger.warning( "Discarding unreadable %s '%s': not a dictionary"%( description, path ) )
+        return None
+    expected = dict( stamp or {}, version=version )
+    if any( [ content.get( key ) != value for key, value in expected.items() ] ):
+        logger.info( "Ignoring %s '%s' from another version"%( description, path ) )
+        return None
+    return content
+
+
+def write( path, version, content, stamp=None ):
+    """
+    Writes content to a state file, together with the version and the
+    stamp, see :func:`read`. The file is replaced in one step.
+
+    :param path:
+        Path to the file. If None nothing is written.
+    :type path:
+        string
+    :param version:
+        The version of the format of the file.
+    :type version:
+        int
+    :param content:
+        The entries of the file.
+    :type content:
+        dict
+    :param stamp:
+        Other entries identifying the writer.
+    :type stamp:
+        dict
+    """
+    if path == None:
+        return
+    content = dict( content )
+    content.update( stamp or {} )
+    content['version'] = version
+    ### the temporary file is unique, so concurrent writers do not mix
+    tmp_path = "%s.%s.tmp"%( path, os.getpid() )
+    try:
+        fh = open( tmp_path, 'w' )
+        try:
+            json.dump( content, fh, indent=1, sort_keys=True )
+        finally:
+            fh.close()
+        os.rename( tmp_path, path )
+    except:
+        if os.path.exists( tmp_path ):
+            os.remove( tmp_path )
+        raise
+
+
+def update( path, version, description, change, stamp=None ):
+    """
+    Reads a state file, changes it and writes it back, while holding a
+    lock on the file, so concurrent runs do not lose each others
+    changes. The lock is taken on a separate file with the suffix
+    '.lock', since the state file itself is replaced when written.
+
+    :param path:
+        Path to the file.
+    :type path:
+        string
+    :param version:
+        The version of the format of the file.
+    :type version:
+        int
+    :param description:
+        Description of the file used in log messages.
+    :type description:
+        string
+    :param change:
+        Function called with the content of the file, or None if there
+        is no usable file. It returns the new content.
+    :type change:
+        function
+    :param stamp:
+        Other entries the file must have, see :func:`read`.
+    :type stamp:
+        dict
+    :return:
+        The new content.
+    """
+    fh = open( path + ".lock", 'a' )
+    fcntl.lockf( fh.fileno(), fcntl.LOCK_EX )
+    try:
+        content = change( read( path, version, description, stamp ) )
+        write( path, version, content, stamp )
+        return content
+    finally:
+        fcntl.lockf( fh.fileno(), fcntl.LOCK_UN )
+        fh.close()
@@ -24,15 +24,31 @@ import os
 import re
 import shutil
 import sys
+import time
 import zipfile
-from datetime import datetime
+from datetime import datetime, timedelta
+import functools
 import io
+import itertools
 
 from lxml import etree
 from .aux import delta_str
 from .aux import datetime_str
 from . import job
 from . import find_tests
+from . import scheduler
+from . import manifest
+from . import result_cache
+from . import rerun
+from . import setup_cache
+from . import selection as selection_expression
+from . import distributed
+from . import worker_pool
+from . import watch
+from . import discovery_index
+from . import file_walker
+from acceptance_tester.supported_test_types import TYPES
+from acceptance_tester.abstract_testsuite_runner.async_test_runner import AsyncTestRunner
 sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.realpath( sys.argv[0] ) ) ) )
 import acceptance_tester.framework.rst_creator as rst_creator
 
@@ -72,7 +88,35 @@ class SuiteTester( object ):
                   use_configured_resources,
                   port_range="12000-13000",
                   color=False,
-                  no_clean=False):
+                  no_clean=False,
+                  state_folder=None,
+                  setup_affinity=False,
+                  setup_cache_size=0,
+                  setup_cache_hardlinks=False,
+                  async_concurrency=50,
+                  coordinator=None,
+                  authkey=None,
+                  shard=None,
+                  test_timeout=None,
+                  global_timeout=None,
+                  max_failures=0,
+                  cancel_grace=None,
+                  pool_size_range=None,
+                  memory_headroom=1024,
+                  capacity_cpus=None,
+                  capacity_memory=None,
+                  changed_only=False,
+                  result_cache_size=0,
+                  cache_artifacts=(),
+                  selection=None,
+                  retries=0,
+                  start_method=None,
+                  watch=False,
+                  watch_interval=1.0,
+                  type_concurrency=(),
+                  include=(),
+                  exclude=(),
+                  keyword=None):
         """
         Initializes the testsuite runner.
 
@@ -108,7 +152,8 @@ class SuiteTester( object ):
         :type testrunner_config
             string
         :param pool_size:
-            The size of the process pool.
+            The size of the process pool, or 'auto' to adjust the size
+            during the run, see **pool_size_range**.
         :type pool_size:
             int
         :param verbose:
@@ -132,6 +177,191 @@ class SuiteTester( object ):
             If true, ansi escape codes are used to colorize output.
         :type color:
             Boolean
+        :param state_folder:
+            Folder used to keep information between runs, such as
+            test durations. If None nothing is kept between runs.
+            This is created if it does not exist.
+        :type state_folder:
+            string
+        :param setup_affinity:
+            If true, tests from the same testsuite are run by the same
+            worker, and the setup is only run once for them.
+        :type setup_affinity:
+            Boolean
+        :param setup_cache_size:
+            Maximum size in megabytes of the cache with build folder
+            snapshots taken after setup. The cache is placed in the
+            state folder, so it needs a state folder. If 0 no
+            snapshots are used.
+        :type setup_cache_size:
+            int
+        :param setup_cache_hardlinks:
+            If true, snapshots may be hardlinked into build folders
+            when the filesystem does not support reflinks.
+        :type setup_cache_hardlinks:
+            Boolean
+        :param async_concurrency:
+            Number of tests each worker runs concurrently when the test
+            runner is an asyncio test runner.
+        :type async_concurrency:
+            int
+        :param coordinator:
+            Address on the form host:port. If given the tests are not
+            run locally, but served to workers connecting to this
+            address, see :mod:`acceptance_tester.framework.distributed`.
+        :type coordinator:
+            string
+        :param authkey:
+            Key shared with the workers. If None the key is read from
+            the environment.
+        :type authkey:
+            string
+        :param shard:
+            Shard to run on the form index/total, counting from 1. If
+            given only the tests of this shard are run, and the names of
+            the report file, log archive and result files are given a
+            shard suffix, so shards can share folders. The split is
+            computed from the durations in test-timings.json in the
+            state folder, which shards only read. Each shard records
+            its durations in a timings file with the shard suffix.
+        :type shard:
+            string
+        :param test_timeout:
+            Seconds a test may run before its worker is killed and the
+            test is reported as an error. A test can override this with
+            a timeout attribute on its test node. If None, tests without
+            a timeout attribute have no timeout.
+        :type test_timeout:
+            float
+        :param global_timeout:
+            Seconds the tests may run in total. When this is exceeded,
+            running tests are stopped and the remaining tests are not
+            run. They are all reported as errors. If None there is no
+            limit.
+        :type global_timeout:
+            float
+        :param max_failures:
+            If larger than 0, the run is cancelled when this number of
+            tests have failed or caused errors. Tests that are not run
+            are reported as skipped.
+        :type max_failures:
+            int
+        :param cancel_grace:
+            Seconds tests already running may continue after the run is
+            cancelled, before they are stopped. If None they are allowed
+            to finish.
+        :type cancel_grace:
+            float
+        :param pool_size_range:
+            Tuple with the smallest and largest pool size used when the
+            pool size is 'auto'. The default is from 1 to the number of
+            CPUs.
+        :type pool_size_range:
+            tuple with two int elements
+        :param memory_headroom:
+            Megabytes of memory to keep available when the pool size is
+            'auto'. Workers are removed when less memory is available.
+        :type memory_headroom:
+            int
+        :param capacity_cpus:
+            CPU slots available to concurrent tests. Tests declare the
+            slots they use with a cpus attribute on their test or
+            testsuite node, the default is 1. If None, the pool size is
+            used, so tests that declare no cpus run as many at a time
+            as there are workers.
+        :type capacity_cpus:
+            float
+        :param capacity_memory:
+            Megabytes of memory available to concurrent tests. Tests
+            declare their memory use with a memory attribute in
+            megabytes on their test or testsuite node. If None, the
+            memory available when the run starts is used.
+        :type capacity_memory:
+            float
+        :param changed_only:
+            If True, only tests whose xml changed, or which did not
+            succeed in the last run, are run. The results of the other
+            tests are carried over from the last run. Needs a state
+            folder.
+        :type changed_only:
+            bool
+        :param result_cache_size:
+            Number of successful results kept in the result cache in
+            the state folder. A test is not run if a successful result
+            is cached for its xml, the version of the test runner, the
+            testrunner configuration and the cache artifacts. Needs a
+            state folder. If 0 no results are cached.
+        :type result_cache_size:
+            int
+        :param cache_artifacts:
+            Paths to files or folders the tests run against. Their
+            content is part of the key of cached results.
+        :type cache_artifacts:
+            list of strings
+        :param selection:
+            If not None, only the selected tests are run. A dictionary
+            with the paths of testsuite files as keys, and sets of test
+            names as used in xUnit files as values, see
+            :func:`acceptance_tester.framework.rerun.failed_tests`.
+        :type selection:
+            dict
+        :param retries:
+            Number of times a test that fails or causes an error is run
+            again, each time on a newly started worker. A test that
+            succeeds after failing is reported as flaky. With a
+            coordinator, the test is run again by the next worker
+            asking for a test.
+        :type retries:
+            int
+        :param start_method:
+            The multiprocessing start method used for the workers,
+            'fork', 'spawn' or 'forkserver'. With 'forkserver' the
+            workers are forked from a server process that has imported
+            the framework, lxml and the modules of the test type, so
+            new workers start quickly, without the memory of this
+            process. If None, the default start method is used.
+        :type start_method:
+            string
+        :param watch:
+            If True, the workers and the resource manager are kept
+            after the run, and the tests affected by changes to the
+            testsuite files or the testrunner configuration are run
+            again, until the run is interrupted. Not supported with a
+            coordinator.
+        :type watch:
+            bool
+        :param watch_interval:
+            Seconds between checks for changes when watching.
+        :type watch_interval:
+            float
+        :param type_concurrency:
+            Limits on the number of tests of a test type running at the
+            same time, on the form name=number. The tests found may be
+            of several test types, which share the workers and the
+            capacity, each with its own resource manager. Test types
+            without a limit are only limited by the capacity.
+        :type type_concurrency:
+            list of strings
+        :param include:
+            Glob patterns of the files in the test folders that may be
+            testsuite files. By default all files ending in .xml.
+        :type include:
+            list of strings
+        :param exclude:
+            Glob patterns of files and folders in the test folders to
+            skip, in addition to those in the ignore file of a test
+            folder. Excluded folders are not searched, so fixture
+            folders such as data/ are never read.
+        :type exclude:
+            list of strings
+        :param keyword:
+            If not None, only the tests selected by this expression are
+            run, see :mod:`acceptance_tester.framework.selection`. Tests
+            are selected before their job arguments are created, so
+            tests that are not selected cost nothing more than finding
+            them.
+        :type keyword:
+            string
 
         :raise RuntimeError:
             If arguments are not good enough for starting test runner.
@@ -141,38 +371,172 @@ class SuiteTester( object ):
         logger.info( "Initializing test environment." )
         self.start = datetime.now()
 
-        self.log_file = os.path.abspath( log_file )
         self.testrunner_config =  testrunner_config
         self.verbose = verbose
         self.use_preloaded_resources = use_preloaded_resources
         self.use_configured_resources = use_configured_resources
 
         self.color = color
+        self.setup_affinity = setup_affinity
+        self.setup_cache_size = int( setup_cache_size )
+        self.setup_cache_hardlinks = setup_cache_hardlinks
+        self.async_concurrency = int( async_concurrency )
+        if self.async_concurrency < 1:
+            err_str = "Async concurrency must be at least 1. Given concurrency '%s'"%self.async_concurrency
+            logger.error( err_str )
+            raise RuntimeError( err_str )
+
+        self.coordinator = None
+        if coordinator != None:
+            self.coordinator = distributed.parse_address( coordinator )
+            self.authkey = distributed.get_authkey( authkey )
+
+        self.test_timeout = self._validated_timeout( test_timeout, "Test timeout" )
+        self.global_timeout = self._validated_timeout( global_timeout, "Global timeout" )
+
+        self.max_failures = int( max_failures )
+        self.cancel_grace = cancel_grace
+
+        self.retries = int( retries )
+        if self.retries < 0:
+            err_str = "Retries must not be negative. Given retries '%s'"%self.retries
+            logger.error( err_str )
+            raise RuntimeError( err_str )
+
+        self.start_method = start_method
+        if self.start_method != None and not self.start_method in multiprocessing.get_all_start_methods():
+            err_str = "Unknown start method '%s', known start methods are: %s"%( self.start_method, ", ".join( multiprocessing.get_all_start_methods() ) )
+            logger.error( err_str )
+            raise RuntimeError( err_str )
+
+        self.watch = watch
+        self.watch_interval = float( watch_interval )
+        if self.watch and self.coordinator != None:
+            err_str = "Watching for changes is not supported with a coordinator"
+            logger.error( err_str )
+            raise RuntimeError( err_str )
+
+        self.type_concurrency = self._validated_type_concurrency( type_concurrency )
+        self.file_filter = file_walker.FileFilter( include, exclude )
+        self.selection = selection
+        self.keyword = None
+        if keyword != None:
+            self.keyword = selection_expression.SelectionExpression( keyword )
+
+        self.changed_only = changed_only
+        if self.changed_only and state_folder == None:
+            err_str = "Running changed tests only needs a state folder to keep results in"
+            logger.error( err_str )
+            raise RuntimeError( err_str )
+        if int( setup_cache_size ) > 0 and state_folder == None:
+            err_str = "The setup cache needs a state folder to keep the snapshots in"
+            logger.error( err_str )
+            raise RuntimeError( err_str )
+        if int( result_cache_size ) > 0 and state_folder == None:
+            err_str = "The result cache needs a state folder to keep the results in"
+            logger.error( err_str )
+            raise RuntimeError( err_str )
+
+        self.shard = self._validated_shard( shard )
+        self.shard_suffix = ""
+        if self.shard != None:
+            self.shard_suffix = ".shard-%s-of-%s"%self.shard
+            report_file = self._add_suffix( report_file, self.shard_suffix )
+            log_file = self._add_suffix( log_file, self.shard_suffix )
 
         self.report_file = os.path.abspath( report_file )
+        self.log_file = os.path.abspath( log_file )
         self.paths_to_tests = list(map( os.path.abspath, paths_to_tests ))
 
+        self.pool_size_range = None
+        self.memory_headroom = int( memory_headroom )
+        if pool_size == "auto":
+            self.pool_size_range = self._validated_pool_size_range( pool_size_range )
+            ### tests are grouped and batched for the largest pool
+            pool_size = self.pool_size_range[1]
         self.pool_size = self._validated_pool_size( pool_size )
+        self.capacity = self._get_capacity( capacity_cpus, capacity_memory )
         self.port_range = self._validated_port_range( port_range )
 
         self.parser = etree.XMLParser( remove_blank_text=True, encoding="UTF-8" )
 
         self._write_lines( "Acceptance test started - %s"%datetime_str( self.start ), force_print=True )
 
-        self.test_type, self.test_type_name, retrieved_tests = find_tests.find_valid_tests( self.paths_to_tests, self.testrunner_config )
+        self.state_folder = None
+        if state_folder != None:
+            self.state_folder = self._create_folder( state_folder )
+        self.discovery_index = None
+        if self.state_folder != None:
+            self.discovery_index = discovery_index.DiscoveryIndex( self._state_file( 'discovery-index.json' ) )
 
-        if retrieved_tests == None:
+        found = find_tests.find_typed_tests( self.paths_to_tests, self.testrunner_config, self.discovery_index, self.file_filter )
+        if self.selection != None or self.keyword != None:
+            found = [ ( x[0], x[1], self._select( x[2] ) ) for x in found ]
+            found = [ x for x in found if len( x[2] ) > 0 ]
+
+        self.test_types = None
+        if len( found ) == 0:
             logger.debug( "Found no testfiles" )
             return
+        self.test_types = dict( [ ( x[1], x[0] ) for x in found ] )
+        if self.coordinator != None and len( self.test_types ) > 1:
+            err_str = "Running several test types is not supported with a coordinator. Found test types: %s"%", ".join( sorted( self.test_types ) )
+            logger.error( err_str )
+            raise RuntimeError( err_str )
 
         ### create needed folders
         self.build_folder = self._create_folder( build_folder )
         self.log_folder = self._create_folder( os.path.join( build_folder, 'logs' ) )
         self.test_results_folder = self._create_folder( test_results_folder )
         self.resource_folder = self._create_folder( resource_folder )
+        ### shards record their durations in their own file, so the
+        ### durations the split is computed from are the same every run
+        self.history = scheduler.TimingHistory( self._state_file( 'test-timings%s.json'%self.shard_suffix ) )
+        self.manifest = manifest.ResultManifest( self._state_file( 'test-manifest.json' ) )
+        self.flakiness = manifest.FlakinessHistory( self._state_file( 'test-flakiness.json' ) )
+        self.result_cache = None
+        self.cache_artifacts = list( map( os.path.abspath, cache_artifacts ) )
+        if int( result_cache_size ) > 0:
+            self.result_cache = result_cache.ResultCache( self._state_file( 'result-cache.json' ), int( result_cache_size ) )
+            self.cache_salts = dict( [ ( name, result_cache.cache_salt( name, test_type['test-runner'], self.testrunner_config, self.cache_artifacts ) )
+                                       for name, test_type in self.test_types.items() ] )
 
         ### create job arguments dictionary
+        self.no_clean = no_clean
         self.tests = []
+        for test_type, test_type_name, retrieved_tests in found:
+            self.tests += self._create_tests( test_type, test_type_name, retrieved_tests, len( self.tests ) )
+
+        if self.shard != None:
+            split_history = scheduler.TimingHistory( self._state_file( 'test-timings.json' ) )
+            self.tests = scheduler.shard( self.tests, split_history, *self.shard )
+
+        self.number_of_tests = len( self.tests )
+        self.number_of_testsuites = len( set( [x['test-suite'] for x in self.tests] ) )
+        self.delimiter_length = 120
+        ### Create status log message
+        self._write_lines( self.__create_initialization_status_lines() )
+
+    def _select( self, retrieved_tests ):
+        """
+        Returns the tests found by
+        :func:`acceptance_tester.framework.find_tests.find_typed_tests`
+        that are in the selection and match the keyword expression.
+        """
+        selected = retrieved_tests
+        if self.selection != None:
+            selected = [ x for x in selected if rerun.junit_test_name( x[1] ) in self.selection.get( x[0], () ) ]
+        if self.keyword != None:
+            selected = [ x for x in selected if self.keyword.matches( x, self.paths_to_tests ) ]
+        return selected
+
+    def _create_tests( self, test_type, test_type_name, retrieved_tests, first_id ):
+        """
+        Returns the job arguments dictionaries for tests of a test type
+        found by :func:`acceptance_tester.framework.find_tests.find_typed_tests`,
+        with ids counting from first_id.
+        """
+        tests = []
         for i, case in enumerate( retrieved_tests ):
 
             test_arguments = dict()
@@ -180,23 +544,21 @@ class SuiteTester( object ):
             test_arguments['log-folder'] = self.log_folder
             test_arguments['name'] = case[1]
             test_arguments['documentation'] = case[3]
-            test_arguments['id'] = i
+            test_arguments['id'] = first_id + i
             test_arguments['report-file'] = self.report_file
             test_arguments['test-suite'] = case[0]
-            test_arguments['type'] = self.test_type
-            test_arguments['type-name'] = self.test_type_name
+            test_arguments['type'] = test_type
+            test_arguments['type-name'] = test_type_name
             test_arguments['verbose'] = self.verbose
             test_arguments['xml'] = case[2]
             test_arguments['color'] = self.color
-            test_arguments['no_clean'] = no_clean
-            
-            self.tests.append( test_arguments )
+            test_arguments['no_clean'] = self.no_clean
+            attributes = self._get_attributes( case )
+            test_arguments['timeout'] = self._get_timeout( attributes, case[1] )
+            test_arguments['resources'] = self._get_resources( attributes, case[4], case[1] )
 
-        self.number_of_tests = len( self.tests )
-        self.number_of_testsuites = len( set( [x['test-suite'] for x in self.tests] ) )
-        self.delimiter_length = 120
-        ### Create status log message
-        self._write_lines( self.__create_initialization_status_lines() )
+            tests.append( test_arguments )
+        return tests
 
     def _validated_pool_size( self, pool_size ):
         pool_size = int( pool_size )
@@ -206,6 +568,114 @@ class SuiteTester( object ):
             raise RuntimeError( err_str )
         return pool_size
 
+    def _validated_pool_size_range( self, pool_size_range ):
+        if pool_size_range == None:
+            pool_size_range = ( 1, os.cpu_count() or 1 )
+        floor, ceiling = [ self._validated_pool_size( x ) for x in pool_size_range ]
+        if floor > ceiling:
+            err_str = "Smallest pool size '%s' is larger than largest pool size '%s'"%( floor, ceiling )
+            logger.error( err_str )
+            raise RuntimeError( err_str )
+        return ( floor, ceiling )
+
+    def _validated_timeout( self, timeout, name ):
+        if timeout == None:
+            return None
+        timeout = float( timeout )
+        if timeout < 0:
+            err_str = "%s must not be negative. Given timeout '%s'"%( name, timeout )
+            logger.error( err_str )
+            raise RuntimeError( err_str )
+        if timeout == 0:
+            return None
+        return timeout
+
+    def _get_attributes( self, case ):
+        """ Returns the attributes of the testsuite node of a test, updated with the attributes of its test node. """
+        attributes = dict( case[4] )
+        attributes.update( case[5] )
+        return attributes
+
+    def _get_timeout( self, attributes, name ):
+        """ Returns the timeout of a test, from the timeout attribute of its test or testsuite node or the test timeout. """
+        if not 'timeout' in attributes:
+            return self.test_timeout
+        try:
+            return self._validated_timeout( attributes['timeout'], "Timeout of test '%s'"%name )
+        except ValueError:
+            err_str = "Unknown timeout format '%s' in test '%s', timeout must be a number of seconds"%( attributes['timeout'], name )
+            logger.error( err_str )
+            raise RuntimeError( err_str )
+
+    def _get_capacity( self, cpus, memory ):
+        """ Returns the resources available to concurrent tests. """
+        if cpus == None:
+            ### tests declaring no cpus are only limited by the pool size
+            cpus = self.pool_size
+        if memory == None:
+            memory = worker_pool.available_memory()
+            if memory == None:
+                memory = float( "inf" )
+            else:
+                memory = memory / ( 1024 * 1024 )
+        capacity = { 'cpus': float( cpus ), 'memory': float( memory ) }
+        for key, amount in capacity.items():
+            if amount <= 0:
+                err_str = "Capacity of %s must be larger than 0. Given capacity '%s'"%( key, amount )
+                logger.error( err_str )
+                raise RuntimeError( err_str )
+        return capacity
+
+    def _get_resources( self, attributes, suite_attributes, name ):
+        """
+        Returns the resources declared for a test with the cpus, memory
+        and exclusive attributes of its test or testsuite node.
+        Exclusive tokens from both nodes are used.
+        """
+        resources = { 'cpus': 1.0, 'memory': 0.0 }
+        for key in resources:
+            if not key in attributes:
+                continue
+            try:
+                resources[key] = float( attributes[key] )
+            except ValueError:
+                resources[key] = None
+            if resources[key] == None or resources[key] < 0:
+                err_str = "Unknown %s format '%s' in test '%s', %s must be a positive number"%( key, attributes[key], name, key )
+                logger.error( err_str )
+                raise RuntimeError( err_str )
+        tokens = ",".join( [ suite_attributes.get( 'exclusive', "" ), attributes.get( 'exclusive', "" ) ] )
+        resources['exclusive'] = set( [ x.strip() for x in tokens.split( "," ) if x.strip() != "" ] )
+        return resources
+
+    def _validated_type_concurrency( self, type_concurrency ):
+        limits = dict()
+        for value in type_concurrency:
+            spl = value.split( "=" )
+            if len( spl ) != 2 or not spl[0].strip() in TYPES or not spl[1].strip().isdigit() or int( spl[1] ) < 1:
+                err_str = "Unknown type concurrency format in string '%s', "%value + \
+                          "format is: name=number, where name is a known test type and number is a positive integer"
+                logger.error( err_str )
+                raise RuntimeError( err_str )
+            limits[spl[0].strip()] = int( spl[1] )
+        return limits
+
+    def _validated_shard( self, shard ):
+        if shard == None:
+            return None
+        spl = shard.split( "/" )
+        if len( spl ) != 2 or not spl[0].isdigit() or not spl[1].isdigit() or not 1 <= int( spl[0] ) <= int( spl[1] ):
+            err_str = "Unknown shard format in string '%s', "%shard + \
+                      "format is: index/total, where index and total are integers and 1 <= index <= total"
+            logger.error( err_str )
+            raise RuntimeError( err_str )
+        return ( int( spl[0] ), int( spl[1] ) )
+
+    def _add_suffix( self, path, suffix ):
+        """ Inserts suffix in path before the file extension. """
+        root, ext = os.path.splitext( path )
+        return root + suffix + ext
+
     def _validated_port_range( self, port_range ):
         spl = port_range.split( "-" )
         if len( spl ) != 2 or int( spl[0] ) >= int( spl[1] ):
@@ -225,42 +695,503 @@ class SuiteTester( object ):
         analysed and logged.
         """
         try:
-            if self.test_type == None:
+            if self.test_types == None:
                 self._write_lines( "Found no tests... exiting.", force_print=True )
                 self._write_junit_files( [] )
                 return
 
-            self.resource_manager = None
-            if 'resource-manager' in self.test_type:
-                self.resource_manager = self.test_type['resource-manager']( self.resource_folder,
-                                                                            self.tests,
-                                                                            self.use_preloaded_resources,
-                                                                            self.use_configured_resources,
-                                                                            self.port_range )
+            ### tests that are unchanged since they succeeded are
+            ### not run, their results are carried over
+            carried = []
+            tests = self.tests
+            if self.changed_only:
+                tests, unchanged = self._carry_over( tests, self._previous_time, "unchanged since the last run" )
+                self._write_lines( "%s tests are unchanged since the last run"%len( unchanged ), force_print=True )
+                carried += unchanged
+            if self.result_cache != None:
+                tests, cached = self._carry_over( tests, self._cached_time, "result from cache" )
+                self._write_lines( "%s tests have a cached result"%len( cached ), force_print=True )
+                carried += cached
+
+            self.resource_managers = dict()
+            if self.coordinator == None:
+                self._start_resource_managers( tests )
             self._write_lines( "Creating pool, and starting tests" )
 
             for test in self.tests:
-                test['resource-manager'] = self.resource_manager
-
-            ### run tests
-
-            pool = multiprocessing.Pool( self.pool_size )
-            results = pool.map( job.job, self.tests )
+                test['resource-manager'] = self.resource_managers.get( test['type-name'] )
+            self.tests_by_id = dict( [ ( test['id'], test ) for test in self.tests ] )
+
+            ### run tests, longest first and one at a time, so no
+            ### worker is left idle while others work through a chunk
+            history = self.history
+            scheduled_tests = scheduler.longest_first( tests, history )
+
+            deadline = None
+            if self.global_timeout != None:
+                deadline = time.monotonic() + self.global_timeout
+
+            if self.coordinator != None:
+                coordinator = distributed.Coordinator( scheduled_tests, list( self.test_types )[0], self.testrunner_config,
+                                                       self.color, self.coordinator, self.authkey, self.log_folder, deadline )
+                self._write_lines( "Waiting for workers on %s:%s"%coordinator.address, force_print=True )
+                completed = self._retry_failures( coordinator.results(), coordinator )
+                results = self._consume_results( itertools.chain( carried, self._watch_failures( completed, coordinator ) ) )
+                self._record_results( results )
+                return self._finish( results )
+
+            pool = self._create_pool( self.tests )
+            completed = self._retry_failures( self._run_on_pool( pool, tests, deadline ), pool )
+            results = self._consume_results( itertools.chain( carried, self._watch_failures( completed, pool ) ) )
+            self._record_results( results )
+
+            if self.watch:
+                self._finish( results, archive=False )
+                pool = self._watch( pool, results )
+                pool.close()
+                pool.join()
+                self._zip_logs()
+                return
             pool.close()
             pool.join()
         finally:
-            if hasattr(self, "resource_manager") and self.resource_manager is not None:
-                self.resource_manager.shutdown()
+            for resource_manager in getattr( self, "resource_managers", {} ).values():
+                resource_manager.shutdown()
+
+        self._finish( results )
+
+    def _start_resource_managers( self, tests ):
+        """
+        Starts a resource manager for each test type that has one, with
+        the tests of the type. When there are several test types, each
+        resource manager gets its own folder in the resource folder, and
+        its own part of the port range.
+        """
+        names = sorted( self.test_types )
+        size = ( self.port_range[1] - self.port_range[0] ) // len( names )
+        for position, name in enumerate( names ):
+            test_type = self.test_types[name]
+            if not 'resource-manager' in test_type:
+                continue
+            folder = self.resource_folder
+            port_range = self.port_range
+            if len( names ) > 1:
+                folder = self._create_folder( os.path.join( self.resource_folder, name ) )
+                port_range = ( self.port_range[0] + position * size, self.port_range[0] + ( position + 1 ) * size - 1 )
+            self.resource_managers[name] = test_type['resource-manager']( folder,
+                                                                          [ x for x in tests if x['type-name'] == name ],
+                                                                          self.use_preloaded_resources,
+                                                                          self.use_configured_resources,
+                                                                          port_range )
+
+    def _create_pool( self, tests ):
+        """
+        Returns a worker pool for tests. The tests are handed to the
+        workers once, through the initializer, so each task only
+        carries a test id. Only the parts of the tests the workers
+        need are handed over, see :func:`acceptance_tester.framework.job.worker_test`.
+        """
+        sizer = None
+        if self.pool_size_range != None:
+            sizer = worker_pool.AdaptivePoolSize( self.pool_size_range[0], self.pool_size_range[1],
+                                                  self.memory_headroom * 1024 * 1024 )
+        return worker_pool.WorkerPool( self.pool_size,
+                                       job.init_worker,
+                                       ( [ job.worker_test( x ) for x in tests ], dict( [ ( x, TYPES[x] ) for x in self.test_types ] ), self.testrunner_config, self.color,
+                                         self._snapshot_cache_arguments() ),
+                                       context=self._worker_context(),
+                                       sizer=sizer )
+
+    def _run_on_pool( self, pool, tests, deadline, added=None ):
+        """
+        Runs tests on pool, and returns an iterator over the results in
+        completion order.
+
+        :param added:
+            Tests unknown to the workers of pool, which are sent along
+            with each task.
+        :type added:
+            list
+        """
+        ### tests of all test types share the capacity
+        capacity = dict( self.capacity )
+        for name, limit in self.type_concurrency.items():
+            capacity['type:%s'%name] = float( limit )
+        budget = scheduler.ResourceBudget( capacity, self._task_resources )
+        supervise = dict( timeout=self._task_timeout, on_lost=self._lost_task, deadline=deadline,
+                          on_cancelled=self._cancelled_task, budget=budget )
+
+        func = functools.partial( job.run_task, concurrency=self.async_concurrency )
+        if added != None:
+            ### the resource manager is not sent, the workers use their own
+            added_tests = [ job.worker_test( dict( [ x for x in test.items() if x[0] != 'resource-manager' ] ) ) for test in added ]
+            func = functools.partial( job.run_with_tests, added_tests, func )
+
+        results = pool.imap_unordered( func, self._schedule( tests ), **supervise )
+        ### a generator, so results stream, and tasks queued while
+        ### consuming them, such as retries, are still run
+        return itertools.chain.from_iterable( ( x if isinstance( x, list ) else [ x ] for x in results ) )
+
+    def _schedule( self, tests ):
+        """
+        Returns the tasks given to the pool for tests, longest first
+        and one at a time, so no worker is left idle while others work
+        through a chunk.
+
+        Tests with an asyncio test runner are dealt into batches, which
+        a worker runs concurrently. With setup affinity, other tests are
+        grouped by testsuite. Otherwise each test is a task. When tasks
+        of several kinds are mixed, they are ordered by their predicted
+        duration.
+        """
+        history = self.history
+        scheduled_tests = scheduler.longest_first( tests, history )
+        async_names = [ x for x in sorted( self.test_types ) if self._is_async( x ) ]
+        if self.setup_affinity and len( async_names ) > 0:
+            logger.warning( "Setup affinity is not supported for asyncio test runners, and is ignored for their tests" )
+
+        parts = []
+        for name in async_names:
+            typed_tests = [ x for x in scheduled_tests if x['type-name'] == name ]
+            if len( typed_tests ) == 0:
+                continue
+            concurrency = min( self.async_concurrency, self.type_concurrency.get( name, self.async_concurrency ) )
+            ### batches are small enough to keep results streaming,
+            ### and large enough to fill the event loop of a worker
+            count = max( self.pool_size, -( -len( typed_tests ) // concurrency ) )
+            parts.append( scheduler.batches( typed_tests, count ) )
+
+        other_tests = [ x for x in scheduled_tests if not x['type-name'] in async_names ]
+        if len( other_tests ) > 0:
+            if self.setup_affinity:
+                parts.append( scheduler.suite_groups( other_tests, history, self.pool_size ) )
+            else:
+                parts.append( [ x['id'] for x in other_tests ] )
+
+        if len( parts ) == 1:
+            return parts[0]
+        return sorted( itertools.chain.from_iterable( parts ), key=lambda x: -self._predicted_task( x ) )
+
+    def _predicted_task( self, task ):
+        """ Returns the predicted duration of a task, in seconds. """
+        predictions = []
+        for test_id in self._task_ids( task ):
+            test = self.tests_by_id[test_id]
+            predictions.append( self.history.predict( test['test-suite'], test['name'] ) or 0.0 )
+        return self._combine( task )( predictions )
+
+    def _watch( self, pool, results ):
+        """
+        Reruns the tests affected by changes to the testsuite files or
+        the testrunner configuration, until interrupted, and prints how
+        the status of the tests changed.
+
+        A changed testsuite file is read again, and its new and changed
+        tests are run. A change to the testrunner configuration restarts
+        the workers, and runs all tests. The resource manager is kept.
+
+        :return:
+            The pool, which is replaced when the testrunner
+            configuration changes.
+        """
+        current = dict( [ ( scheduler.history_key( x['test-suite'], x['name'] ), x ) for x in self.tests ] )
+        statuses = dict( [ ( scheduler.history_key( x['test-suite'], x['name'] ), x['status'] ) for x in results ] )
+        config = []
+        if self.testrunner_config != None and os.path.exists( self.testrunner_config ):
+            config = [ os.path.abspath( self.testrunner_config ) ]
+        watcher = watch.FileWatcher( self.paths_to_tests, config, self.watch_interval, self.file_filter )
+        self._write_lines( "Watching for changes, press Ctrl-C to stop", force_print=True )
+        try:
+            while True:
+                changed = watcher.wait_for_changes()
+                in_config = [ x for x in changed for y in config if x == y or x.startswith( y + os.sep ) ]
+                config_changed = len( in_config ) > 0
+                suites = sorted( [ x for x in changed if not x in in_config ] )
+                ( tests, removed ) = self._update_tests( current, suites )
+                lines = [ "", "Changed: %s"%", ".join( sorted( changed ) ) ]
+                for key in removed:
+                    test = removed[key]
+                    lines.append( "  %s (%s): removed"%( test['name'], test['test-suite'] ) )
+                    statuses.pop( key, None )
+                if config_changed:
+                    self._write_lines( "Testrunner configuration changed, restarting workers", force_print=True )
+                    pool.close()
+                    pool.join()
+                    tests = list( current.values() )
+                    pool = self._create_pool( tests )
+                    added = None
+                else:
+                    added = tests
+                if len( tests ) == 0:
+                    self._write_lines( lines + [ "No tests are affected by the changes" ], force_print=True )
+                    continue
+
+                self._write_lines( "Running %s affected tests"%len( tests ), force_print=True )
+                new_results = []
+                completed = self._retry_failures( self._run_on_pool( pool, tests, None, added ), pool )
+                for result in self._watch_failures( completed, pool ):
+                    del result['xml']
+                    new_results.append( result )
+                self._record_results( new_results )
+
+                lines += watch.status_changes( statuses, new_results )
+                for result in new_results:
+                    statuses[scheduler.history_key( result['test-suite'], result['name'] )] = result['status']
+                failing = len( [ x for x in statuses.values() if x in [ "ERROR", "FAILURE" ] ] )
+                lines.append( "Ran %s tests, %s of %s tests are failing"%( len( new_results ), failing, len( statuses ) ) )
+                self._write_lines( lines, force_print=True )
+        except KeyboardInterrupt:
+            self._write_lines( "Stopped watching", force_print=True )
+            pool.terminate()
+        finally:
+            watcher.close()
+        return pool
+
+    def _update_tests( self, current, suites ):
+        """
+        Reads changed testsuite files again, and updates current, the
+        tests by key, with their tests. Testsuite files that cannot be
+        read keep their tests, until they are fixed.
 
-        ### analyze results
+        :return:
+            Tuple with a list of the new and changed tests, and a
+            dictionary with the removed tests by key.
+        """
+        found = []
+        readable = [ x for x in suites if os.path.exists( x ) ]
+        if len( readable ) > 0:
+            try:
+                typed_tests = find_tests.find_typed_tests( readable, self.testrunner_config, self.discovery_index, self.file_filter )
+            except ( RuntimeError, etree.XMLSyntaxError ) as err:
+                logger.warning( "Could not read changed testsuite files: %s"%err )
+                typed_tests = []
+            first_id = max( list( self.tests_by_id ) + [ -1 ] ) + 1
+            for test_type, test_type_name, retrieved_tests in typed_tests:
+                ### the workers only know the test types of the run
+                if not test_type_name in self.test_types:
+                    logger.warning( "Ignoring changed testsuite files of test type '%s'"%test_type_name )
+                    continue
+                retrieved_tests = self._select( retrieved_tests )
+                found += self._create_tests( self.test_types[test_type_name], test_type_name, retrieved_tests, first_id + len( found ) )
+
+        ### tests are dropped from testsuite files that were removed or read
+        read = set( [ x['test-suite'] for x in found ] )
+        for suite in readable:
+            if not suite in read:
+                logger.warning( "Keeping the tests of testsuite file '%s', which could not be read"%suite )
+        removed = dict( [ ( key, test ) for key, test in current.items()
+                          if test['test-suite'] in read or test['test-suite'] in suites and not os.path.exists( test['test-suite'] ) ] )
+        for key in removed:
+            del current[key]
+
+        tests = []
+        for test in found:
+            key = scheduler.history_key( test['test-suite'], test['name'] )
+            previous = removed.pop( key, None )
+            if previous != None and manifest.xml_hash( previous['xml'] ) == manifest.xml_hash( test['xml'] ):
+                current[key] = previous
+                continue
+            test['resource-manager'] = self.resource_managers.get( test['type-name'] )
+            current[key] = test
+            self.tests_by_id[test['id']] = test
+            tests.append( test )
+        return ( tests, removed )
+
+    def _finish( self, results, archive=True ):
+        """
+        Archives logs, and writes the summary and the documentation of
+        the run. When watching, the logs are archived when watching
+        stops.
+        """
         delta = datetime.now() - self.start
-        self._zip_logs()
-        self._write_junit_files( results )
+        if archive:
+            self._zip_logs()
         self._write_lines( self.__create_summary_of_tests_lines( results ) )
         self._write_lines( self.__create_summary_lines( results, delta ), True )
-        rst_creator.create_test_documentation( results,
-                                               os.path.join( self.test_results_folder, "sphinx-rst" ),
-                                               self.start, delta )
+        self.documentation.finish( self.start, delta )
+
+    def _carry_over( self, tests, lookup, reason ):
+        """
+        Splits tests into the tests to run, and results carried over
+        for the tests lookup returns an earlier duration in seconds for.
+        """
+        durations = dict( [ ( test['id'], lookup( test ) ) for test in tests ] )
+        remaining = [ test for test in tests if durations[test['id']] == None ]
+        carried = [ job.carried_result( test, timedelta( seconds=durations[test['id']] ), reason )
+                    for test in tests if durations[test['id']] != None ]
+        return ( remaining, carried )
+
+    def _previous_time( self, test ):
+        """ Returns the duration of the last run of a test, if it is unchanged and succeeded. """
+        previous = self.manifest.previous( test )
+        if previous == None:
+            return None
+        return previous['time']
+
+    def _cached_time( self, test ):
+        """ Returns the duration of the cached successful run of a test, if any. """
+        return self.result_cache.get( result_cache.result_key( self.cache_salts[test['type-name']], test['xml'] ) )
+
+    def _record_results( self, results ):
+        """
+        Records the durations and results of the run for later runs.
+        """
+        self.history.record_results( results )
+        self.history.save()
+        self.manifest.record_results( results, self.tests_by_id )
+        self.manifest.save()
+        if self.retries > 0:
+            self.flakiness.record_results( results )
+            self.flakiness.save()
+        if self.result_cache != None:
+            for result in results:
+                if result['status'] == "SUCCESS" and not result.get( 'carried-over' ):
+                    test = self.tests_by_id[result['id']]
+                    key = result_cache.result_key( self.cache_salts[test['type-name']], test['xml'] )
+                    self.result_cache.put( key, result['time'].total_seconds() )
+            self.result_cache.save()
+
+    def _consume_results( self, results ):
+        """
+        Handles test results as they are completed.
+
+        The rst documentation of each test is written when the result
+        arrives, and the xUnit file of a testsuite is written as soon as
+        all tests in the testsuite are done. The xml of the test is
+        dropped from the result afterwards, so only small results are
+        kept for the summary.
+
+        :param results:
+            Iterable yielding test results in completion order.
+        :type results:
+            iterable
+        :return:
+            The results without xml, ordered by test id.
+        """
+        self.documentation = rst_creator.RstDocumentation( os.path.join( self.test_results_folder, "sphinx-rst" + self.shard_suffix ) )
+
+        remaining = dict()
+        for test in self.tests:
+            remaining[test['test-suite']] = remaining.get( test['test-suite'], 0 ) + 1
+
+        unwritten = dict()
+        consumed = []
+        for result in results:
+            self.documentation.add( result )
+
+            suite = result['test-suite']
+            unwritten.setdefault( suite, [] ).append( result )
+            remaining[suite] -= 1
+            if remaining[suite] == 0:
+                suite_results = unwritten.pop( suite )
+                suite_results.sort( key=lambda x: x['id'] )
+                self._write_junit_file( suite, suite_results )
+                for suite_result in suite_results:
+                    del suite_result['xml']
+
+            consumed.append( result )
+
+        consumed.sort( key=lambda x: x['id'] )
+        return consumed
+
+    def _task_ids( self, task ):
+        """ Returns the ids of the tests in a task given to the pool, which is either a test id or a list of ids."""
+        if isinstance( task, list ):
+            return task
+        return [ task ]
+
+    def _task_timeout( self, task ):
+        """ Returns the timeout of a task, which is the sum of the timeouts of its tests."""
+        timeouts = [ self.tests_by_id[x]['timeout'] for x in self._task_ids( task ) ]
+        if None in timeouts:
+            return None
+        return sum( timeouts )
+
+    def _task_resources( self, task ):
+        """
+        Returns the resources of a task. The tests of an async batch run
+        concurrently, so their resources are added. The tests of a
+        testsuite group run one after another, so the largest amounts
+        are used. All exclusive tokens of the tests are held.
+
+        A task also uses one slot of its test type for each test
+        running at the same time, which is limited by the type
+        concurrency.
+        """
+        tests = [ self.tests_by_id[x]['resources'] for x in self._task_ids( task ) ]
+        combine = self._combine( task )
+        resources = dict( [ ( key, combine( [ x[key] for x in tests ] ) ) for key in [ 'cpus', 'memory' ] ] )
+        resources['exclusive'] = set().union( *[ x['exclusive'] for x in tests ] )
+        resources['type:%s'%self.tests_by_id[self._task_ids( task )[0]]['type-name']] = float( combine( [ 1 for x in tests ] ) )
+        return resources
+
+    def _combine( self, task ):
+        """
+        Returns the function combining amounts of the tests of a task.
+        The tests of an async batch run concurrently, so their amounts
+        are added, while the largest amount is used for other tasks.
+        """
+        if self._is_async( self.tests_by_id[self._task_ids( task )[0]]['type-name'] ):
+            return sum
+        return max
+
+    def _lost_task( self, task, elapsed, message ):
+        """ Returns error results for the tests in a task that was stopped by the pool."""
+        results = [ job.error_result( self.tests_by_id[x], message, elapsed ) for x in self._task_ids( task ) ]
+        if isinstance( task, list ):
+            return results
+        return results[0]
+
+    def _cancelled_task( self, task, elapsed, message ):
+        """ Returns skipped results for the tests in a task that was cancelled."""
+        results = [ job.skipped_result( self.tests_by_id[x], message, elapsed ) for x in self._task_ids( task ) ]
+        if isinstance( task, list ):
+            return results
+        return results[0]
+
+    def _watch_failures( self, results, runner ):
+        """
+        Passes on results, and cancels the run on runner when the
+        number of failed tests reaches the maximum number of failures.
+        """
+        failures = 0
+        cancelled = False
+        for result in results:
+            if result['status'] in [ "ERROR", "FAILURE" ]:
+                failures += 1
+            if not cancelled and self.max_failures > 0 and failures >= self.max_failures:
+                self._write_lines( "%s tests failed, cancelling remaining tests"%failures, force_print=True )
+                runner.cancel( self.cancel_grace )
+                cancelled = True
+            yield result
+
+    def _retry_failures( self, results, runner ):
+        """
+        Passes on results, and runs tests that failed or caused errors
+        again on runner, until they succeed or have run retries + 1
+        times. The results of earlier attempts are not passed on, but
+        are listed under the key 'attempts' of the final result. If the
+        final attempt is skipped, since the run was cancelled, the last
+        failed attempt is passed on instead.
+        """
+        attempts = dict()
+        for result in results:
+            tries = attempts.setdefault( result['id'], [] )
+            if result['status'] in [ "ERROR", "FAILURE" ] and len( tries ) < self.retries:
+                tries.append( result )
+                self._write_lines( "Retrying test '%s' on a new worker, attempt %s of %s"%( result['name'], len( tries ) + 1, self.retries + 1 ), force_print=True )
+                task = result['id']
+                if self._is_async( self.tests_by_id[task]['type-name'] ) or self.setup_affinity:
+                    task = [ task ]
+                runner.retry( task )
+                continue
+            if len( tries ) > 0:
+                if result['status'] != "SKIPPED":
+                    tries.append( result )
+                result = tries[-1]
+                result['attempts'] = [ ( x['status'], x['time'] ) for x in tries ]
+                result['flaky'] = result['status'] == "SUCCESS"
+            yield result
 
     def _create_folder( self, folder ):
         """ Creates folder if does not already exist, and return an absolute path to folder."""
@@ -270,6 +1201,47 @@ class SuiteTester( object ):
             os.mkdir( mod )
         return mod
 
+    def _worker_context( self ):
+        """ Returns the multiprocessing context for the workers, or None for the default context."""
+        if self.start_method == None:
+            return None
+        context = multiprocessing.get_context( self.start_method )
+        if self.start_method == "forkserver":
+            context.set_forkserver_preload( self._preload_modules() )
+        return context
+
+    def _preload_modules( self ):
+        """ Returns the modules imported by the forkserver before it forks workers."""
+        modules = [ "lxml.etree", "acceptance_tester.framework.job" ]
+        for name in sorted( self.test_types ):
+            for key in [ 'test-runner', 'resource-manager' ]:
+                definition = TYPES[name].get( key )
+                if isinstance( definition, str ) and "." in definition:
+                    modules.append( definition.rsplit( ".", 1 )[0] )
+        return modules
+
+    def _is_async( self, test_type_name ):
+        """ Returns True if the test runner of a test type is an asyncio test runner."""
+        runner = self.test_types[test_type_name]['test-runner']
+        return isinstance( runner, type ) and issubclass( runner, AsyncTestRunner )
+
+    def _snapshot_cache_arguments( self ):
+        """
+        Returns the arguments for the setup snapshot cache used by the
+        workers, or None. The content of the resource folder is part
+        of the keys of the snapshots.
+        """
+        if self.setup_cache_size <= 0:
+            return None
+        fingerprint = setup_cache.paths_fingerprint( [ self.resource_folder ] )
+        return ( self._state_file( 'setup-cache' ), self.setup_cache_size * 1024 * 1024, self.setup_cache_hardlinks, fingerprint )
+
+    def _state_file( self, name ):
+        """ Returns path to file in the state folder, or None if no state folder is used."""
+        if self.state_folder == None:
+            return None
+        return os.path.join( self.state_folder, name )
+
     def _create_folder_name( self, suite_file, test_name ):
         """ Create folder name based on the testsuite filename and the testname """
         sname = suite_file.split( os.sep )[-1]
@@ -295,9 +1267,6 @@ class SuiteTester( object ):
         """
         parsed_results = dict()
 
-        parser = etree.XMLParser( remove_blank_text=True, encoding="UTF-8" )
-        nsmap = { 'ts': "info:testsuite#" }
-
         for result in results:
 
             if not result['test-suite'] in parsed_results:
@@ -305,47 +1274,101 @@ class SuiteTester( object ):
             else:
                 parsed_results[result['test-suite']].append( result )
         for name, data in parsed_results.items():
+            self._write_junit_file( name, data )
 
-            mod_name = [x for x in name.split( os.sep ) if x != '']
-            mod_name[-1] = mod_name[-1][:mod_name[-1].rfind( '.' )]
-            fullname = ".".join( mod_name )
-            self._create_folder( os.path.join( self.test_results_folder, "xUnit" ) )
-
-            filename = os.path.join( self.test_results_folder, "xUnit", "TEST-%s.xml"%".".join( mod_name ) )
-            ### Shorten name if testfile is in subfolder of 'testsuites'
-            if 'testsuites' in mod_name:
-                mod_name = mod_name[mod_name.index( 'testsuites' ) + 1:]
-
-            suite_path = ".".join( mod_name )
-            logger.debug( "Writing testsuite file '%s'"%filename )
-            junit_xml = Junit_testsuite( fullname )
-
-            for i, test in enumerate(data):
-                xml = etree.parse( io.BytesIO( test['xml'] ), parser )
-                def _retrieve_text( xpath ):
-                    result = xml.xpath( xpath, namespaces=nsmap )
-                    text = None
-                    if len( result ) > 0:
-                        text = result[0].text.strip()
-                    return text
-
-                description = _retrieve_text( '/wrapping/ts:test/ts:description')
-                given = _retrieve_text( '/wrapping/ts:test/ts:given')
-                when = _retrieve_text( '/wrapping/ts:test/ts:when')
-                then = _retrieve_text( '/wrapping/ts:test/ts:then')
-
-                msg = "\nDescription:\n%s\n\nGiven:\n%s\n\nWhen:\n%s\n\nThen:\n%s\n"%( description, given, when, then )
-                junit_xml.set_system_out(msg)
-
-                name = str(i) + "_" + test['name'].replace(' ', '_').replace('-', '_').replace(',', '_')
-                if len( test['errors'] ) > 0:
-                    junit_xml.add_error( suite_path, name, test['time'], "\n".join( test['errors'] ) )
-                elif len( test['failures'] ) > 0:
-                    junit_xml.add_failure( suite_path, name, test['time'], "\n".join( test['failures'] ) )
-                else:
-                    junit_xml.add_success( suite_path, name, test['time'] )
+    def _write_junit_file( self, name, data ):
+        """
+        Generates and writes test result file for a single testsuite.
+        """
+        parser = etree.XMLParser( remove_blank_text=True, encoding="UTF-8" )
+        nsmap = { 'ts': "info:testsuite#" }
+
+        mod_name = [x for x in name.split( os.sep ) if x != '']
+        mod_name[-1] = mod_name[-1][:mod_name[-1].rfind( '.' )]
+        fullname = ".".join( mod_name )
+        self._create_folder( os.path.join( self.test_results_folder, "xUnit" ) )
+
+        filename = os.path.join( self.test_results_folder, "xUnit", "TEST-%s%s.xml"%( ".".join( mod_name ), self.shard_suffix ) )
+        ### Shorten name if testfile is in subfolder of 'testsuites'
+        if 'testsuites' in mod_name:
+            mod_name = mod_name[mod_name.index( 'testsuites' ) + 1:]
+
+        suite_path = ".".join( mod_name )
+        logger.debug( "Writing testsuite file '%s'"%filename )
+        junit_xml = Junit_testsuite( fullname )
+        skipped = dict()
+        properties = dict()
+
+        for i, test in enumerate(data):
+            xml = etree.parse( io.BytesIO( test['xml'] ), parser )
+            def _retrieve_text( xpath ):
+                result = xml.xpath( xpath, namespaces=nsmap )
+                text = None
+                if len( result ) > 0:
+                    text = result[0].text.strip()
+                return text
+
+            description = _retrieve_text( '/wrapping/ts:test/ts:description')
+            given = _retrieve_text( '/wrapping/ts:test/ts:given')
+            when = _retrieve_text( '/wrapping/ts:test/ts:when')
+            then = _retrieve_text( '/wrapping/ts:test/ts:then')
+
+            msg = "\nDescription:\n%s\n\nGiven:\n%s\n\nWhen:\n%s\n\nThen:\n%s\n"%( description, given, when, then )
+            junit_xml.set_system_out(msg)
+
+            name = str(i) + "_" + rerun.junit_test_name( test['name'] )
+            if 'attempts' in test:
+                properties[name] = [ ( 'attempts', ", ".join( [ x[0] for x in test['attempts'] ] ) ),
+                                     ( 'flaky', str( test['flaky'] ).lower() ) ]
+            if test['status'] == "SKIPPED":
+                junit_xml.add_success( suite_path, name, test['time'] )
+                ### the reason follows the status line of the summary
+                skipped[name] = test['summary'][test['summary'].index( "  status: SKIPPED" ) + 2]
+            elif len( test['errors'] ) > 0:
+                junit_xml.add_error( suite_path, name, test['time'], "\n".join( test['errors'] ) )
+            elif len( test['failures'] ) > 0:
+                junit_xml.add_failure( suite_path, name, test['time'], "\n".join( test['failures'] ) )
+            else:
+                junit_xml.add_success( suite_path, name, test['time'] )
+
+        junit_xml.write( filename )
+        if len( skipped ) > 0 or len( properties ) > 0:
+            self._mark_testcases( filename, skipped, properties )
 
-            junit_xml.write( filename )
+    def _mark_testcases( self, filename, skipped, properties ):
+        """
+        Marks testcases in a written xUnit file as skipped, and adds
+        properties to testcases.
+
+        :param filename:
+            The xUnit file.
+        :type filename:
+            string
+        :param skipped:
+            Dictionary with the names of the skipped testcases as keys,
+            and the reasons they were skipped as values.
+        :type skipped:
+            dict
+        :param properties:
+            Dictionary with the names of testcases as keys, and lists
+            of name and value tuples as values.
+        :type properties:
+            dict
+        """
+        parser = etree.XMLParser( remove_blank_text=True, encoding="UTF-8" )
+        xml = etree.parse( filename, parser )
+        for testcase in xml.iter( 'testcase' ):
+            if testcase.get( 'name' ) in properties:
+                node = etree.Element( 'properties' )
+                for name, value in properties[testcase.get( 'name' )]:
+                    etree.SubElement( node, 'property', name=name, value=value )
+                testcase.insert( 0, node )
+            if testcase.get( 'name' ) in skipped:
+                etree.SubElement( testcase, 'skipped', message=skipped[testcase.get( 'name' )] )
+        if len( skipped ) > 0:
+            for testsuite in xml.iter( 'testsuite' ):
+                testsuite.set( 'skipped', str( len( skipped ) ) )
+        xml.write( filename, pretty_print=True, encoding="UTF-8", xml_declaration=True )
 
     def _write_lines( self, lines, force_print=False ):
         """
@@ -379,15 +1402,58 @@ class SuiteTester( object ):
         header.append( ( "resource folder", self.resource_folder ) )
         header.append( ( "report file", self.report_file ) )
         header.append( ( "test result folder", self.test_results_folder ) )
-        header.append( ( "pool size", self.pool_size ) )
-        header.append( ( "test type", self.test_type_name ) )
+        if self.coordinator != None:
+            header.append( ( "coordinator", "%s:%s"%self.coordinator ) )
+        else:
+            if self.pool_size_range != None:
+                header.append( ( "pool size", "auto, %s-%s, %s MB memory headroom"%( self.pool_size_range + ( self.memory_headroom, ) ) ) )
+            else:
+                header.append( ( "pool size", self.pool_size ) )
+            memory = "unlimited memory"
+            if self.capacity['memory'] != float( "inf" ):
+                memory = "%s MB memory"%int( self.capacity['memory'] )
+            header.append( ( "capacity", "%s cpus, %s"%( self.capacity['cpus'], memory ) ) )
+        header.append( ( "setup affinity", self.setup_affinity ) )
+        if True in [ self._is_async( x ) for x in self.test_types ]:
+            header.append( ( "async concurrency", self.async_concurrency ) )
+        if self.setup_cache_size > 0:
+            header.append( ( "setup cache size", "%s MB"%self.setup_cache_size ) )
+        if self.state_folder != None:
+            header.append( ( "state folder", self.state_folder ) )
+        if self.shard != None:
+            header.append( ( "shard", "%s of %s"%self.shard ) )
+        if self.test_timeout != None:
+            header.append( ( "test timeout", "%s seconds"%self.test_timeout ) )
+        if self.global_timeout != None:
+            header.append( ( "global timeout", "%s seconds"%self.global_timeout ) )
+        if self.max_failures > 0:
+            header.append( ( "max failures", self.max_failures ) )
+        if self.changed_only:
+            header.append( ( "changed only", self.changed_only ) )
+        if self.retries > 0:
+            header.append( ( "retries", self.retries ) )
+        if self.start_method != None:
+            header.append( ( "start method", self.start_method ) )
+        if self.watch:
+            header.append( ( "watch", "every %s seconds"%self.watch_interval ) )
+        if self.result_cache != None:
+            header.append( ( "result cache size", "%s results"%self.result_cache.max_entries ) )
+            if len( self.cache_artifacts ) > 0:
+                header.append( ( "cache artifacts", str( self.cache_artifacts ) ) )
         header.append( ( "number of tests", self.number_of_tests ) )
         header.append( ( "number of testsuite files", self.number_of_testsuites ) )
-        header.append( ( "test runner", self.test_type['test-runner'] ) )
-        if 'resource-manager' in self.test_type:
-            header.append( ( "resource manager", self.test_type['resource-manager'] ) )
-        if 'xsd' in self.test_type:
-            header.append( ( "xsd file", self.test_type['xsd'] ) )
+        for name in sorted( self.test_types ):
+            test_type = self.test_types[name]
+            header.append( ( "test type", name ) )
+            if len( self.test_types ) > 1:
+                header.append( ( "  number of tests", len( [ x for x in self.tests if x['type-name'] == name ] ) ) )
+            header.append( ( "  test runner", test_type['test-runner'] ) )
+            if 'resource-manager' in test_type:
+                header.append( ( "  resource manager", test_type['resource-manager'] ) )
+            if 'xsd' in test_type:
+                header.append( ( "  xsd file", test_type['xsd'] ) )
+            if name in self.type_concurrency:
+                header.append( ( "  concurrency", self.type_concurrency[name] ) )
         offset = max( [len( x[0] ) for x in header] ) + 5
         func_ppad = lambda s, l: s + ( "." * ( l - len( s ) ) )
         header = ["%s %s"%( func_ppad( x[0] + ":", offset ), x[1] ) for x in header]
@@ -416,6 +1482,9 @@ class SuiteTester( object ):
 
         errors = sum( [x['status'] == "ERROR" for x in results] )
         failures = sum( [x['status'] == "FAILURE" for x in results] )
+        skipped = sum( [x['status'] == "SKIPPED" for x in results] )
+        flaky = [ x for x in results if x.get( 'flaky', False ) ]
+        carried = sum( [x.get( 'carried-over', False ) for x in results] )
 
         prec = postc = ""
         if errors > 0:
@@ -429,11 +1498,25 @@ class SuiteTester( object ):
                 prec = colorama.Fore.YELLOW+colorama.Style.BRIGHT
                 postc = colorama.Fore.RESET+colorama.Style.RESET_ALL
             summary.append( "%s tests %sFAILED%s"%( failures, prec, postc ) )
-        if errors == 0 and failures == 0:
+        if skipped > 0:
+            if self.color:
+                prec = colorama.Fore.CYAN+colorama.Style.BRIGHT
+                postc = colorama.Fore.RESET+colorama.Style.RESET_ALL
+            summary.append( "%s tests were %sSKIPPED%s"%( skipped, prec, postc ) )
+        if len( flaky ) > 0:
+            if self.color:
+                prec = colorama.Fore.MAGENTA+colorama.Style.BRIGHT
+                postc = colorama.Fore.RESET+colorama.Style.RESET_ALL
+            summary.append( "%s tests were %sFLAKY%s, they failed before they succeeded:"%( len( flaky ), prec, postc ) )
+            for result in flaky:
+                summary.append( "  %s in %s, flaky in %s of %s runs"%( ( result['name'], result['test-suite'] ) + self.flakiness.rate( result['test-suite'], result['name'] ) ) )
+        if errors == 0 and failures == 0 and skipped == 0:
             if self.color:
                 prec = colorama.Fore.GREEN+colorama.Style.BRIGHT
                 postc = colorama.Fore.RESET+colorama.Style.RESET_ALL
             summary.append( "All tests ran %sSUCCESSFULLY%s"%( prec, postc ) )
+        if carried > 0:
+            summary.append( "%s tests were not rerun, their earlier results were used"%carried )
         summary += ["", "Duration: %s"%delta_str( delta ),
                     "=" * self.delimiter_length ]
         logger.debug( "[PERFORMANCE:(test-suite-duration, sum, %s)]"%delta )
@@ -447,7 +1530,7 @@ class SuiteTester( object ):
         return summary
 
 
-def run( test_paths, build_folder, resource_folder, test_result_folder, report_file, log_file, testrunner_config, pool_size, verbose, use_preloaded_resources, use_configured_resources, port_range, color, no_clean ):
+def run( test_paths, build_folder, resource_folder, test_result_folder, report_file, log_file, testrunner_config, pool_size, verbose, use_preloaded_resources, use_configured_resources, port_range, color, no_clean, state_folder=None, setup_affinity=False, setup_cache_size=0, setup_cache_hardlinks=False, async_concurrency=50, coordinator=None, authkey=None, shard=None, test_timeout=None, global_timeout=None, max_failures=0, cancel_grace=None, pool_size_range=None, memory_headroom=1024, capacity_cpus=None, capacity_memory=None, changed_only=False, result_cache_size=0, cache_artifacts=(), selection=None, retries=0, start_method=None, watch=False, watch_interval=1.0, type_concurrency=(), include=(), exclude=(), keyword=None ):
     """
         Initializes and runs a testsuite runner.
 
@@ -475,7 +1558,7 @@ def run( test_paths, build_folder, resource_folder, test_result_folder, report_f
         :type log_file
             string
         :param pool_size:
-            The size of the process pool.
+            The size of the process pool, or 'auto'.
         :type pool_size:
             int
         :param verbose:
@@ -495,6 +1578,120 @@ def run( test_paths, build_folder, resource_folder, test_result_folder, report_f
             If true, ansi escape codes are used to colorize output.
         :type color:
             Boolean
+        :param state_folder:
+            Folder used to keep information between runs. If None
+            nothing is kept between runs.
+        :type state_folder:
+            string
+        :param setup_affinity:
+            If true, tests from the same testsuite share a worker and setup.
+        :type setup_affinity:
+            Boolean
+        :param setup_cache_size:
+            Maximum size in megabytes of the setup snapshot cache.
+        :type setup_cache_size:
+            int
+        :param setup_cache_hardlinks:
+            If true, snapshots may be hardlinked into build folders.
+        :type setup_cache_hardlinks:
+            Boolean
+        :param async_concurrency:
+            Number of concurrent tests per worker for asyncio test runners.
+        :type async_concurrency:
+            int
+        :param coordinator:
+            If given, the address on the form host:port to serve tests to workers on.
+        :type coordinator:
+            string
+        :param authkey:
+            Key shared with the workers.
+        :type authkey:
+            string
+        :param shard:
+            If given, the shard to run on the form index/total.
+        :type shard:
+            string
+        :param test_timeout:
+            Seconds each test may run, unless overridden by the test.
+        :type test_timeout:
+            float
+        :param global_timeout:
+            Seconds all tests may run in total.
+        :type global_timeout:
+            float
+        :param max_failures:
+            If larger than 0, the number of failed tests that cancels the run.
+        :type max_failures:
+            int
+        :param cancel_grace:
+            Seconds running tests may continue after the run is cancelled.
+        :type cancel_grace:
+            float
+        :param pool_size_range:
+            Smallest and largest pool size when the pool size is 'auto'.
+        :type pool_size_range:
+            tuple with two int elements
+        :param memory_headroom:
+            Megabytes of memory to keep available when the pool size is 'auto'.
+        :type memory_headroom:
+            int
+        :param capacity_cpus:
+            CPU slots available to concurrent tests.
+        :type capacity_cpus:
+            float
+        :param capacity_memory:
+            Megabytes of memory available to concurrent tests.
+        :type capacity_memory:
+            float
+        :param changed_only:
+            If True, only changed tests and tests that did not succeed are run.
+        :type changed_only:
+            bool
+        :param result_cache_size:
+            Number of successful results kept in the result cache.
+        :type result_cache_size:
+            int
+        :param cache_artifacts:
+            Paths to files or folders that are part of the key of cached results.
+        :type cache_artifacts:
+            list of strings
+        :param selection:
+            If not None, the tests to run by testsuite file, see :class:`SuiteTester`.
+        :type selection:
+            dict
+        :param retries:
+            Number of times a failed test is run again on a new worker.
+        :type retries:
+            int
+        :param start_method:
+            The multiprocessing start method used for the workers.
+        :type start_method:
+            string
+        :param watch:
+            If True, tests affected by changes are run again until the
+            run is interrupted.
+        :type watch:
+            bool
+        :param watch_interval:
+            Seconds between checks for changes when watching.
+        :type watch_interval:
+            float
+        :param type_concurrency:
+            Limits on the number of running tests of a test type, on the form name=number.
+        :type type_concurrency:
+            list of strings
+        :param include:
+            Glob patterns of the files that may be testsuite files.
+        :type include:
+            list of strings
+        :param exclude:
+            Glob patterns of files and folders to skip when searching for testsuite files.
+        :type exclude:
+            list of strings
+        :param keyword:
+            Expression selecting the tests to run, see :mod:`acceptance_tester.framework.selection`.
+        :type keyword:
+            string
     """
     tsr = SuiteTester( test_paths,
                        build_folder,
@@ -509,6 +1706,34 @@ def run( test_paths, build_folder, resource_folder, test_result_folder, report_f
                        use_configured_resources,
                        port_range,
                        color,
-                       no_clean)
+                       no_clean,
+                       state_folder=state_folder,
+                       setup_affinity=setup_affinity,
+                       setup_cache_size=setup_cache_size,
+                       setup_cache_hardlinks=setup_cache_hardlinks,
+                       async_concurrency=async_concurrency,
+                       coordinator=coordinator,
+                       authkey=authkey,
+                       shard=shard,
+                       test_timeout=test_timeout,
+                       global_timeout=global_timeout,
+                       max_failures=max_failures,
+                       cancel_grace=cancel_grace,
+                       pool_size_range=pool_size_range,
+                       memory_headroom=memory_headroom,
+                       capacity_cpus=capacity_cpus,
+                       capacity_memory=capacity_memory,
+                       changed_only=changed_only,
+                       result_cache_size=result_cache_size,
+                       cache_artifacts=cache_artifacts,
+                       selection=selection,
+                       retries=retries,
+                       start_method=start_method,
+                       watch=watch,
+                       watch_interval=watch_interval,
+                       type_concurrency=type_concurrency,
+                       include=include,
+                       exclude=exclude,
+                       keyword=keyword )
 
     tsr.run()
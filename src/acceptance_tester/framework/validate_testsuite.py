@@ -55,6 +55,11 @@ file can be validated.
 #. Children of the root node can either be a node called 'setup' or 'test'.
 #. Only one 'setup' node is allowed
 
+The first two points are checked by :func:`has_testsuite_root`,
+which only reads the beginning of a file. Files that are not testsuite
+files, such as large xml fixtures placed next to the testsuites, are
+rejected without being parsed.
+
 """
 import logging
 from lxml import etree
@@ -76,6 +81,37 @@ logger = logging.getLogger( "dbc."+__name__ )
 logger.addHandler( NullHandler() )
 
 
+@nottest
+def has_testsuite_root( file ):
+    """
+    Checks the root node of a file, reading only as much of the file
+    as needed to find the root node.
+
+    :param file:
+        The xml file to check
+    :type file:
+        string
+
+    :return:
+        True if the root node is a testsuite node with a type
+        attribute, False otherwise
+    """
+    namespace = "{info:testsuite#}"
+
+    try:
+        fh = open( file, "rb" )
+    except IOError:
+        return False
+    try:
+        for event, element in etree.iterparse( fh, events=( "start", ) ):
+            return element.tag == "%stestsuite"%namespace and bool( element.get( "type" ) )
+    except Exception:
+        pass
+    finally:
+        fh.close()
+    return False
+
+
 @nottest
 def validate_testsuite_file( file ):
     """
@@ -91,6 +127,10 @@ def validate_testsuite_file( file ):
     """
     namespace = "{info:testsuite#}"
 
+    if not has_testsuite_root( file ):
+        logger.debug( "File '%s' is not a testsuite file"%file )
+        return None
+
     parser = etree.XMLParser( remove_blank_text=True, encoding="UTF-8" )
 
     xml = None
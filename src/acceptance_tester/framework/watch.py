@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""
+:mod:`acceptance_tester.framework.watch` -- Watches testsuite files for changes
+===============================================================================
+
+=====
+Watch
+=====
+
+This module contains the class :class:`FileWatcher`, which waits for
+changes to testsuite files and other watched files, such as the
+testrunner configuration.
+
+Changes are found by comparing the modification time and size of the
+watched files with a snapshot taken after the previous change. The
+snapshot is taken every interval seconds. If the module inotify_simple
+is installed, the watcher also wakes up when the kernel reports a
+change in a watched folder, so changes are found without waiting for
+the interval. Editors often write a file in several steps, so the
+watcher waits until the files have been quiet for a moment before it
+reports a change.
+
+The function :func:`status_changes` describes how the results of tests
+changed between two runs.
+"""
+import logging
+import os
+import time
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+from .file_walker import FileFilter
+from .scheduler import history_key
+
+
+class NullHandler( logging.Handler ):
+    """
+    Nullhandler for logging.
+    """
+
+    def emit( self, record ):
+        pass
+
+### define logger
+logger = logging.getLogger( "dbc."+__name__ )
+logger.addHandler( NullHandler() )
+
+### seconds the watched files must be unchanged before a change is reported
+SETTLE_TIME = 0.2
+
+
+class FileWatcher( object ):
+    """
+    Reports changes to testsuite files and other watched files.
+    """
+
+    def __init__( self, test_paths, other_paths=(), interval=1.0, file_filter=None ):
+        """
+        Initializes the watcher, and takes the first snapshot.
+
+        :param test_paths:
+            Paths to testsuite files, or folders searched for testsuite
+            files, which are the files selected by file_filter.
+        :type test_paths:
+            list of strings
+        :param other_paths:
+            Paths to other files or folders, where all files are watched.
+        :type other_paths:
+            list of strings
+        :param interval:
+            Seconds between snapshots.
+        :type interval:
+            float
+        :param file_filter:
+            Selects the testsuite files in test_paths, by default all
+            files ending in .xml.
+        :type file_filter:
+            :class:`acceptance_tester.framework.file_walker.FileFilter`
+        """
+        if file_filter == None:
+            file_filter = FileFilter()
+        self.file_filter = file_filter
+        self.test_paths = list( test_paths )
+        self.other_paths = list( other_paths )
+        self.interval = interval
+        self.inotify = None
+        if inotify_simple != None:
+            self.inotify = self._create_inotify()
+        self.snapshot = self._take_snapshot()
+
+    def _create_inotify( self ):
+        """ Returns an inotify instance watching all folders below the watched paths. """
+        inotify = inotify_simple.INotify()
+        flags = inotify_simple.flags
+        mask = flags.MODIFY | flags.CLOSE_WRITE | flags.CREATE | flags.DELETE | flags.MOVED_TO | flags.MOVED_FROM
+        for folder in self._folders():
+            try:
+                inotify.add_watch( folder, mask )
+            except OSError as err:
+                logger.debug( "Could not watch folder '%s': %s"%( folder, err ) )
+        return inotify
+
+    def _folders( self ):
+        """ Returns the folders holding the watched files. """
+        folders = set()
+        for path in self.test_paths + self.other_paths:
+            if os.path.isdir( path ):
+                for root, dirs, files in os.walk( path ):
+                    dirs[:] = [ x for x in dirs if not x.startswith( "." ) ]
+                    folders.add( root )
+            else:
+                folders.add( os.path.dirname( path ) )
+        return folders
+
+    def _files( self, path ):
+        """ Returns the files at or below path. """
+        if not os.path.isdir( path ):
+            return [ path ]
+        found = []
+        for root, dirs, files in os.walk( path ):
+            dirs[:] = [ x for x in dirs if not x.startswith( "." ) ]
+            found += [ os.path.join( root, x ) for x in files ]
+        return found
+
+    def _take_snapshot( self ):
+        """ Returns a dictionary with the modification time and size of each watched file. """
+        snapshot = dict()
+        watched = []
+        for path in self.test_paths:
+            watched += self.file_filter.walk( path )
+        for path in self.other_paths:
+            watched += self._files( path )
+        for filename in watched:
+            try:
+                stat = os.stat( filename )
+            except OSError:
+                continue
+            snapshot[filename] = ( stat.st_mtime_ns, stat.st_size )
+        return snapshot
+
+    def _wait( self, timeout ):
+        """ Waits up to timeout seconds, or until inotify reports an event. """
+        if self.inotify == None:
+            time.sleep( timeout )
+            return
+        if len( self.inotify.read( timeout=int( timeout * 1000 ) ) ) > 0:
+            ### new folders are added to the watches
+            self.inotify.close()
+            self.inotify = self._create_inotify()
+
+    def changes( self ):
+        """
+        Returns the paths of the files that were changed, created or
+        removed since the previous call, without waiting.
+        """
+        snapshot = self._take_snapshot()
+        changed = set( [ x for x in snapshot if snapshot[x] != self.snapshot.get( x ) ] )
+        changed.update( [ x for x in self.snapshot if not x in snapshot ] )
+        self.snapshot = snapshot
+        return changed
+
+    def wait_for_changes( self ):
+        """
+        Waits until watched files change, and returns the paths of the
+        files that were changed, created or removed.
+        """
+        changed = set()
+        while len( changed ) == 0:
+            self._wait( self.interval )
+            changed = self.changes()
+        ### wait for writes in progress to finish
+        more = changed
+        while len( more ) > 0:
+            time.sleep( SETTLE_TIME )
+            more = self.changes()
+            changed.update( more )
+        logger.debug( "Watched files changed: %s"%sorted( changed ) )
+        return changed
+
+    def close( self ):
+        """
+        Stops watching.
+        """
+        if self.inotify != None:
+            self.inotify.close()
+            self.inotify = None
+
+
+def status_changes( previous, results ):
+    """
+    Returns lines describing how the status of tests changed.
+
+    :param previous:
+        Dictionary with keys as returned by
+        :func:`acceptance_tester.framework.scheduler.history_key`, and
+        the status of the test in the previous run as values.
+    :type previous:
+        dict
+    :param results:
+        The new results, as returned by
+        :func:`acceptance_tester.framework.job.job`.
+    :type results:
+        list
+    """
+    lines = []
+    for result in sorted( results, key=lambda x: ( x['test-suite'], x['name'] ) ):
+        old = previous.get( history_key( result['test-suite'], result['name'] ) )
+        if old == None:
+            lines.append( "  %s (%s): new, %s"%( result['name'], result['test-suite'], result['status'] ) )
+        elif old != result['status']:
+            lines.append( "  %s (%s): %s -> %s"%( result['name'], result['test-suite'], old, result['status'] ) )
+    return lines
@@ -0,0 +1,520 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""
+:mod:`acceptance_tester.framework.worker_pool` -- Supervised process pool
+=========================================================================
+
+===========
+Worker Pool
+===========
+
+This module contains the class :class:`WorkerPool`, a process pool
+which, unlike :class:`multiprocessing.Pool`, knows which task each
+worker is running. This lets the pool enforce a timeout for each task
+and a deadline for the whole run.
+
+A worker running a task past its timeout is killed and replaced by a
+new worker, and the task is reported through a callback instead of
+through its result. The same happens if a worker dies while running a
+task. The remaining tasks are not affected.
+
+The number of workers can be adjusted during the run by an
+:class:`AdaptivePoolSize`, which reads the load average and the
+available memory of the host from /proc.
+
+Tasks that should be run again, such as failed tests, can be added
+with :meth:`WorkerPool.retry` while the results are consumed. They are
+run before the remaining tasks, each on a newly started worker.
+
+A run can be cancelled with :meth:`WorkerPool.cancel` while its
+results are consumed. Pending tasks are then reported through a
+callback, and running tasks are allowed to finish, or are stopped after
+a grace period.
+
+Killing a worker does not run the shutdown hooks of the test it was
+running, so services started by that test may be left running.
+"""
+import collections
+import logging
+import multiprocessing
+import os
+import time
+import traceback
+from datetime import timedelta
+from multiprocessing.connection import wait
+
+
+class NullHandler( logging.Handler ):
+    """
+    Nullhandler for logging.
+    """
+
+    def emit( self, record ):
+        pass
+
+### define logger
+logger = logging.getLogger( "dbc."+__name__ )
+logger.addHandler( NullHandler() )
+
+
+def _load_average():
+    """ Returns the load average of the last minute, or None if it can not be read. """
+    try:
+        fh = open( "/proc/loadavg" )
+        content = fh.read()
+        fh.close()
+        return float( content.split()[0] )
+    except ( IOError, ValueError, IndexError ):
+        return None
+
+
+def available_memory():
+    """ Returns the available memory in bytes, or None if it can not be read. """
+    try:
+        fh = open( "/proc/meminfo" )
+        lines = fh.readlines()
+        fh.close()
+    except IOError:
+        return None
+    for line in lines:
+        if line.startswith( "MemAvailable:" ):
+            return int( line.split()[1] ) * 1024
+    return None
+
+
+class AdaptivePoolSize( object ):
+    """
+    Adjusts the number of workers to the CPU and memory pressure of the host.
+
+    The size starts at the floor. While tasks are waiting for a worker,
+    a worker is added each interval, as long as the load average is
+    below the number of CPUs and more memory than the headroom is
+    available. A worker is removed each interval while the available
+    memory is below the headroom, or the load average is above the
+    number of CPUs plus one.
+    """
+
+    def __init__( self, floor, ceiling, memory_headroom, interval=5.0 ):
+        """
+        :param floor:
+            The smallest number of workers.
+        :type floor:
+            int
+        :param ceiling:
+            The largest number of workers.
+        :type ceiling:
+            int
+        :param memory_headroom:
+            Bytes of memory to keep available on the host.
+        :type memory_headroom:
+            int
+        :param interval:
+            Seconds between adjustments.
+        :type interval:
+            float
+        """
+        self.floor = floor
+        self.ceiling = ceiling
+        self.memory_headroom = memory_headroom
+        self.interval = interval
+        self.cpus = os.cpu_count() or 1
+        self.size = floor
+        self.adjusted = time.monotonic()
+
+    def update( self, wanted ):
+        """
+        Returns the number of workers to use now.
+
+        :param wanted:
+            The number of tasks running or waiting to run.
+        :type wanted:
+            int
+        """
+        now = time.monotonic()
+        if now - self.adjusted < self.interval:
+            return self.size
+        self.adjusted = now
+
+        load = _load_average()
+        available = available_memory()
+        if load == None or available == None:
+            return self.size
+
+        size = self.size
+        if available < self.memory_headroom or load > self.cpus + 1:
+            size = max( self.floor, size - 1 )
+        elif wanted > size and load < self.cpus:
+            size = min( self.ceiling, size + 1 )
+
+        if size != self.size:
+            logger.info( "Changing pool size from %s to %s (load %s, %s MB available)"%( self.size, size, load, available // ( 1024 * 1024 ) ) )
+            self.size = size
+        return self.size
+
+
+def _worker_main( conn, initializer, initargs ):
+    """ Runs tasks received on conn until the connection is closed. """
+    if initializer != None:
+        initializer( *initargs )
+    while True:
+        try:
+            task = conn.recv()
+        except ( EOFError, KeyboardInterrupt ):
+            ### an idle worker exits quietly on Ctrl-C
+            break
+        if task == None:
+            break
+        func, arg = task
+        try:
+            conn.send( ( True, func( arg ) ) )
+        except Exception:
+            conn.send( ( False, traceback.format_exc() ) )
+    conn.close()
+
+
+class _Worker( object ):
+    """ A worker process and the task it is running. """
+
+    def __init__( self, context, initializer, initargs ):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process( target=_worker_main, args=( child_conn, initializer, initargs ) )
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        self.task = None
+        self.started = None
+        self.deadline = None
+
+    def start_task( self, func, task, timeout ):
+        self.task = task
+        self.started = time.monotonic()
+        self.deadline = None
+        if timeout != None:
+            self.deadline = self.started + timeout
+        self.conn.send( ( func, task ) )
+
+    def elapsed( self ):
+        return timedelta( seconds=time.monotonic() - self.started )
+
+    def kill( self ):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class WorkerPool( object ):
+    """
+    Process pool supervising the tasks of its workers.
+    """
+
+    def __init__( self, processes, initializer=None, initargs=(), context=None, sizer=None ):
+        """
+        Starts the worker processes.
+
+        :param processes:
+            Number of worker processes.
+        :type processes:
+            int
+        :param initializer:
+            If not None, each worker calls initializer( \\*initargs )
+            when it starts. Replacement workers are initialized as well.
+        :type initializer:
+            function
+        :param initargs:
+            Arguments to the initializer.
+        :type initargs:
+            tuple
+        :param context:
+            The multiprocessing context used to start workers. The
+            default context is used if None.
+        :type context:
+            multiprocessing.context.BaseContext
+        :param sizer:
+            If not None, the :class:`AdaptivePoolSize` deciding the
+            number of workers during a run. processes is then ignored,
+            and the pool starts with the floor of the sizer.
+        :type sizer:
+            AdaptivePoolSize
+        """
+        self.initializer = initializer
+        self.initargs = initargs
+        self.context = context
+        if self.context == None:
+            self.context = multiprocessing.get_context()
+        self.sizer = sizer
+        if self.sizer != None:
+            processes = self.sizer.size
+        self.workers = [ self._spawn() for i in range( processes ) ]
+        self.retired = []
+        self.cancelled = False
+        self.cancel_deadline = None
+        self.budget = None
+        self.retried = collections.deque()
+        self.pending = collections.deque()
+
+    def _spawn( self ):
+        return _Worker( self.context, self.initializer, self.initargs )
+
+    def imap_unordered( self, func, tasks, timeout=None, on_lost=None, deadline=None, on_cancelled=None, budget=None ):
+        """
+        Runs func on each task, one task at a time in each worker, and
+        yields the results in completion order.
+
+        :param func:
+            Picklable function called with a task as argument.
+        :type func:
+            function
+        :param tasks:
+            Picklable arguments for func.
+        :type tasks:
+            iterable
+        :param timeout:
+            If not None, a function returning the timeout in seconds of
+            a task, or None if the task has no timeout.
+        :type timeout:
+            function
+        :param on_lost:
+            Function called with the task, the elapsed time and a
+            message, when a task is not completed. Its return value is
+            yielded in place of the result of the task. Tasks are lost
+            when they time out, when their worker dies, and when the
+            deadline is passed. If None, a lost task raises
+            RuntimeError.
+        :type on_lost:
+            function
+        :param deadline:
+            If not None, the :func:`time.monotonic` time after which no
+            tasks are started, and running tasks are stopped.
+        :type deadline:
+            float
+        :param on_cancelled:
+            Function called like on_lost, for tasks that are not run or
+            are stopped because the run is cancelled. If None, on_lost
+            is used.
+        :type on_cancelled:
+            function
+        :param budget:
+            If not None, a
+            :class:`acceptance_tester.framework.scheduler.ResourceBudget`.
+            Tasks are only started when they fit in the budget. The
+            first pending task that fits is started, so tasks keep
+            their order as far as the budget allows.
+        :type budget:
+            ResourceBudget
+
+        :raise RuntimeError:
+            If func raises, with the traceback from the worker.
+        """
+        if on_lost == None:
+            def on_lost( task, elapsed, message ):
+                raise RuntimeError( message )
+        if on_cancelled == None:
+            on_cancelled = on_lost
+
+        self.cancelled = False
+        self.cancel_deadline = None
+        self.budget = budget
+        self.retried = collections.deque()
+        self.pending = collections.deque( tasks )
+        pending = self.pending
+        while len( pending ) > 0 or len( self.retried ) > 0 or self._busy():
+            if self.cancelled:
+                for queue in [ self.retried, pending ]:
+                    while len( queue ) > 0:
+                        yield on_cancelled( queue.popleft(), timedelta(), "Test not run, since the run was cancelled" )
+                if self.cancel_deadline != None and time.monotonic() >= self.cancel_deadline:
+                    for worker in self._busy():
+                        yield self._replace( worker, on_cancelled, "Test stopped, since the run was cancelled" )
+                    continue
+
+            if deadline != None and time.monotonic() >= deadline:
+                pending.extendleft( reversed( self.retried ) )
+                self.retried.clear()
+                for result in self._stop_all( pending, on_lost ):
+                    yield result
+                return
+
+            limit = len( self.workers )
+            if self.sizer != None:
+                limit = self._resize( self.sizer.update( len( self._busy() ) + len( pending ) + len( self.retried ) ) )
+            running = len( self._busy() )
+            for worker in list( self.workers ):
+                if worker.task != None or running >= limit:
+                    continue
+                queue = self.retried
+                index = self._next_task( queue )
+                if index == None:
+                    queue = pending
+                    index = self._next_task( queue )
+                if index == None:
+                    break
+                task = queue[index]
+                del queue[index]
+                if queue is self.retried:
+                    worker = self._refresh( worker )
+                if self.budget != None:
+                    self.budget.acquire( task )
+                worker.start_task( func, task, timeout( task ) if timeout != None else None )
+                running += 1
+
+            busy = self._busy()
+            if len( busy ) == 0:
+                continue
+            deadlines = [ x.deadline for x in busy if x.deadline != None ]
+            if deadline != None:
+                deadlines.append( deadline )
+            if self.cancel_deadline != None:
+                deadlines.append( self.cancel_deadline )
+            if self.sizer != None and len( pending ) + len( self.retried ) > 0:
+                deadlines.append( time.monotonic() + self.sizer.interval )
+            wait_time = None
+            if len( deadlines ) > 0:
+                wait_time = max( 0, min( deadlines ) - time.monotonic() )
+            wait( [ x.conn for x in busy ] + [ x.process.sentinel for x in busy ], wait_time )
+
+            now = time.monotonic()
+            for worker in busy:
+                received = None
+                died = not worker.process.is_alive()
+                if worker.conn.poll():
+                    try:
+                        received = worker.conn.recv()
+                    except EOFError:
+                        died = True
+                if received != None:
+                    task = self._end_task( worker )
+                    ok, result = received
+                    if not ok:
+                        raise RuntimeError( "Task '%s' raised in worker:\n%s"%( task, result ) )
+                    yield result
+                elif died:
+                    worker.process.join()
+                    message = "Worker running the test died with exit code %s"%worker.process.exitcode
+                    yield self._replace( worker, on_lost, message )
+                elif worker.deadline != None and now >= worker.deadline:
+                    message = "Test timed out after %s seconds"%round( worker.deadline - worker.started, 3 )
+                    yield self._replace( worker, on_lost, message )
+
+    def cancel( self, grace=None ):
+        """
+        Cancels the run in progress in :meth:`imap_unordered`. No more
+        tasks are started.
+
+        :param grace:
+            Seconds running tasks may continue before they are stopped.
+            If None they are allowed to finish.
+        :type grace:
+            float
+        """
+        self.cancelled = True
+        if grace != None:
+            self.cancel_deadline = time.monotonic() + grace
+
+    def add( self, task ):
+        """
+        Adds a task to the pending tasks of the run in progress in
+        :meth:`imap_unordered`. The task is started after the tasks
+        already pending, on an idle worker.
+
+        :param task:
+            Picklable argument for the function of the run.
+        :type task:
+            object
+        """
+        self.pending.append( task )
+
+    def retry( self, task ):
+        """
+        Adds a task to the run in progress in :meth:`imap_unordered`.
+        The task is started before the pending tasks, on a newly
+        started worker, so it does not share a process with the tasks
+        run before.
+
+        :param task:
+            Picklable argument for the function of the run.
+        :type task:
+            object
+        """
+        self.retried.append( task )
+
+    def _refresh( self, worker ):
+        """ Retires an idle worker, and returns a new worker started in its place. """
+        self.workers.remove( worker )
+        worker.conn.send( None )
+        self.retired.append( worker )
+        fresh = self._spawn()
+        self.workers.append( fresh )
+        return fresh
+
+    def _next_task( self, pending ):
+        """ Returns the index of the next pending task to start, or None if no task can be started. """
+        if len( pending ) == 0:
+            return None
+        if self.budget == None:
+            return 0
+        for index, task in enumerate( pending ):
+            if self.budget.fits( task ):
+                return index
+        return None
+
+    def _end_task( self, worker ):
+        """ Marks the worker as idle, and returns the task it ran. """
+        task = worker.task
+        worker.task = None
+        if self.budget != None:
+            self.budget.release( task )
+        return task
+
+    def _resize( self, size ):
+        """ Starts or retires workers, so the pool has size workers once the busy workers are done. """
+        while len( self.workers ) < size:
+            self.workers.append( self._spawn() )
+        for worker in [ x for x in self.workers if x.task == None ]:
+            if len( self.workers ) <= size:
+                break
+            self.workers.remove( worker )
+            worker.conn.send( None )
+            self.retired.append( worker )
+        return size
+
+    def _busy( self ):
+        return [ x for x in self.workers if x.task != None ]
+
+    def _replace( self, worker, on_lost, message ):
+        """ Kills worker, starts a new worker in its place, and reports its task as lost. """
+        logger.error( "%s. Replacing worker %s"%( message, worker.process.pid ) )
+        elapsed = worker.elapsed()
+        task = self._end_task( worker )
+        worker.kill()
+        self.workers[self.workers.index( worker )] = self._spawn()
+        return on_lost( task, elapsed, message )
+
+    def _stop_all( self, pending, on_lost ):
+        """ Stops running tasks, and reports them and the pending tasks as lost. """
+        logger.error( "Deadline for the run passed, stopping %s running and %s pending tasks"%( len( self._busy() ), len( pending ) ) )
+        results = []
+        for worker in self._busy():
+            results.append( self._replace( worker, on_lost, "Test stopped, since the time limit for the run was exceeded" ) )
+        while len( pending ) > 0:
+            results.append( on_lost( pending.popleft(), timedelta(), "Test not run, since the time limit for the run was exceeded" ) )
+        return results
+
+    def close( self ):
+        """ Lets the workers exit, once they are idle. """
+        for worker in self.workers:
+            try:
+                worker.conn.send( None )
+            except ( OSError, ValueError ):
+                pass
+
+    def join( self ):
+        """ Waits for the workers to exit. """
+        for worker in self.workers + self.retired:
+            worker.process.join()
+            worker.conn.close()
+
+    def terminate( self ):
+        """ Kills all workers. """
+        for worker in self.workers + self.retired:
+            worker.kill()
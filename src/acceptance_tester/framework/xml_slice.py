@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""
+:mod:`acceptance_tester.framework.xml_slice` -- Tests as byte ranges in testsuite files
+======================================================================================
+
+=========
+Xml Slice
+=========
+
+This module contains the class :class:`XmlSlice`, which refers to the
+wrapped xml of a test by the byte ranges of its setup and test nodes
+in the testsuite file.
+
+Discovery records the ranges instead of copies of the xml, so the
+main process does not hold a second copy of every testsuite, and each
+worker reads and parses only the part of the file belonging to its
+own test. The file is memory mapped when it is read.
+
+A node cut out of its file loses the namespace declarations of the
+testsuite node. These are added to the start tag of the node when
+the slice is read. Files with a document type declaration, which may
+define entities used by the nodes, and files not encoded in UTF-8 or
+ASCII are not sliced; their tests keep the wrapped xml as a string.
+
+A slice records the size and modification time of its file, and
+raises an error if it is read after the file changed. The worker
+running the test reports this as an error result of the test, see
+:func:`acceptance_tester.framework.job.job`.
+"""
+import hashlib
+import logging
+import mmap
+import os
+import re
+from xml.parsers import expat
+from xml.sax.saxutils import quoteattr
+
+
+class NullHandler( logging.Handler ):
+    """
+    Nullhandler for logging.
+    """
+
+    def emit( self, record ):
+        pass
+
+### define logger
+logger = logging.getLogger( "dbc."+__name__ )
+logger.addHandler( NullHandler() )
+
+_NAMESPACE_DECLARATION = re.compile( r"\sxmlns(?::([^\s=]+))?\s*=" )
+_TAG_NAME = re.compile( r"<[^\s/>]+" )
+
+
+def _map( fh ):
+    """ Returns the content of an open file, memory mapped if possible. """
+    try:
+        return mmap.mmap( fh.fileno(), 0, access=mmap.ACCESS_READ )
+    except ( ValueError, OSError ):
+        ### empty files and some file systems cannot be mapped
+        return fh.read()
+
+
+def _tag_end( data, position ):
+    """ Returns the position after the tag starting at position, skipping quoted attribute values. """
+    quote = None
+    while position < len( data ):
+        char = data[position:position + 1]
+        if quote != None:
+            if char == quote:
+                quote = None
+        elif char in ( b'"', b"'" ):
+            quote = char
+        elif char == b">":
+            return position + 1
+        position += 1
+    raise ValueError( "Unterminated tag" )
+
+
+def _child_ranges( data ):
+    """ Returns the start and end positions of the children of the root node. """
+    parser = expat.ParserCreate()
+    ranges = []
+    state = { 'depth': 0, 'start': None }
+
+    def _start( name, attributes ):
+        state['depth'] += 1
+        if state['depth'] == 2:
+            state['start'] = parser.CurrentByteIndex
+
+    def _end( name ):
+        if state['depth'] == 2:
+            start_end = _tag_end( data, state['start'] )
+            if data[start_end - 2:start_end] == b"/>":
+                ranges.append( ( state['start'], start_end ) )
+            else:
+                ranges.append( ( state['start'], _tag_end( data, parser.CurrentByteIndex ) ) )
+        state['depth'] -= 1
+
+    parser.StartElementHandler = _start
+    parser.EndElementHandler = _end
+    parser.Parse( data, True )
+    return ranges
+
+
+def _declarations( start_tag, namespaces ):
+    """ Returns the namespace declarations missing in start_tag. """
+    declared = set( [ x.group( 1 ) for x in _NAMESPACE_DECLARATION.finditer( start_tag ) ] )
+    declarations = []
+    for prefix, uri in sorted( namespaces.items(), key=lambda x: x[0] or "" ):
+        if not prefix in declared:
+            name = "xmlns"
+            if prefix != None:
+                name = "xmlns:%s"%prefix
+            declarations.append( " %s=%s"%( name, quoteattr( uri ) ) )
+    return "".join( declarations )
+
+
+def _wrap( name, data, ranges ):
+    """ Returns the wrapped xml of the nodes in ranges of data. """
+    parts = [ "<wrapping name=\"%s\">"%name ]
+    for start, end, declarations in ranges:
+        node = bytes( data[start:end] ).decode( 'UTF-8' )
+        name_end = _TAG_NAME.match( node ).end()
+        parts.append( node[:name_end] + declarations + node[name_end:] )
+    parts.append( "</wrapping>" )
+    return "".join( parts )
+
+
+class XmlSlice( object ):
+    """
+    The wrapped xml of a test, as byte ranges in its testsuite file.
+    """
+
+    def __init__( self, path, name, ranges, size, mtime, digest ):
+        """
+        Initializes the slice. Slices are created by :func:`slice_suite`.
+
+        :param path:
+            Path to the testsuite file.
+        :type path:
+            string
+        :param name:
+            Name of the test.
+        :type name:
+            string
+        :param ranges:
+            The start and end positions of the setup node, if any, and
+            the test node, each with the namespace declarations added to
+            the node.
+        :type ranges:
+            list of tuples
+        :param size:
+            Size of the file when the slice was made.
+        :type size:
+            int
+        :param mtime:
+            Modification time of the file in nanoseconds when the slice was made.
+        :type mtime:
+            int
+        :param digest:
+            Hash of the wrapped xml, see :func:`acceptance_tester.framework.manifest.xml_hash`.
+        :type digest:
+            string
+        """
+        self.path = path
+        self.name = name
+        self.ranges = [ tuple( x ) for x in ranges ]
+        self.size = size
+        self.mtime = mtime
+        self.digest = digest
+
+    def __eq__( self, other ):
+        return isinstance( other, XmlSlice ) and self.to_list() == other.to_list()
+
+    def __ne__( self, other ):
+        return not self == other
+
+    def __hash__( self ):
+        return hash( ( self.path, self.name, self.digest ) )
+
+    def read( self ):
+        """
+        Returns the wrapped xml of the test as a string.
+
+        :raise RuntimeError:
+            If the testsuite file changed since the slice was made.
+        """
+        fh = open( self.path, 'rb' )
+        try:
+            stat = os.fstat( fh.fileno() )
+            if stat.st_size != self.size or stat.st_mtime_ns != self.mtime:
+                raise RuntimeError( "Testsuite file '%s' changed since test '%s' was found"%( self.path, self.name ) )
+            data = _map( fh )
+            try:
+                return _wrap( self.name, data, self.ranges )
+            finally:
+                if isinstance( data, mmap.mmap ):
+                    data.close()
+        finally:
+            fh.close()
+
+    def to_list( self ):
+        """ Returns the slice as a list, which can be written as json. """
+        return [ self.path, self.name, [ list( x ) for x in self.ranges ], self.size, self.mtime, self.digest ]
+
+    @classmethod
+    def from_list( cls, values ):
+        """ Returns the slice written by :meth:`to_list`. """
+        return cls( *values )
+
+
+def wrapped_xml( xml ):
+    """
+    Returns the wrapped xml of a test as a string.
+
+    :param xml:
+        The wrapped xml as a string, or an :class:`XmlSlice`.
+    """
+    if isinstance( xml, XmlSlice ):
+        return xml.read()
+    return xml
+
+
+def slice_suite( path, xml ):
+    """
+    Returns a list with an :class:`XmlSlice` for each test in a
+    testsuite file, in document order. None is returned if the file
+    cannot be sliced.
+
+    :param path:
+        Path to the testsuite file.
+    :type path:
+        string
+    :param xml:
+        The parsed testsuite file.
+    :type xml:
+        lxml.etree._ElementTree
+    """
+    encoding = ( xml.docinfo.encoding or "UTF-8" ).upper()
+    if xml.docinfo.doctype or not encoding in [ "UTF-8", "UTF8", "ASCII", "US-ASCII" ]:
+        return None
+
+    root = xml.getroot()
+    children = [ x for x in root if isinstance( x.tag, str ) ]
+    fh = open( path, 'rb' )
+    try:
+        stat = os.fstat( fh.fileno() )
+        data = _map( fh )
+        try:
+            try:
+                ranges = _child_ranges( data )
+            except ( expat.ExpatError, ValueError ) as err:
+                logger.debug( "Could not slice testsuite file '%s': %s"%( path, err ) )
+                return None
+            if len( ranges ) != len( children ):
+                return None
+
+            ranges = [ ( start, end, _declarations( bytes( data[start:_tag_end( data, start )] ).decode( 'UTF-8' ), root.nsmap ) )
+                       for start, end in ranges ]
+            setup = [ x for node, x in zip( children, ranges ) if node.tag == "{info:testsuite#}setup" ][:1]
+            slices = []
+            for node, node_range in zip( children, ranges ):
+                if node.tag != "{info:testsuite#}test":
+                    continue
+                test_ranges = setup + [ node_range ]
+                digest = hashlib.sha1( _wrap( node.get( "name" ), data, test_ranges ).encode( 'UTF-8' ) ).hexdigest()
+                slices.append( XmlSlice( path, node.get( "name" ), test_ranges, stat.st_size, stat.st_mtime_ns, digest ) )
+            return slices
+        finally:
+            if isinstance( data, mmap.mmap ):
+                data.close()
+    finally:
+        fh.close()
@@ -6,22 +6,30 @@ from optparse import OptionParser
 import datetime
 
 import acceptance_tester.framework.find_tests as find_tests
+import acceptance_tester.framework.discovery_index as discovery_index
+import acceptance_tester.framework.xml_slice as xml_slice
 import acceptance_tester.framework.rst_creator as rst_creator
 
 
-def create_report( test_folder, output_folder, start, delta ):
+def create_report( test_folder, output_folder, start, delta, state_folder=None ):
+
+    index = None
+    if state_folder != None:
+        if not os.path.exists( state_folder ):
+            os.mkdir( state_folder )
+        index = discovery_index.DiscoveryIndex( os.path.join( state_folder, 'discovery-index.json' ) )
 
-    test_type, test_type_name, tests = find_tests.find_valid_tests( [test_folder], None )
     data = []
 
-    for test in tests:
+    for test_type, test_type_name, tests in find_tests.find_typed_tests( [test_folder], None, index ):
+        for test in tests:
 
-        entry = { 'xml': test[2],
-                  'type-name': test_type_name,
-                  'build-folder': test[0],
-                  'test-suite': test[0] }
+            entry = { 'xml': xml_slice.wrapped_xml( test[2] ).encode( 'UTF-8' ),
+                      'type-name': test_type_name,
+                      'build-folder': test[0],
+                      'test-suite': test[0] }
 
-        data.append( entry )
+            data.append( entry )
 
     rst_creator.create_test_documentation( data, output_folder, start, delta )
 
@@ -60,6 +68,10 @@ def cli():
                                This is the format you get if you print a python datetime.datetime object""",
                        default=None )
 
+    parser.add_option( "--state-folder", type="string", action="store", dest="state_folder",
+                       help="Folder keeping the discovery index shared with suite_test, so unchanged testsuite files are not parsed again.",
+                       default=None )
+
     ( options, args ) = parser.parse_args()
 
     if len(args) < 2:
@@ -75,5 +87,5 @@ def cli():
     start_time = parse_datetimestr( options.start_time )
     end_time = parse_datetimestr( options.end_time )
 
-    create_report( os.path.abspath( args[0] ), os.path.abspath( args[1] ), start_time, end_time-start_time )
+    create_report( os.path.abspath( args[0] ), os.path.abspath( args[1] ), start_time, end_time-start_time, options.state_folder )
 
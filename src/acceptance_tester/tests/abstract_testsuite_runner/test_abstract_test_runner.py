@@ -168,3 +168,130 @@ class TestSuiteTester( unittest.TestCase ):
 
         self.assertRaises( RuntimeError, tr.parse, etree.fromstring( testsuite ) )
         self.assertEqual( 1, tr.shutdown.call_count )
+
+    def test_parser_with_keep_setup_runs_setup_once( self ):
+        """ test whether the setup is only run for the first test when keep_setup is set
+        """
+        testsuite = '''<wrapping name="facet genreCategory">
+                        <setup xmlns="info:testsuite#"
+                               xmlns:s="http://dbc.dk/xml/namespaces/solr">
+                         <s:service/>
+                        </setup>
+                        <test xmlns="info:testsuite#"
+                              xmlns:s="http://dbc.dk/xml/namespaces/solr"
+                              name="facet genreCategory">
+                        </test>
+                       </wrapping>'''
+
+        calls = []
+        def setup( node ):
+            calls.append( 'setup' )
+
+        def shutdown( save_logfile ):
+            calls.append( 'shutdown' )
+            return ( ['SHUTDOWN-OUTPUT'], [], [] )
+
+        tr = testrunner.TestRunner( 'testpath', 1, self.logfolder )
+        tr.setup_functions.update( {'{http://dbc.dk/xml/namespaces/solr}service': { 'setup': setup, 'shutdown': shutdown } } )
+        tr.keep_setup = True
+
+        tr.parse( etree.fromstring( testsuite ) )
+        tr.prepare_test( 2, self.logfolder )
+        tr.parse( etree.fromstring( testsuite ) )
+        self.assertEqual( ['setup'], calls )
+
+        tr.shutdown_setup()
+        self.assertEqual( ['setup', 'shutdown'], calls )
+        self.assertEqual( ['SHUTDOWN-OUTPUT'], tr.output )
+
+    def test_parser_with_keep_setup_runs_setup_again_if_it_failed( self ):
+        """ test whether a failed setup is shut down with its test, and run again by the next test
+        """
+        testsuite = '''<wrapping name="facet genreCategory">
+                        <setup xmlns="info:testsuite#"
+                               xmlns:s="http://dbc.dk/xml/namespaces/solr">
+                         <s:service/>
+                        </setup>
+                        <test xmlns="info:testsuite#"
+                              xmlns:s="http://dbc.dk/xml/namespaces/solr"
+                              name="facet genreCategory">
+                        </test>
+                       </wrapping>'''
+
+        calls = []
+        def setup( node ):
+            calls.append( 'setup' )
+            if calls.count( 'setup' ) == 1:
+                tr.errors.append( 'SETUP-ERROR' )
+
+        def shutdown( save_logfile ):
+            calls.append( 'shutdown' )
+            return ( [], [], [] )
+
+        tr = testrunner.TestRunner( 'testpath', 1, self.logfolder )
+        tr.setup_functions.update( {'{http://dbc.dk/xml/namespaces/solr}service': { 'setup': setup, 'shutdown': shutdown } } )
+        tr.keep_setup = True
+
+        tr.parse( etree.fromstring( testsuite ) )
+        self.assertEqual( ['setup', 'shutdown'], calls )
+        self.assertEqual( ['SETUP-ERROR'], tr.errors )
+
+        tr.prepare_test( 2, self.logfolder )
+        tr.parse( etree.fromstring( testsuite ) )
+        self.assertEqual( ['setup', 'shutdown', 'setup'], calls )
+        self.assertEqual( [], tr.errors )
+
+        tr.shutdown_setup()
+        self.assertEqual( ['setup', 'shutdown', 'setup', 'shutdown'], calls )
+
+    def test_prepare_test_clears_results_of_previous_test( self ):
+        """ test whether prepare_test gives the next test fresh result lists
+        """
+        tr = testrunner.TestRunner( 'testpath', 1, self.logfolder )
+        failures = tr.failures
+        failures.append( 'TEST-FAIL' )
+
+        tr.prepare_test( 2, 'other-logfolder' )
+        self.assertEqual( [], tr.failures )
+        self.assertEqual( ['TEST-FAIL'], failures )
+        self.assertEqual( 2, tr.id )
+        self.assertEqual( 'other-logfolder', tr.logfolder )
+
+    def test_parser_calls_setup_snapshot_after_setup( self ):
+        """ test whether the setup snapshot callback is called once the setup has run
+        """
+        testsuite = '''<wrapping name="facet genreCategory">
+                        <setup xmlns="info:testsuite#"
+                               xmlns:s="http://dbc.dk/xml/namespaces/solr">
+                        </setup>
+                        <test xmlns="info:testsuite#"
+                              xmlns:s="http://dbc.dk/xml/namespaces/solr"
+                              name="facet genreCategory">
+                        </test>
+                       </wrapping>'''
+
+        snapshot = Mock()
+        tr = testrunner.TestRunner( 'testpath', 1, self.logfolder )
+        tr.setup_snapshot = snapshot
+        tr.parse( etree.fromstring( testsuite ) )
+        self.assertEqual( 1, snapshot.call_count )
+
+    def test_parser_does_not_call_setup_snapshot_if_setup_failed( self ):
+        """ test whether no snapshot is taken if the setup reported failures
+        """
+        testsuite = '''<wrapping name="facet genreCategory">
+                        <setup xmlns="info:testsuite#"
+                               xmlns:s="http://dbc.dk/xml/namespaces/solr">
+                         <s:foo type="normal"/>
+                        </setup>
+                        <test xmlns="info:testsuite#"
+                              xmlns:s="http://dbc.dk/xml/namespaces/solr"
+                              name="facet genreCategory">
+                        </test>
+                       </wrapping>'''
+
+        snapshot = Mock()
+        tr = testrunner.TestRunner( 'testpath', 1, self.logfolder )
+        tr.setup_snapshot = snapshot
+        tr.parse( etree.fromstring( testsuite ) )
+        self.assertEqual( 0, snapshot.call_count )
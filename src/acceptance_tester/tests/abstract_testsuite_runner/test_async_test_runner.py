@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+import asyncio
+import os
+import unittest
+import shutil
+import tempfile
+from lxml import etree
+
+import acceptance_tester.abstract_testsuite_runner.async_test_runner as async_test_runner
+
+
+testsuite = '''<wrapping name="facet genreCategory">
+                <setup xmlns="info:testsuite#"
+                       xmlns:s="http://dbc.dk/xml/namespaces/solr">
+                 <s:service/>
+                </setup>
+                <test xmlns="info:testsuite#"
+                      xmlns:s="http://dbc.dk/xml/namespaces/solr"
+                      name="facet genreCategory">
+                 <s:myfunc/>
+                 <s:syncfunc/>
+                </test>
+               </wrapping>'''
+
+
+class TestAsyncTestRunner( unittest.TestCase ):
+
+    def setUp( self ):
+        self.test_folder = tempfile.mkdtemp()
+        self.logfolder = os.path.join( self.test_folder, 'logfolder' )
+
+    def tearDown( self ):
+        shutil.rmtree( self.test_folder )
+
+    def test_parser_awaits_coroutine_functions( self ):
+        """ test whether coroutine parser, setup and shutdown functions are awaited
+        """
+        calls = []
+
+        async def setup( node ):
+            await asyncio.sleep( 0 )
+            calls.append( 'setup' )
+
+        async def shutdown( save_logfile ):
+            await asyncio.sleep( 0 )
+            return ( ['SHUTDOWN'], [], [] )
+
+        async def myfunc( node ):
+            await asyncio.sleep( 0 )
+            return ( ['ASYNC-OUTPUT'], [], [] )
+
+        def syncfunc( node ):
+            return ( ['SYNC-OUTPUT'], [], [] )
+
+        tr = async_test_runner.AsyncTestRunner( 'testpath', 1, self.logfolder )
+        tr.setup_functions.update( {'{http://dbc.dk/xml/namespaces/solr}service': { 'setup': setup, 'shutdown': shutdown } } )
+        tr.parser_functions.update( {'{http://dbc.dk/xml/namespaces/solr}myfunc': myfunc,
+                                     '{http://dbc.dk/xml/namespaces/solr}syncfunc': syncfunc } )
+        asyncio.run( tr.parse( etree.fromstring( testsuite ) ) )
+
+        self.assertEqual( ['setup'], calls )
+        self.assertEqual( ['ASYNC-OUTPUT', 'SYNC-OUTPUT', 'SHUTDOWN'], tr.output )
+        self.assertEqual( [], tr.failures )
+
+    def test_parser_shuts_down_if_node_function_raises( self ):
+        """ test whether shutdown hooks run if a coroutine node function raises
+        """
+        async def myfunc( node ):
+            raise RuntimeError( 'foo error' )
+
+        def shutdown( save_logfile ):
+            return ( ['SHUTDOWN'], [], [] )
+
+        tr = async_test_runner.AsyncTestRunner( 'testpath', 1, self.logfolder )
+        tr.setup_functions.update( {'{http://dbc.dk/xml/namespaces/solr}service': { 'setup': lambda x: None, 'shutdown': shutdown } } )
+        tr.parser_functions.update( {'{http://dbc.dk/xml/namespaces/solr}myfunc': myfunc } )
+
+        self.assertRaises( RuntimeError, asyncio.run, tr.parse( etree.fromstring( testsuite ) ) )
+        self.assertEqual( ['SHUTDOWN'], tr.output )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import acceptance_tester.framework.discovery_index as discovery_index
+
+
+class TestDiscoveryIndex( unittest.TestCase ):
+
+    def setUp( self ):
+        self.test_folder = tempfile.mkdtemp()
+        self.path = os.path.join( self.test_folder, "discovery-index.json" )
+        self.suite = self.write( "a.xml", "<testsuite/>" )
+        self.tests = [ ( self.suite, "test1", "<wrapping/>", { 'description': "d" }, { 'type': "dummy" }, { 'name': "test1" } ) ]
+
+    def tearDown( self ):
+        shutil.rmtree( self.test_folder )
+
+    def write( self, name, content, age=60 ):
+        path = os.path.join( self.test_folder, name )
+        fh = open( path, 'w' )
+        fh.write( content )
+        fh.close()
+        then = time.time() - age
+        os.utime( path, ( then, then ) )
+        return path
+
+    def record( self, index ):
+        index.record( self.suite, os.stat( self.suite ), "dummy", self.tests )
+
+    def test_unchanged_file_is_found( self ):
+        """ Test that the recorded tests of an unchanged file are returned after a save and load
+        """
+        index = discovery_index.DiscoveryIndex( self.path )
+        self.record( index )
+        index.save()
+
+        loaded = discovery_index.DiscoveryIndex( self.path )
+        self.assertEqual( "dummy", loaded.lookup( self.suite )['type'] )
+        self.assertEqual( self.tests, loaded.tests( self.suite ) )
+
+    def test_changed_file_is_not_found( self ):
+        """ Test that a file changed after it was indexed must be parsed again
+        """
+        index = discovery_index.DiscoveryIndex()
+        self.record( index )
+        self.write( "a.xml", "<testsuite><test/></testsuite>" )
+        self.assertEqual( None, index.lookup( self.suite ) )
+
+    def test_recently_modified_file_is_not_indexed( self ):
+        """ Test that a file modified within the last seconds is not indexed
+        """
+        self.write( "a.xml", "<testsuite/>", age=0 )
+        index = discovery_index.DiscoveryIndex()
+        self.record( index )
+        self.assertEqual( None, index.lookup( self.suite ) )
+
+    def test_index_of_other_version_is_ignored( self ):
+        """ Test that an index written by another version is discarded
+        """
+        index = discovery_index.DiscoveryIndex( self.path )
+        self.record( index )
+        index.save()
+        fh = open( self.path )
+        content = json.load( fh )
+        fh.close()
+        content['acceptance-tester'] = "0.0.0"
+        fh = open( self.path, 'w' )
+        json.dump( content, fh )
+        fh.close()
+
+        self.assertEqual( None, discovery_index.DiscoveryIndex( self.path ).lookup( self.suite ) )
+
+    def test_removed_files_are_not_saved( self ):
+        """ Test that entries of removed files are dropped when the index is saved
+        """
+        index = discovery_index.DiscoveryIndex( self.path )
+        self.record( index )
+        os.remove( self.suite )
+        index.save()
+        self.assertEqual( {}, discovery_index.DiscoveryIndex( self.path ).entries )
+
+
+if __name__ == '__main__':
+    unittest.main()
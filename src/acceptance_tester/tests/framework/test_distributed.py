@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from multiprocessing.connection import Client
+
+import acceptance_tester.framework.distributed as distributed
+from acceptance_tester.abstract_testsuite_runner.test_runner import TestRunner
+from acceptance_tester.supported_test_types import TYPES
+
+AUTHKEY = b"secret"
+
+
+class  LoggingMockRunner( TestRunner ):
+
+    def run_test( self, test_xml, build_folder, resource_manager ):
+        fh = open( os.path.join( self.logfolder, "test.log" ), 'w' )
+        fh.write( "log of test %s"%self.id )
+        fh.close()
+        if self.id == 1:
+            self.failures.append( "failure encountered" )
+        if test_xml.get( 'hang' ) != None:
+            time.sleep( 60 )
+
+
+class TestParseAddress( unittest.TestCase ):
+
+    def test_host_and_port_are_returned( self ):
+        """ Test that an address is split into host and port
+        """
+        self.assertEqual( ( "localhost", 8000 ), distributed.parse_address( "localhost:8000" ) )
+
+    def test_address_without_port_raises( self ):
+        """ Test that an address without port is rejected
+        """
+        self.assertRaises( RuntimeError, distributed.parse_address, "localhost" )
+
+
+class TestCoordinator( unittest.TestCase ):
+
+    def setUp( self ):
+        self.test_folder = tempfile.mkdtemp()
+        self.log_folder = os.path.join( self.test_folder, "logs" )
+        os.mkdir( self.log_folder )
+        self.tests = []
+        for i in range( 4 ):
+            self.tests.append( { "id": i,
+                                 "build-folder": os.path.join( self.test_folder, "build", "suite___test%s"%i ),
+                                 "documentation": {},
+                                 "name": "test%s"%i,
+                                 "test-suite": "suite.xml",
+                                 "report-file": os.path.join( self.test_folder, "report.txt" ),
+                                 "resource-manager": None,
+                                 "type": None,
+                                 "type-name": "distributed-mock",
+                                 "verbose": False,
+                                 "xml": "<wrapping name=\"test%s\"/>"%i,
+                                 "log-folder": self.log_folder,
+                                 "timeout": None,
+                                 "color": False } )
+        TYPES['distributed-mock'] = { 'test-runner': "acceptance_tester.tests.framework.test_distributed.LoggingMockRunner" }
+
+    def tearDown( self ):
+        del TYPES['distributed-mock']
+        shutil.rmtree( self.test_folder )
+
+    def _coordinator( self ):
+        return distributed.Coordinator( self.tests, "distributed-mock", None, False,
+                                        ( "localhost", 0 ), AUTHKEY, self.log_folder )
+
+    def _start_worker( self, coordinator, name="worker", pool_size=2 ):
+        build_folder = os.path.join( self.test_folder, name )
+        worker = threading.Thread( target=distributed.run_worker,
+                                   args=( coordinator.address, AUTHKEY, build_folder,
+                                          os.path.join( build_folder, "resources" ), pool_size ) )
+        worker.start()
+        return worker
+
+    def _hang( self, test ):
+        test['xml'] = "<wrapping name=\"%s\" hang=\"yes\"/>"%test['name']
+
+    def test_tests_are_run_by_several_workers( self ):
+        """ Test that all tests are run when two workers share them, and logs are shipped back
+        """
+        coordinator = self._coordinator()
+        workers = [ self._start_worker( coordinator, "worker%s"%i ) for i in range( 2 ) ]
+
+        results = sorted( coordinator.results(), key=lambda x: x['id'] )
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual( [ 'SUCCESS', 'FAILURE', 'SUCCESS', 'SUCCESS' ], [ x['status'] for x in results ] )
+        fh = open( os.path.join( self.log_folder, "suite___test3", "test.log" ) )
+        self.assertEqual( "log of test 3", fh.read() )
+        fh.close()
+
+    def test_tests_of_lost_worker_are_reported_as_errors( self ):
+        """ Test that a test is reported as an error if its worker disconnects
+        """
+        self.tests = self.tests[:1]
+        coordinator = self._coordinator()
+        conn = Client( coordinator.address, authkey=AUTHKEY )
+        conn.send( ( 'hello', 'lost-worker', 1 ) )
+        conn.recv()
+        conn.send( ( 'next', ) )
+        conn.recv()
+        conn.close()
+
+        results = list( coordinator.results() )
+        self.assertEqual( 'ERROR', results[0]['status'] )
+        self.assertTrue( "lost-worker" in results[0]['errors'][1] )
+
+    def test_test_is_stopped_at_its_timeout( self ):
+        """ Test that a hanging test on a worker is reported as an error at its timeout, and the other tests run
+        """
+        self._hang( self.tests[2] )
+        self.tests[2]['timeout'] = 0.5
+        coordinator = self._coordinator()
+        worker = self._start_worker( coordinator )
+
+        results = sorted( coordinator.results(), key=lambda x: x['id'] )
+        worker.join()
+
+        self.assertEqual( [ 'SUCCESS', 'FAILURE', 'ERROR', 'SUCCESS' ], [ x['status'] for x in results ] )
+        self.assertTrue( "timed out" in results[2]['errors'][1] )
+
+    def test_retried_test_is_run_again( self ):
+        """ Test that a test retried on the coordinator is handed to a worker again
+        """
+        coordinator = self._coordinator()
+        worker = self._start_worker( coordinator )
+
+        runs = []
+        for result in coordinator.results():
+            runs.append( result['id'] )
+            if result['status'] == 'FAILURE' and runs.count( result['id'] ) == 1:
+                coordinator.retry( [ result['id'] ] )
+        worker.join()
+
+        self.assertEqual( [ 0, 1, 1, 2, 3 ], sorted( runs ) )
+
+    def test_last_test_is_retried_after_workers_ran_out_of_tests( self ):
+        """ Test that workers wait for a retry of the last test, instead of leaving when they run out of tests
+        """
+        self.tests = self.tests[1:2]
+        coordinator = self._coordinator()
+        worker = self._start_worker( coordinator )
+
+        statuses = []
+        for result in coordinator.results():
+            statuses.append( result['status'] )
+            if len( statuses ) == 1:
+                time.sleep( 0.2 )
+                coordinator.retry( [ result['id'] ] )
+        worker.join()
+
+        self.assertEqual( [ 'FAILURE', 'FAILURE' ], statuses )
+
+    def test_running_tests_are_skipped_after_cancel_grace( self ):
+        """ Test that the coordinator stops waiting for running tests when the cancel grace period ends
+        """
+        self.tests = self.tests[:2]
+        self._hang( self.tests[0] )
+        self.tests[0]['timeout'] = 5
+        coordinator = self._coordinator()
+        worker = self._start_worker( coordinator, pool_size=1 )
+        threading.Timer( 1, coordinator.cancel, ( 0.5, ) ).start()
+
+        started = time.monotonic()
+        results = sorted( coordinator.results(), key=lambda x: x['id'] )
+        elapsed = time.monotonic() - started
+        worker.join()
+
+        self.assertEqual( [ 'SKIPPED', 'SKIPPED' ], [ x['status'] for x in results ] )
+        self.assertTrue( "stopped" in "".join( results[0]['summary'] ) )
+        self.assertTrue( elapsed < 4 )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import acceptance_tester.framework.file_walker as file_walker
+
+
+class TestFileFilter( unittest.TestCase ):
+
+    def setUp( self ):
+        self.test_folder = tempfile.mkdtemp()
+        for folder in [ ".a", ".b", "c", "data", os.path.join( "c", "data" ), os.path.join( "c", "d" ) ]:
+            os.mkdir( os.path.join( self.test_folder, folder ) )
+        for name in [ "a.xml", "a.txt", ".a/x.xml", ".b/x.xml", "c/b.xml", "c/d/c.xml", "data/x.xml", "c/data/x.xml" ]:
+            self.write( name, "<testsuite/>" )
+
+    def tearDown( self ):
+        shutil.rmtree( self.test_folder )
+
+    def write( self, name, content ):
+        path = os.path.join( self.test_folder, name )
+        fh = open( path, 'w' )
+        fh.write( content )
+        fh.close()
+        return path
+
+    def found( self, file_filter ):
+        return [ os.path.relpath( x, self.test_folder ) for x in file_filter.walk( self.test_folder ) ]
+
+    def test_xml_files_outside_hidden_folders_are_found( self ):
+        """ Test that adjacent hidden folders are all skipped, and files are found top down
+        """
+        self.assertEqual( [ "a.xml", "c/b.xml", "c/d/c.xml", "c/data/x.xml", "data/x.xml" ],
+                          self.found( file_walker.FileFilter() ) )
+
+    def test_excluded_folders_are_not_searched( self ):
+        """ Test that a folder pattern prunes folders at any depth before they are listed
+        """
+        listed = []
+        scandir = os.scandir
+
+        def record( path ):
+            listed.append( os.path.relpath( path, self.test_folder ) )
+            return scandir( path )
+
+        with patch( "os.scandir", side_effect=record ):
+            found = self.found( file_walker.FileFilter( exclude=[ "data/" ] ) )
+        self.assertEqual( [ "a.xml", "c/b.xml", "c/d/c.xml" ], found )
+        self.assertEqual( [ ".", "c", "c/d" ], listed )
+
+    def test_patterns_with_a_slash_match_the_relative_path( self ):
+        """ Test that include and exclude patterns with a slash are relative to the test folder
+        """
+        self.assertEqual( [ "c/data/x.xml" ], self.found( file_walker.FileFilter( include=[ "c/*/*.xml" ], exclude=[ "c/d/" ] ) ) )
+        self.assertEqual( [ "a.txt" ], self.found( file_walker.FileFilter( include=[ "*.txt" ] ) ) )
+
+    def test_ignore_file_in_test_folder_is_read( self ):
+        """ Test that patterns in the ignore file are excluded, and comments are skipped
+        """
+        self.write( file_walker.IGNORE_FILE, "# fixtures\n\ndata/\nc/d\n" )
+        self.assertEqual( [ "a.xml", "c/b.xml" ], self.found( file_walker.FileFilter() ) )
+
+    def test_single_file_is_matched_by_name( self ):
+        """ Test that a path to a file is found if its name is included
+        """
+        path = os.path.join( self.test_folder, "c", "b.xml" )
+        self.assertEqual( [ path ], file_walker.FileFilter().walk( path ) )
+        self.assertEqual( [], file_walker.FileFilter( exclude=[ "b.*" ] ).walk( path ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import acceptance_tester.framework.find_tests as find_tests
+import acceptance_tester.framework.discovery_index as discovery_index
+
+SUITE = '''<testsuite xmlns="info:testsuite#" type="dummy">
+ <test name="test%s"/>
+</testsuite>'''
+
+XSD = '''<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="info:testsuite#" elementFormDefault="qualified">
+ <xs:element name="testsuite">
+  <xs:complexType>
+   <xs:sequence>
+    <xs:element name="test" maxOccurs="unbounded">
+     <xs:complexType><xs:attribute name="name" type="xs:string"/></xs:complexType>
+    </xs:element>
+   </xs:sequence>
+   <xs:attribute name="type" type="xs:string"/>
+  </xs:complexType>
+ </xs:element>
+</xs:schema>'''
+
+
+def write_file( folder, name, content ):
+    path = os.path.join( folder, name )
+    fh = open( path, 'w' )
+    fh.write( content )
+    fh.close()
+    ### files modified within the last seconds are not indexed
+    then = time.time() - 60
+    os.utime( path, ( then, then ) )
+    return path
+
+
+class TestFindTestsuites( unittest.TestCase ):
+
+    def setUp( self ):
+        self.test_folder = tempfile.mkdtemp()
+        self.threshold = find_tests.POOL_THRESHOLD
+        self.suites = []
+        for i in range( 6 ):
+            self.suites.append( write_file( self.test_folder, "suite%s.xml"%i, SUITE%i ) )
+            write_file( self.test_folder, "fixture%s.xml"%i, "<fixture>%s</fixture>"%( "<row/>" * 100 ) )
+
+    def tearDown( self ):
+        find_tests.POOL_THRESHOLD = self.threshold
+        shutil.rmtree( self.test_folder )
+
+    def test_only_testsuite_files_are_found( self ):
+        """ Test that xml files that are not testsuites are left out
+        """
+        found = find_tests._find_testsuites( self.test_folder )
+        self.assertEqual( sorted( self.suites ), sorted( [ x[0] for x in found ] ) )
+
+    def test_each_file_is_validated_once( self ):
+        """ Test that files are parsed once, also when there are many files
+        """
+        find_tests.POOL_THRESHOLD = 2
+        validate = find_tests.validate_testsuite.validate_testsuite_file
+        with patch.object( find_tests.validate_testsuite, 'validate_testsuite_file', side_effect=validate ) as validate_file:
+            found = find_tests._find_testsuites( self.test_folder )
+        self.assertEqual( 12, validate_file.call_count )
+        self.assertEqual( "test0", found[[ x[0] for x in found ].index( self.suites[0] )][1].getroot()[0].get( "name" ) )
+
+
+class TestTypedDiscovery( unittest.TestCase ):
+
+    def setUp( self ):
+        self.test_folder = tempfile.mkdtemp()
+        write_file( self.test_folder, "suite0.xml", SUITE%0 )
+        write_file( self.test_folder, "suite1.xml", SUITE.replace( "dummy", "other" )%1 )
+        self.test_type = patch.object( find_tests, '_get_test_type', side_effect=lambda name, config: ( name, { 'test-runner': object } ) )
+        self.test_type.start()
+
+    def tearDown( self ):
+        self.test_type.stop()
+        shutil.rmtree( self.test_folder )
+
+    def test_tests_are_grouped_by_test_type( self ):
+        """ Test that the tests of each test type are returned together, ordered by type name
+        """
+        found = find_tests.find_typed_tests( [ self.test_folder ], None )
+        self.assertEqual( [ ( "dummy", [ "test0" ] ), ( "other", [ "test1" ] ) ], [ ( x[1], [ y[1] for y in x[2] ] ) for x in found ] )
+        index = discovery_index.DiscoveryIndex( os.path.join( self.test_folder, "index.json" ) )
+        self.assertEqual( found, find_tests.find_typed_tests( [ self.test_folder ], None, index ) )
+
+    def test_single_test_type_is_required_by_find_valid_tests( self ):
+        """ Test that find_valid_tests refuses testsuites of several test types
+        """
+        self.assertRaises( RuntimeError, find_tests.find_valid_tests, [ self.test_folder ], None )
+
+
+class TestIndexedDiscovery( unittest.TestCase ):
+
+    def setUp( self ):
+        self.test_folder = tempfile.mkdtemp()
+        for i in range( 3 ):
+            write_file( self.test_folder, "suite%s.xml"%i, SUITE%i )
+        write_file( self.test_folder, "fixture.xml", "<fixture/>" )
+        self.index = discovery_index.DiscoveryIndex( os.path.join( self.test_folder, "index.json" ) )
+        self.test_type = patch.object( find_tests, '_get_test_type', return_value=( "dummy", { 'test-runner': object } ) )
+        self.test_type.start()
+
+    def tearDown( self ):
+        self.test_type.stop()
+        shutil.rmtree( self.test_folder )
+
+    def test_indexed_discovery_finds_the_same_tests( self ):
+        """ Test that the tests found through the index are the tests found without it
+        """
+        expected = find_tests.find_valid_tests( [ self.test_folder ], None )[2]
+        self.assertEqual( expected, find_tests.find_valid_tests( [ self.test_folder ], None, self.index )[2] )
+        index = discovery_index.DiscoveryIndex( self.index.path )
+        self.assertEqual( expected, find_tests.find_valid_tests( [ self.test_folder ], None, index )[2] )
+
+    def test_unchanged_files_are_not_parsed( self ):
+        """ Test that only the changed testsuite file is parsed when the index is used again
+        """
+        find_tests.find_valid_tests( [ self.test_folder ], None, self.index )
+        changed = write_file( self.test_folder, "suite1.xml", SUITE%"changed" )
+        with patch.object( find_tests, '_parse_testsuites', wraps=find_tests._parse_testsuites ) as parse:
+            tests = find_tests.find_valid_tests( [ self.test_folder ], None, self.index )[2]
+        self.assertEqual( [ [ changed ] ], [ x[0][0] for x in parse.call_args_list ] )
+        self.assertEqual( [ "test0", "testchanged", "test2" ], [ x[1] for x in sorted( tests ) ] )
+
+
+class TestSchemaValidation( unittest.TestCase ):
+
+    def setUp( self ):
+        self.test_folder = tempfile.mkdtemp()
+        self.threshold = find_tests.POOL_THRESHOLD
+        self.xsd = write_file( self.test_folder, "dummy.xsd", XSD )
+        self.suites = [ write_file( self.test_folder, "suite%s.xml"%i, SUITE%i ) for i in range( 4 ) ]
+        self.suites.append( write_file( self.test_folder, "invalid.xml", '<testsuite xmlns="info:testsuite#"><other/></testsuite>' ) )
+        self.test_type = { 'xsd': "xsd/dummy.xsd" }
+        self.patches = [ patch.object( find_tests.pkg_resources, 'resource_exists', return_value=True ),
+                         patch.object( find_tests.pkg_resources, 'resource_filename', return_value=self.xsd ),
+                         patch.dict( find_tests._schemas, clear=True ) ]
+        for x in self.patches:
+            x.start()
+
+    def tearDown( self ):
+        for x in self.patches:
+            x.stop()
+        find_tests.POOL_THRESHOLD = self.threshold
+        shutil.rmtree( self.test_folder )
+
+    def test_schema_is_compiled_once( self ):
+        """ Test that a schema is compiled only the first time it is asked for
+        """
+        schema = find_tests._get_schema( "xsd/dummy.xsd" )
+        self.assertTrue( schema is find_tests._get_schema( "xsd/dummy.xsd" ) )
+        self.assertEqual( 1, find_tests.pkg_resources.resource_exists.call_count )
+
+    def test_non_valid_suites_are_filtered( self ):
+        """ Test that only suites validating against the schema are kept, also when validated in a pool
+        """
+        suites = [ ( x, None ) for x in self.suites ]
+        self.assertEqual( suites[:4], find_tests._filter_non_valid_suites( suites, self.test_type ) )
+        find_tests.POOL_THRESHOLD = 2
+        self.assertEqual( suites[:4], find_tests._filter_non_valid_suites( suites, self.test_type ) )
+
+    def test_results_are_kept_for_unchanged_suites( self ):
+        """ Test that unchanged suites are not validated again when an index is given
+        """
+        index = discovery_index.DiscoveryIndex()
+        suites = [ ( x, None ) for x in self.suites ]
+        for path in self.suites:
+            index.record( path, os.stat( path ), "dummy", [] )
+        find_tests._filter_non_valid_suites( suites, self.test_type, index )
+        write_file( self.test_folder, "suite1.xml", SUITE%"changed" )
+        index.record( self.suites[1], os.stat( self.suites[1] ), "dummy", [] )
+        with patch.object( find_tests, '_validate_schema', wraps=find_tests._validate_schema ) as validate:
+            self.assertEqual( suites[:4], find_tests._filter_non_valid_suites( suites, self.test_type, index ) )
+        self.assertEqual( [ self.suites[1] ], [ x[0][1] for x in validate.call_args_list ] )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,20 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 # -*- mode: python -*-
+import asyncio
+import datetime
 import os
 import shutil
 import sys
 import tempfile
 import unittest
+from lxml import etree
 
 sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.dirname( os.path.dirname( os.path.abspath( sys.argv[0] ) ) ) ) ) )
 import acceptance_tester.framework.job as job
+import acceptance_tester.framework.xml_slice as xml_slice
 from acceptance_tester.abstract_testsuite_runner.test_runner import TestRunner
+from acceptance_tester.abstract_testsuite_runner.async_test_runner import AsyncTestRunner
 
 
 def mock_sync_stdout_write( string ):
@@ -28,6 +33,38 @@ class  MockRunner( TestRunner ):
         pass
 
 
+class  WorkerMockRunner( TestRunner ):
+
+    def run_test( self, test_xml, build_folder, resource_manager ):
+        self.failures.append( "config: %s"%self.config )
+
+
+class  SetupCountingRunner( TestRunner ):
+
+    created = 0
+
+    def __init__( self, test_path, id, logfolder ):
+        TestRunner.__init__( self, test_path, id, logfolder )
+        SetupCountingRunner.created += 1
+
+    def run_test( self, test_xml, build_folder, resource_manager ):
+        self.output.append( "keep setup: %s"%self.keep_setup )
+
+
+class  AsyncMockRunner( AsyncTestRunner ):
+
+    running = 0
+    max_running = 0
+
+    async def run_test( self, test_xml, build_folder, resource_manager ):
+        AsyncMockRunner.running += 1
+        AsyncMockRunner.max_running = max( AsyncMockRunner.max_running, AsyncMockRunner.running )
+        await asyncio.sleep( 0.01 )
+        AsyncMockRunner.running -= 1
+        if self.id == 1:
+            raise RuntimeError( "exception encountered" )
+
+
 class TestJob( unittest.TestCase ):
 
     def setUp( self ):
@@ -100,5 +137,183 @@ class TestJob( unittest.TestCase ):
         self.assertEqual( 'ERROR', job.job( self.arg )['status'] )
 
 
+    def test_error_result_reports_the_message_as_an_error( self ):
+        """
+        Tests that a test stopped by the framework gets status 'ERROR' with the given message.
+        """
+        result = job.error_result( self.arg, "Test timed out", datetime.timedelta( seconds=5 ) )
+
+        self.assertEqual( 'ERROR', result['status'] )
+        self.assertEqual( [ "Testname : 'foo'", "Test timed out" ], result['errors'] )
+        self.assertEqual( datetime.timedelta( seconds=5 ), result['time'] )
+
+
+    def test_skipped_result_has_status_SKIPPED( self ):
+        """
+        Tests that a cancelled test gets status 'SKIPPED' without errors or failures.
+        """
+        result = job.skipped_result( self.arg, "Test not run" )
+
+        self.assertEqual( 'SKIPPED', result['status'] )
+        self.assertEqual( [], result['errors'] + result['failures'] )
+        self.assertTrue( "Test not run" in result['summary'] )
+
+
+    def test_carried_result_is_a_success_marked_as_carried_over( self ):
+        """
+        Tests that an unchanged test gets status 'SUCCESS' with the duration of the earlier run.
+        """
+        result = job.carried_result( self.arg, datetime.timedelta( seconds=3 ) )
+
+        self.assertEqual( 'SUCCESS', result['status'] )
+        self.assertTrue( result['carried-over'] )
+        self.assertEqual( datetime.timedelta( seconds=3 ), result['time'] )
+
+
+class TestWorker( unittest.TestCase ):
+
+    def setUp( self ):
+
+        self.test_folder = tempfile.mkdtemp()
+        self.tests = []
+        for i in range( 3 ):
+            self.tests.append( { "id": i,
+                                 "build-folder": os.path.join( self.test_folder, "build%s"%i ),
+                                 "documentation": {},
+                                 "name": "foo%s"%i,
+                                 "test-suite": "bar",
+                                 "report-file": "baz",
+                                 "resource-manager": None,
+                                 "type": None,
+                                 "type-name": "type name",
+                                 "verbose": False,
+                                 "xml": "<test-xml>msg</test-xml>",
+                                 "log-folder": self.test_folder,
+                                 "color": False } )
+        self.definition = { 'test-runner': "acceptance_tester.tests.framework.test_job.WorkerMockRunner" }
+
+    def tearDown( self ):
+        job._worker_state.clear()
+        shutil.rmtree( self.test_folder )
+
+    def test_init_worker_loads_test_type( self ):
+        """
+        Tests that the initializer loads the test runner class of the test type.
+        """
+        job.init_worker( self.tests, self.definition, "config-file", False )
+        self.assertEqual( WorkerMockRunner, job._worker_state['types']['type name']['test-runner'] )
+
+    def test_run_test_id_runs_the_test_with_the_given_id( self ):
+        """
+        Tests that a test is run from its id, with the runner loaded by the initializer.
+        """
+        job.init_worker( self.tests, self.definition, "config-file", False )
+        result = job.run_test_id( 1 )
+
+        self.assertEqual( "foo1", result['name'] )
+        self.assertEqual( 'FAILURE', result['status'] )
+        self.assertTrue( "config: config-file" in result['failures'] )
+
+    def test_parser_is_created_once_per_process( self ):
+        """
+        Tests that the same parser is used for all tests in a worker.
+        """
+        job.init_worker( self.tests, self.definition, None, False )
+        parser = job._get_parser()
+        job.run_test_id( 0 )
+        self.assertTrue( parser is job._get_parser() )
+
+    def test_run_suite_ids_reuses_one_runner( self ):
+        """
+        Tests that all tests in a suite group are run by the same test runner.
+        """
+        definition = { 'test-runner': "acceptance_tester.tests.framework.test_job.SetupCountingRunner" }
+        SetupCountingRunner.created = 0
+        job.init_worker( self.tests, definition, None, False )
+        results = job.run_suite_ids( [ 0, 1, 2 ] )
+
+        self.assertEqual( 1, SetupCountingRunner.created )
+        self.assertEqual( [ "foo0", "foo1", "foo2" ], [ x['name'] for x in results ] )
+        for result in results:
+            self.assertFalse( os.path.exists( result['build-folder'] ) )
+
+    def test_run_async_ids_runs_tests_concurrently( self ):
+        """
+        Tests that async tests are run concurrently, limited by the given concurrency.
+        """
+        definition = { 'test-runner': "acceptance_tester.tests.framework.test_job.AsyncMockRunner" }
+        AsyncMockRunner.max_running = 0
+        job.init_worker( self.tests, definition, None, False )
+        results = job.run_async_ids( [ 0, 1, 2 ], 2 )
+
+        self.assertEqual( 2, AsyncMockRunner.max_running )
+        self.assertEqual( [ 'SUCCESS', 'ERROR', 'SUCCESS' ], [ x['status'] for x in results ] )
+
+    def test_run_task_runs_tests_of_several_test_types( self ):
+        """
+        Tests that tests of different test types are run with the runner of their type.
+        """
+        definitions = { 'type name': self.definition,
+                        'async type': { 'test-runner': "acceptance_tester.tests.framework.test_job.AsyncMockRunner" } }
+        self.tests[2]['type-name'] = "async type"
+        job.init_worker( self.tests, definitions, None, False )
+
+        self.assertEqual( 'FAILURE', job.run_task( 0, 1 )['status'] )
+        self.assertEqual( [ 'SUCCESS' ], [ x['status'] for x in job.run_task( [ 2 ], 1 ) ] )
+        self.assertEqual( AsyncMockRunner, job._worker_state['types']['async type']['test-runner'] )
+
+    def test_worker_reads_documentation_from_the_xml( self ):
+        """
+        Tests that tests are handed to workers without documentation, which is read from the xml when the test is run.
+        """
+        self.tests[0]['documentation'] = { 'when': "A record is added" }
+        self.tests[0]['xml'] = ( "<wrapping name=\"foo0\"><test xmlns=\"info:testsuite#\" name=\"foo0\">"
+                                 "<when>\n  A record is added\n</when></test></wrapping>" )
+        tests = [ job.worker_test( x ) for x in self.tests ]
+        self.assertFalse( 'documentation' in tests[0] )
+
+        job.init_worker( tests, self.definition, None, False )
+        self.assertEqual( { 'when': "A record is added" }, job.run_test_id( 0 )['documentation'] )
+        self.assertEqual( {}, job.run_test_id( 1 )['documentation'] )
+
+    def test_test_of_changed_testsuite_is_reported_as_error( self ):
+        """
+        Tests that a sliced test whose testsuite file changed after discovery is reported as an error.
+        """
+        path = os.path.join( self.test_folder, "suite.xml" )
+        fh = open( path, 'w' )
+        fh.write( "<testsuite xmlns=\"info:testsuite#\"><test name=\"foo0\"/></testsuite>" )
+        fh.close()
+        self.tests[0]['xml'] = xml_slice.slice_suite( path, etree.parse( path ) )[0]
+        fh = open( path, 'a' )
+        fh.write( "\n" )
+        fh.close()
+
+        job.init_worker( self.tests, self.definition, None, False )
+        results = job.run_suite_ids( [ 0, 1 ] )
+
+        self.assertEqual( [ 'ERROR', 'FAILURE' ], [ x['status'] for x in results ] )
+        self.assertTrue( "changed" in results[0]['errors'][1] )
+
+    def test_unread_test_keeps_the_folder_of_another_test( self ):
+        """
+        Tests that the build folder named like the candidate build folder of a test that could not be read is kept.
+        """
+        path = os.path.join( self.test_folder, "suite.xml" )
+        fh = open( path, 'w' )
+        fh.write( "<testsuite xmlns=\"info:testsuite#\"><test name=\"foo0\"/></testsuite>" )
+        fh.close()
+        self.tests[0]['xml'] = xml_slice.slice_suite( path, etree.parse( path ) )[0]
+        os.remove( path )
+        os.mkdir( self.tests[0]['build-folder'] )
+
+        job.init_worker( self.tests, self.definition, None, False )
+        results = job.run_suite_ids( [ 0, 1 ] )
+
+        self.assertEqual( 'ERROR', results[0]['status'] )
+        self.assertTrue( os.path.exists( self.tests[0]['build-folder'] ) )
+        self.assertFalse( os.path.exists( results[1]['build-folder'] ) )
+
+
 if __name__ == '__main__':
     unittest.main()
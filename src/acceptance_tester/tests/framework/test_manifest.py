@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import acceptance_tester.framework.manifest as manifest
+
+
+def make_test( name, xml ):
+    return { 'id': 0, 'test-suite': "a.xml", 'name': name, 'xml': xml }
+
+
+def make_result( name, status ):
+    return { 'id': 0, 'test-suite': "a.xml", 'name': name, 'status': status,
+             'time': datetime.timedelta( seconds=4 ) }
+
+
+class TestResultManifest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.test_folder = tempfile.mkdtemp()
+        self.path = os.path.join( self.test_folder, "manifest.json" )
+        self.test = make_test( "test1", "<wrapping/>" )
+        self.manifest = manifest.ResultManifest( self.path )
+
+    def tearDown( self ):
+        shutil.rmtree( self.test_folder )
+
+    def test_unknown_test_has_no_previous_result( self ):
+        """ Test that a test not in the manifest is run
+        """
+        self.assertEqual( None, self.manifest.previous( self.test ) )
+
+    def test_unchanged_successful_test_has_previous_result( self ):
+        """ Test that the result of an unchanged test that succeeded is returned after a save and load
+        """
+        self.manifest.record_results( [ make_result( "test1", "SUCCESS" ) ], { 0: self.test } )
+        self.manifest.save()
+
+        loaded = manifest.ResultManifest( self.path )
+        self.assertEqual( 4.0, loaded.previous( self.test )['time'] )
+
+    def test_changed_test_has_no_previous_result( self ):
+        """ Test that a test is run when its xml changed
+        """
+        self.manifest.record_results( [ make_result( "test1", "SUCCESS" ) ], { 0: self.test } )
+        self.assertEqual( None, self.manifest.previous( make_test( "test1", "<wrapping>changed</wrapping>" ) ) )
+
+    def test_failed_test_has_no_previous_result( self ):
+        """ Test that a test is run again when it did not succeed
+        """
+        self.manifest.record_results( [ make_result( "test1", "FAILURE" ) ], { 0: self.test } )
+        self.assertEqual( None, self.manifest.previous( self.test ) )
+
+    def test_carried_over_results_are_not_recorded( self ):
+        """ Test that a carried over result does not replace the recorded result
+        """
+        self.manifest.record_results( [ make_result( "test1", "SUCCESS" ) ], { 0: self.test } )
+        carried = make_result( "test1", "SUCCESS" )
+        carried['time'] = datetime.timedelta( seconds=1 )
+        carried['carried-over'] = True
+        self.manifest.record_results( [ carried ], { 0: self.test } )
+        self.assertEqual( 4.0, self.manifest.previous( self.test )['time'] )
+
+    def test_interleaved_runs_keep_each_others_results( self ):
+        """ Test that a run sharing the manifest does not overwrite results it did not record
+        """
+        self.manifest.record_results( [ make_result( "test1", "SUCCESS" ) ], { 0: self.test } )
+        self.manifest.save()
+        first = manifest.ResultManifest( self.path )
+        second = manifest.ResultManifest( self.path )
+        other = make_test( "test2", "<wrapping/>" )
+
+        first.record_results( [ make_result( "test1", "FAILURE" ) ], { 0: self.test } )
+        second.record_results( [ make_result( "test2", "SUCCESS" ) ], { 0: other } )
+        first.save()
+        second.save()
+
+        loaded = manifest.ResultManifest( self.path )
+        self.assertEqual( None, loaded.previous( self.test ) )
+        self.assertEqual( 4.0, loaded.previous( other )['time'] )
+
+
+class TestFlakinessHistory( unittest.TestCase ):
+
+    def test_flaky_runs_are_counted( self ):
+        """ Test that the rate counts the runs in which a test was flaky
+        """
+        history = manifest.FlakinessHistory()
+        flaky = make_result( "test1", "SUCCESS" )
+        flaky['flaky'] = True
+        history.record_results( [ flaky ] )
+        history.record_results( [ make_result( "test1", "SUCCESS" ) ] )
+        history.record_results( [ make_result( "test1", "SKIPPED" ) ] )
+        self.assertEqual( ( 1, 2 ), history.rate( "a.xml", "test1" ) )
+
+    def test_interleaved_runs_add_their_counts( self ):
+        """ Test that runs sharing the history add their runs to the counts, instead of replacing them
+        """
+        test_folder = tempfile.mkdtemp()
+        self.addCleanup( shutil.rmtree, test_folder )
+        path = os.path.join( test_folder, "flakiness.json" )
+        first = manifest.FlakinessHistory( path )
+        second = manifest.FlakinessHistory( path )
+        flaky = make_result( "test1", "SUCCESS" )
+        flaky['flaky'] = True
+
+        first.record_results( [ flaky ] )
+        second.record_results( [ make_result( "test1", "SUCCESS" ) ] )
+        first.save()
+        second.save()
+
+        self.assertEqual( ( 1, 2 ), second.rate( "a.xml", "test1" ) )
+        self.assertEqual( ( 1, 2 ), manifest.FlakinessHistory( path ).rate( "a.xml", "test1" ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
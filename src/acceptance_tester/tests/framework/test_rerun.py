@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+import acceptance_tester.framework.rerun as rerun
+
+XUNIT = """<testsuite name="%s">
+<testcase name="0_first_test"/>
+<testcase name="1_second_test"><failure/></testcase>
+<testcase name="2_third_test"><error/></testcase>
+</testsuite>"""
+
+
+class TestFailedTests( unittest.TestCase ):
+
+    def setUp( self ):
+        self.test_folder = os.path.realpath( tempfile.mkdtemp() )
+        self.suite_folder = os.path.join( self.test_folder, "suites.v2" )
+        os.mkdir( self.suite_folder )
+        self.suite = os.path.join( self.suite_folder, "suite.xml" )
+        open( self.suite, 'w' ).close()
+        os.makedirs( os.path.join( self.test_folder, "results", "xUnit" ) )
+
+    def tearDown( self ):
+        shutil.rmtree( self.test_folder )
+
+    def _write_xunit( self, suite_path ):
+        name = ".".join( [ x for x in suite_path[:-len( ".xml" )].split( os.sep ) if x != '' ] )
+        fh = open( os.path.join( self.test_folder, "results", "xUnit", "TEST-%s.xml"%name ), 'w' )
+        fh.write( XUNIT%name )
+        fh.close()
+
+    def test_failed_and_errored_tests_are_found( self ):
+        """ Test that failed tests are mapped back to their testsuite file, also when folder names contain dots
+        """
+        self._write_xunit( self.suite )
+        failed = rerun.failed_tests( os.path.join( self.test_folder, "results" ) )
+        self.assertEqual( { self.suite: set( [ "second_test", "third_test" ] ) }, failed )
+
+    def test_removed_testsuites_are_left_out( self ):
+        """ Test that failed tests of a testsuite file that no longer exists are ignored
+        """
+        self._write_xunit( os.path.join( self.suite_folder, "removed.xml" ) )
+        self.assertEqual( {}, rerun.failed_tests( os.path.join( self.test_folder, "results" ) ) )
+
+    def test_junit_name_replaces_separators( self ):
+        """ Test that spaces, dashes and commas are replaced in testcase names
+        """
+        self.assertEqual( "a_b_c_d", rerun.junit_test_name( "a b-c,d" ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
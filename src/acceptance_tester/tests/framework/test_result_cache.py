@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+import acceptance_tester.framework.result_cache as result_cache
+from acceptance_tester.abstract_testsuite_runner.test_runner import TestRunner
+
+
+class TestCacheKey( unittest.TestCase ):
+
+    def setUp( self ):
+        self.test_folder = tempfile.mkdtemp()
+        self.artifact = os.path.join( self.test_folder, "artifact.jar" )
+        self._write( "version 1" )
+
+    def tearDown( self ):
+        shutil.rmtree( self.test_folder )
+
+    def _write( self, content ):
+        fh = open( self.artifact, 'w' )
+        fh.write( content )
+        fh.close()
+
+    def _salt( self ):
+        return result_cache.cache_salt( "type", TestRunner, None, [ self.artifact ] )
+
+    def test_key_is_stable( self ):
+        """ Test that the same test and artifacts give the same key
+        """
+        self.assertEqual( result_cache.result_key( self._salt(), "<wrapping/>" ),
+                          result_cache.result_key( self._salt(), "<wrapping/>" ) )
+
+    def test_key_changes_with_xml( self ):
+        """ Test that a changed test gets another key
+        """
+        salt = self._salt()
+        self.assertNotEqual( result_cache.result_key( salt, "<wrapping/>" ),
+                             result_cache.result_key( salt, "<wrapping>changed</wrapping>" ) )
+
+    def test_key_changes_with_artifact_content( self ):
+        """ Test that a changed artifact gives all tests another key
+        """
+        salt = self._salt()
+        self._write( "version 2" )
+        self.assertNotEqual( salt, self._salt() )
+
+    def test_runner_version_is_found_in_package( self ):
+        """ Test that the version of the package containing the test runner is used
+        """
+        self.assertTrue( result_cache.runner_version( TestRunner ).startswith( "acceptance_tester " ) )
+
+
+class TestResultCache( unittest.TestCase ):
+
+    def setUp( self ):
+        self.test_folder = tempfile.mkdtemp()
+        self.path = os.path.join( self.test_folder, "result-cache.json" )
+
+    def tearDown( self ):
+        shutil.rmtree( self.test_folder )
+
+    def test_saved_result_is_found( self ):
+        """ Test that a cached result is found by a later run
+        """
+        cache = result_cache.ResultCache( self.path, 10 )
+        self.assertEqual( None, cache.get( "key" ) )
+        cache.put( "key", 4.0 )
+        cache.save()
+        self.assertEqual( 4.0, result_cache.ResultCache( self.path, 10 ).get( "key" ) )
+
+    def test_least_recently_used_results_are_evicted( self ):
+        """ Test that the cache keeps the most recently used results within its limit
+        """
+        cache = result_cache.ResultCache( self.path, 2 )
+        for key in [ "a", "b" ]:
+            cache.put( key, 1.0 )
+            cache.save()
+        cache.get( "a" )
+        cache.put( "c", 1.0 )
+        cache.save()
+
+        cache = result_cache.ResultCache( self.path, 2 )
+        self.assertEqual( [ 1.0, None, 1.0 ], [ cache.get( x ) for x in [ "a", "b", "c" ] ] )
+
+    def test_results_of_concurrent_runs_are_merged( self ):
+        """ Test that results saved by two runs sharing the cache are both kept
+        """
+        first = result_cache.ResultCache( self.path, 10 )
+        second = result_cache.ResultCache( self.path, 10 )
+        first.put( "a", 1.0 )
+        second.put( "b", 2.0 )
+        first.save()
+        second.save()
+        cache = result_cache.ResultCache( self.path, 10 )
+        self.assertEqual( [ 1.0, 2.0 ], [ cache.get( x ) for x in [ "a", "b" ] ] )
+
+    def test_unreadable_cache_is_replaced( self ):
+        """ Test that a corrupt cache file is discarded, and replaced when the cache is saved
+        """
+        fh = open( self.path, 'w' )
+        fh.write( "{ truncated" )
+        fh.close()
+        cache = result_cache.ResultCache( self.path, 10 )
+        self.assertEqual( None, cache.get( "a" ) )
+        cache.put( "a", 1.0 )
+        cache.save()
+        self.assertEqual( 1.0, result_cache.ResultCache( self.path, 10 ).get( "a" ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
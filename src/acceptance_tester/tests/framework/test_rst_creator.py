@@ -184,3 +184,32 @@ class TestRstCreator( unittest.TestCase ):
 
         for f in expected_files:
             self.assertTrue( os.path.exists( os.path.join( self.test_folder, f ) ) )
+
+    def test_rst_documentation_writes_test_file_when_result_is_added( self ):
+        """ Test whether the rst file of a test is written as soon as the result is added
+        """
+        documentation = rst_creator.RstDocumentation( self.test_folder )
+        documentation.add( testdata[1] )
+
+        self.assertTrue( os.path.exists( os.path.join( self.test_folder, 'game_has_soundtrack___game_has_soundtrack.rst' ) ) )
+        self.assertFalse( os.path.exists( os.path.join( self.test_folder, 'index.rst' ) ) )
+
+    def test_rst_documentation_views_are_ordered_by_test_id( self ):
+        """ Test whether the views list tests by id regardless of the order results are added in
+        """
+        start = datetime.datetime( 2000, 2, 2, 2, 2, 2 )
+        delta = datetime.datetime( 2000, 2, 2, 2, 2, 5 ) - start
+
+        documentation = rst_creator.RstDocumentation( self.test_folder )
+        for i, test in reversed( list( enumerate( testdata ) ) ):
+            result = dict( test )
+            result['id'] = i
+            documentation.add( result )
+        documentation.finish( start, delta )
+
+        fh = open( os.path.join( self.test_folder, 'flatview.rst' ) )
+        content = fh.read()
+        fh.close()
+        expected = [ os.path.split( x['build-folder'] )[-1] for x in testdata ]
+        found = [ x.strip() for x in content.split( "\n" ) if x.strip() in expected ]
+        self.assertEqual( expected, found )
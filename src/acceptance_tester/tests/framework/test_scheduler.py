@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import acceptance_tester.framework.scheduler as scheduler
+
+
+def make_test( suite, name ):
+    return { 'test-suite': suite, 'name': name }
+
+
+class TestTimingHistory( unittest.TestCase ):
+
+    def setUp( self ):
+        self.test_folder = tempfile.mkdtemp()
+        self.path = os.path.join( self.test_folder, "timings.json" )
+
+    def tearDown( self ):
+        shutil.rmtree( self.test_folder )
+
+    def test_predict_returns_none_if_nothing_is_recorded( self ):
+        """ Test that no prediction is made for an empty history
+        """
+        history = scheduler.TimingHistory()
+        self.assertEqual( None, history.predict( "suite.xml", "test" ) )
+
+    def test_predict_returns_recorded_duration( self ):
+        """ Test that the recorded duration is used for a known test
+        """
+        history = scheduler.TimingHistory()
+        history.record( "suite.xml", "test", 10.0 )
+        self.assertEqual( 10.0, history.predict( "suite.xml", "test" ) )
+
+    def test_predict_uses_suite_average_for_unknown_test( self ):
+        """ Test that unknown tests are predicted from the average of their testsuite
+        """
+        history = scheduler.TimingHistory()
+        history.record( "a.xml", "test1", 10.0 )
+        history.record( "a.xml", "test2", 20.0 )
+        history.record( "b.xml", "test1", 100.0 )
+        self.assertEqual( 15.0, history.predict( "a.xml", "new test" ) )
+
+    def test_predict_uses_global_average_for_unknown_suite( self ):
+        """ Test that tests from unknown testsuites are predicted from the average of all tests
+        """
+        history = scheduler.TimingHistory()
+        history.record( "a.xml", "test1", 10.0 )
+        history.record( "b.xml", "test1", 20.0 )
+        self.assertEqual( 15.0, history.predict( "c.xml", "test1" ) )
+
+    def test_record_smooths_repeated_measurements( self ):
+        """ Test that a new measurement is merged with the recorded duration
+        """
+        history = scheduler.TimingHistory( smoothing=0.5 )
+        history.record( "a.xml", "test1", 10.0 )
+        history.record( "a.xml", "test1", 20.0 )
+        self.assertEqual( 15.0, history.predict( "a.xml", "test1" ) )
+
+    def test_history_is_saved_and_loaded( self ):
+        """ Test that recorded durations survive a save and load
+        """
+        history = scheduler.TimingHistory( self.path )
+        history.record_results( [ { 'test-suite': "a.xml", 'name': "test1",
+                                    'time': datetime.timedelta( seconds=42 ) } ] )
+        history.save()
+
+        loaded = scheduler.TimingHistory( self.path )
+        self.assertEqual( 42.0, loaded.predict( "a.xml", "test1" ) )
+
+    def test_skipped_tests_are_not_recorded( self ):
+        """ Test that tests skipped by a cancelled run do not affect the history
+        """
+        history = scheduler.TimingHistory()
+        history.record_results( [ { 'test-suite': "a.xml", 'name': "test1", 'status': "SKIPPED",
+                                    'time': datetime.timedelta( seconds=0 ) } ] )
+        self.assertEqual( None, history.predict( "a.xml", "test1" ) )
+
+    def test_unreadable_history_is_ignored( self ):
+        """ Test that a corrupt history file results in an empty history
+        """
+        fh = open( self.path, 'w' )
+        fh.write( "not json" )
+        fh.close()
+        history = scheduler.TimingHistory( self.path )
+        self.assertEqual( None, history.predict( "a.xml", "test1" ) )
+
+
+class TestLongestFirst( unittest.TestCase ):
+
+    def test_tests_are_ordered_longest_first( self ):
+        """ Test that tests are ordered by predicted duration, longest first
+        """
+        history = scheduler.TimingHistory()
+        history.record( "a.xml", "short", 1.0 )
+        history.record( "a.xml", "long", 100.0 )
+        history.record( "b.xml", "medium", 10.0 )
+        tests = [ make_test( "a.xml", "short" ), make_test( "b.xml", "medium" ), make_test( "a.xml", "long" ) ]
+
+        ordered = scheduler.longest_first( tests, history )
+        self.assertEqual( [ "long", "medium", "short" ], [ x['name'] for x in ordered ] )
+
+    def test_order_is_kept_without_history( self ):
+        """ Test that discovery order is kept when no durations are known
+        """
+        tests = [ make_test( "a.xml", "test%s"%i ) for i in range( 5 ) ]
+        ordered = scheduler.longest_first( tests, scheduler.TimingHistory() )
+        self.assertEqual( tests, ordered )
+
+
+class TestSuiteGroups( unittest.TestCase ):
+
+    def make_tests( self, suites ):
+        tests = []
+        for suite, count in suites:
+            for i in range( count ):
+                test = make_test( suite, "test%s"%i )
+                test['id'] = len( tests )
+                tests.append( test )
+        return tests
+
+    def test_tests_are_grouped_by_suite( self ):
+        """ Test that each group only contains tests from one testsuite
+        """
+        tests = self.make_tests( [ ( "a.xml", 3 ), ( "b.xml", 2 ) ] )
+        groups = scheduler.suite_groups( tests, scheduler.TimingHistory(), 2 )
+        self.assertEqual( [ [0, 1, 2], [3, 4] ], groups )
+
+    def test_groups_are_ordered_longest_first( self ):
+        """ Test that the group with the longest total duration is first
+        """
+        tests = self.make_tests( [ ( "a.xml", 2 ), ( "b.xml", 2 ) ] )
+        history = scheduler.TimingHistory()
+        history.record( "a.xml", "test0", 1.0 )
+        history.record( "b.xml", "test0", 10.0 )
+        groups = scheduler.suite_groups( tests, history, 1 )
+        self.assertEqual( [ [2, 3], [0, 1] ], groups )
+
+    def test_suites_are_split_if_fewer_than_workers( self ):
+        """ Test that a single testsuite is split so all workers get tests
+        """
+        tests = self.make_tests( [ ( "a.xml", 5 ) ] )
+        groups = scheduler.suite_groups( tests, scheduler.TimingHistory(), 2 )
+        self.assertEqual( [ [0, 1, 2], [3, 4] ], groups )
+
+
+class TestBatches( unittest.TestCase ):
+
+    def test_tests_are_dealt_round_robin( self ):
+        """ Test that each batch gets a share of the long and the short tests
+        """
+        tests = [ { 'id': i } for i in range( 5 ) ]
+        self.assertEqual( [ [0, 2, 4], [1, 3] ], scheduler.batches( tests, 2 ) )
+
+    def test_empty_batches_are_left_out( self ):
+        """ Test that no empty batches are returned if there are fewer tests than batches
+        """
+        tests = [ { 'id': i } for i in range( 2 ) ]
+        self.assertEqual( [ [0], [1] ], scheduler.batches( tests, 4 ) )
+
+
+class TestResourceBudget( unittest.TestCase ):
+
+    def setUp( self ):
+        self.demands = { 'small': { 'cpus': 1.0, 'memory': 100.0, 'exclusive': set() },
+                         'large': { 'cpus': 3.0, 'memory': 100.0, 'exclusive': set() },
+                         'huge': { 'cpus': 8.0, 'memory': 100.0, 'exclusive': set() },
+                         'db': { 'cpus': 1.0, 'memory': 100.0, 'exclusive': set( [ 'database' ] ) } }
+        self.budget = scheduler.ResourceBudget( { 'cpus': 4.0, 'memory': 1000.0 }, self.demands.get )
+
+    def test_task_fits_within_capacity( self ):
+        """ Test that tasks are started until the capacity is used
+        """
+        self.budget.acquire( 'large' )
+        self.assertTrue( self.budget.fits( 'small' ) )
+        self.budget.acquire( 'small' )
+        self.assertFalse( self.budget.fits( 'small' ) )
+
+    def test_released_resources_are_available( self ):
+        """ Test that the resources of a finished task can be used by the next task
+        """
+        self.budget.acquire( 'large' )
+        self.budget.acquire( 'small' )
+        self.budget.release( 'large' )
+        self.assertTrue( self.budget.fits( 'large' ) )
+
+    def test_exclusive_token_is_held_by_one_task( self ):
+        """ Test that tasks with the same exclusive token do not run at the same time
+        """
+        self.budget.acquire( 'db' )
+        self.assertFalse( self.budget.fits( 'db' ) )
+        self.assertTrue( self.budget.fits( 'small' ) )
+        self.budget.release( 'db' )
+        self.assertTrue( self.budget.fits( 'db' ) )
+
+    def test_task_larger_than_capacity_runs_alone( self ):
+        """ Test that a task needing more than the capacity is started when nothing else runs
+        """
+        self.assertTrue( self.budget.fits( 'huge' ) )
+        self.budget.acquire( 'huge' )
+        self.assertFalse( self.budget.fits( 'small' ) )
+
+
+class TestShard( unittest.TestCase ):
+
+    def make_tests( self, count ):
+        return [ make_test( "a.xml", "test%s"%i ) for i in range( count ) ]
+
+    def test_shards_cover_all_tests_once( self ):
+        """ Test that every test is in exactly one shard
+        """
+        tests = self.make_tests( 7 )
+        history = scheduler.TimingHistory()
+        shards = [ scheduler.shard( tests, history, i, 3 ) for i in range( 1, 4 ) ]
+        names = sorted( [ x['name'] for shard in shards for x in shard ] )
+        self.assertEqual( sorted( [ x['name'] for x in tests ] ), names )
+        self.assertEqual( [ 3, 2, 2 ], [ len( x ) for x in shards ] )
+
+    def test_shards_are_balanced_by_duration( self ):
+        """ Test that a long test gets a shard of its own
+        """
+        tests = self.make_tests( 4 )
+        history = scheduler.TimingHistory()
+        history.record( "a.xml", "test2", 30.0 )
+        for name in [ "test0", "test1", "test3" ]:
+            history.record( "a.xml", name, 10.0 )
+        self.assertEqual( [ "test2" ], [ x['name'] for x in scheduler.shard( tests, history, 1, 2 ) ] )
+
+    def test_split_does_not_depend_on_discovery_order( self ):
+        """ Test that the same tests end in the same shard when found in another order
+        """
+        tests = self.make_tests( 5 )
+        history = scheduler.TimingHistory()
+        first = scheduler.shard( tests, history, 2, 2 )
+        second = scheduler.shard( list( reversed( tests ) ), history, 2, 2 )
+        self.assertEqual( sorted( [ x['name'] for x in first ] ), sorted( [ x['name'] for x in second ] ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+import unittest
+
+import acceptance_tester.framework.selection as selection
+
+CASES = [ ( "/tests/holdings/suite.xml", "delete_record", None, { 'when': "A record is deleted" }, {}, {} ),
+          ( "/tests/holdings/suite.xml", "add_record", None, { 'when': "A record is added", 'then': "It times out" }, {}, {} ),
+          ( "/tests/search/slow.xml", "search_all", None, {}, {}, {} ) ]
+
+
+class TestSelectionExpression( unittest.TestCase ):
+
+    def selected( self, expression ):
+        expression = selection.SelectionExpression( expression )
+        return [ x[1] for x in CASES if expression.matches( x ) ]
+
+    def test_term_is_searched_in_name_and_suite_path( self ):
+        """ Test that a term without a field selects by test name or testsuite path
+        """
+        self.assertEqual( [ "delete_record", "add_record" ], self.selected( "RECORD" ) )
+        self.assertEqual( [ "search_all" ], self.selected( "slow" ) )
+
+    def test_term_with_field_is_searched_in_that_field( self ):
+        """ Test that field terms search the documentation, and quoted terms keep white space
+        """
+        self.assertEqual( [ "delete_record" ], self.selected( "when:'is deleted'" ) )
+        self.assertEqual( [ "add_record" ], self.selected( 'then:"times out"' ) )
+        self.assertEqual( [ "search_all" ], self.selected( "name:^s" ) )
+
+    def test_operators_and_parentheses( self ):
+        """ Test that not binds tighter than and, which binds tighter than or
+        """
+        self.assertEqual( [ "add_record", "search_all" ], self.selected( "not delete" ) )
+        self.assertEqual( [ "add_record", "search_all" ], self.selected( "holdings and not delete or search" ) )
+        self.assertEqual( [ "add_record" ], self.selected( "holdings and not (delete or search)" ) )
+
+    def test_suite_path_is_relative_to_the_test_folder( self ):
+        """ Test that terms do not match the folders above the test folder, or a testsuite given by path
+        """
+        expression = selection.SelectionExpression( "tests" )
+        self.assertEqual( [], [ x[1] for x in CASES if expression.matches( x, [ "/tests" ] ) ] )
+        expression = selection.SelectionExpression( "suite:^holdings/" )
+        self.assertEqual( [ "delete_record", "add_record" ], [ x[1] for x in CASES if expression.matches( x, [ "/tests" ] ) ] )
+        self.assertEqual( "slow.xml", selection.relative_suite_path( "/tests/search/slow.xml", [ "/tests", "/tests/search/slow.xml" ] ) )
+        self.assertEqual( "search/slow.xml", selection.relative_suite_path( "/tests/search/slow.xml", [ "/tests", "/tests/holdings" ] ) )
+
+    def test_invalid_expressions_are_rejected( self ):
+        """ Test that expressions that cannot be parsed raise RuntimeError
+        """
+        for expression in [ "", "a and", "(a", "a b", "title:a", "name:[" ]:
+            self.assertRaises( RuntimeError, selection.SelectionExpression, expression )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+from lxml import etree
+
+import acceptance_tester.framework.setup_cache as setup_cache
+
+
+setup_xml = '''<setup xmlns="info:testsuite#" xmlns:fc="http://dbc.dk/xml/namespaces/fcrepo">
+                <fc:fcrepo type="normal" />
+               </setup>'''
+
+
+class TestSetupKey( unittest.TestCase ):
+
+    def test_key_ignores_whitespace_differences( self ):
+        """ Test that setup nodes differing only in attribute quoting get the same key
+        """
+        other_xml = setup_xml.replace( 'type="normal"', "type='normal'" )
+        key1 = setup_cache.setup_key( etree.fromstring( setup_xml ), "type", "/suites" )
+        key2 = setup_cache.setup_key( etree.fromstring( other_xml ), "type", "/suites" )
+        self.assertEqual( key1, key2 )
+
+    def test_key_depends_on_suite_folder( self ):
+        """ Test that identical setup in different folders gets different keys
+        """
+        key1 = setup_cache.setup_key( etree.fromstring( setup_xml ), "type", "/suites/a" )
+        key2 = setup_cache.setup_key( etree.fromstring( setup_xml ), "type", "/suites/b" )
+        self.assertNotEqual( key1, key2 )
+
+
+    def test_key_depends_on_referenced_fixtures( self ):
+        """ Test that changing a fixture file the setup refers to gives a new key
+        """
+        folder = tempfile.mkdtemp()
+        try:
+            os.mkdir( os.path.join( folder, "fixtures" ) )
+            fixture = os.path.join( folder, "fixtures", "records.txt" )
+            fh = open( fixture, 'w' )
+            fh.write( "one" )
+            fh.close()
+            node = etree.fromstring( '<setup xmlns="info:testsuite#"><load folder="fixtures"/><load folder=".."/></setup>' )
+            key1 = setup_cache.setup_key( node, "type", folder )
+            fh = open( fixture, 'w' )
+            fh.write( "one and two" )
+            fh.close()
+            key2 = setup_cache.setup_key( node, "type", folder )
+            self.assertNotEqual( key1, key2 )
+            self.assertEqual( [ os.path.join( folder, "fixtures" ) ], setup_cache.fixture_paths( node, folder ) )
+        finally:
+            shutil.rmtree( folder )
+
+    def test_key_depends_on_fingerprint( self ):
+        """ Test that the fingerprint of the resource folder is part of the key
+        """
+        key1 = setup_cache.setup_key( etree.fromstring( setup_xml ), "type", "/suites", "a" )
+        key2 = setup_cache.setup_key( etree.fromstring( setup_xml ), "type", "/suites", "b" )
+        self.assertNotEqual( key1, key2 )
+
+
+class TestSetupSnapshotCache( unittest.TestCase ):
+
+    def setUp( self ):
+        self.test_folder = tempfile.mkdtemp()
+        self.cache_folder = os.path.join( self.test_folder, "cache" )
+        self.counter = 0
+
+    def tearDown( self ):
+        shutil.rmtree( self.test_folder )
+
+    def make_build_folder( self, files ):
+        self.counter += 1
+        folder = os.path.join( self.test_folder, "build%s"%self.counter )
+        os.mkdir( folder )
+        for name, content in files.items():
+            path = os.path.join( folder, name )
+            if not os.path.exists( os.path.dirname( path ) ):
+                os.makedirs( os.path.dirname( path ) )
+            fh = open( path, 'w' )
+            fh.write( content )
+            fh.close()
+        return folder
+
+    def test_restore_returns_false_for_unknown_key( self ):
+        """ Test that nothing is restored if no snapshot exists
+        """
+        cache = setup_cache.SetupSnapshotCache( self.cache_folder, 1000 )
+        self.assertFalse( cache.restore( "unknown", self.make_build_folder( {} ) ) )
+
+    def test_stored_snapshot_is_restored( self ):
+        """ Test that a stored build folder is restored into a new build folder
+        """
+        cache = setup_cache.SetupSnapshotCache( self.cache_folder, 1000 )
+        cache.store( "key", self.make_build_folder( { 'fixture.txt': 'data', 'sub/more.txt': 'more' } ) )
+
+        build_folder = self.make_build_folder( {} )
+        self.assertTrue( cache.restore( "key", build_folder ) )
+        fh = open( os.path.join( build_folder, 'sub', 'more.txt' ) )
+        self.assertEqual( 'more', fh.read() )
+        fh.close()
+
+    def test_snapshot_is_independent_of_build_folder( self ):
+        """ Test that changes to the build folder after storing do not change the snapshot
+        """
+        cache = setup_cache.SetupSnapshotCache( self.cache_folder, 1000 )
+        original = self.make_build_folder( { 'fixture.txt': 'data' } )
+        cache.store( "key", original )
+        fh = open( os.path.join( original, 'fixture.txt' ), 'w' )
+        fh.write( 'changed' )
+        fh.close()
+
+        build_folder = self.make_build_folder( {} )
+        cache.restore( "key", build_folder )
+        fh = open( os.path.join( build_folder, 'fixture.txt' ) )
+        self.assertEqual( 'data', fh.read() )
+        fh.close()
+
+    def test_least_recently_used_snapshot_is_evicted( self ):
+        """ Test that the least recently used snapshot is removed when the cache is full
+        """
+        cache = setup_cache.SetupSnapshotCache( self.cache_folder, 10 )
+        cache.store( "old", self.make_build_folder( { 'a': '1234' } ) )
+        time.sleep( 0.01 )
+        cache.store( "used", self.make_build_folder( { 'a': '1234' } ) )
+        time.sleep( 0.01 )
+        cache.restore( "old", self.make_build_folder( {} ) )
+        time.sleep( 0.01 )
+        cache.store( "new", self.make_build_folder( { 'a': '1234' } ) )
+
+        self.assertTrue( cache.restore( "old", self.make_build_folder( {} ) ) )
+        self.assertFalse( cache.restore( "used", self.make_build_folder( {} ) ) )
+        self.assertTrue( cache.restore( "new", self.make_build_folder( {} ) ) )
+
+    def test_files_are_copied_without_the_lock( self ):
+        """ Test that snapshots are copied while the index is not locked
+        """
+        cache = setup_cache.SetupSnapshotCache( self.cache_folder, 1000 )
+        locked = []
+        locked_index = cache._locked_index
+
+        def _locked_index( update ):
+            locked.append( True )
+            try:
+                return locked_index( update )
+            finally:
+                locked.pop()
+
+        copy_tree = setup_cache._copy_tree
+
+        def _copy_tree( src, dst, hardlinks ):
+            self.assertEqual( [], locked )
+            copy_tree( src, dst, hardlinks )
+
+        with patch.object( cache, '_locked_index', side_effect=_locked_index ), \
+             patch.object( setup_cache, '_copy_tree', side_effect=_copy_tree ) as copied:
+            cache.store( "key", self.make_build_folder( { 'fixture.txt': 'data' } ) )
+            self.assertTrue( cache.restore( "key", self.make_build_folder( {} ) ) )
+        self.assertEqual( 2, copied.call_count )
+        self.assertEqual( [ 'index.json', 'key' ], sorted( os.listdir( self.cache_folder ) ) )
+
+    def test_evicted_snapshot_is_not_restored( self ):
+        """ Test that a snapshot removed while it is restored leaves an empty build folder
+        """
+        cache = setup_cache.SetupSnapshotCache( self.cache_folder, 1000 )
+        cache.store( "key", self.make_build_folder( { 'fixture.txt': 'data', 'sub/more.txt': 'more' } ) )
+        copy_tree = setup_cache._copy_tree
+
+        def _copy_tree( src, dst, hardlinks ):
+            os.mkdir( os.path.join( dst, 'partial' ) )
+            shutil.rmtree( src )
+            copy_tree( src, dst, hardlinks )
+
+        build_folder = self.make_build_folder( {} )
+        with patch.object( setup_cache, '_copy_tree', side_effect=_copy_tree ):
+            self.assertFalse( cache.restore( "key", build_folder ) )
+        self.assertEqual( [], os.listdir( build_folder ) )
+
+    def test_too_large_build_folder_is_not_stored( self ):
+        """ Test that a build folder larger than the cache is not stored
+        """
+        cache = setup_cache.SetupSnapshotCache( self.cache_folder, 2 )
+        cache.store( "key", self.make_build_folder( { 'a': '1234' } ) )
+        self.assertFalse( cache.restore( "key", self.make_build_folder( {} ) ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
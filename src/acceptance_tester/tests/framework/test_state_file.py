@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+import acceptance_tester.framework.state_file as state_file
+
+
+class TestStateFile( unittest.TestCase ):
+
+    def setUp( self ):
+        self.test_folder = tempfile.mkdtemp()
+        self.path = os.path.join( self.test_folder, "state.json" )
+
+    def tearDown( self ):
+        shutil.rmtree( self.test_folder )
+
+    def test_content_is_read_back( self ):
+        """ Test that written content is read back with its version and stamp, and no temporary file is left
+        """
+        state_file.write( self.path, 2, { 'tests': { 'a': 1 } }, { 'writer': "x" } )
+        content = state_file.read( self.path, 2, "state", { 'writer': "x" } )
+
+        self.assertEqual( { 'tests': { 'a': 1 }, 'writer': "x", 'version': 2 }, content )
+        self.assertEqual( [ "state.json" ], os.listdir( self.test_folder ) )
+
+    def test_missing_and_unreadable_files_are_discarded( self ):
+        """ Test that missing, corrupt and non dictionary files read as None
+        """
+        self.assertEqual( None, state_file.read( self.path, 1, "state" ) )
+        self.assertEqual( None, state_file.read( None, 1, "state" ) )
+        for content in [ "{ truncated", "[ 1, 2 ]", "" ]:
+            fh = open( self.path, 'w' )
+            fh.write( content )
+            fh.close()
+            self.assertEqual( None, state_file.read( self.path, 1, "state" ) )
+
+    def test_other_version_or_stamp_is_ignored( self ):
+        """ Test that a file with another version or stamp reads as None
+        """
+        state_file.write( self.path, 1, {}, { 'writer': "x" } )
+        self.assertEqual( None, state_file.read( self.path, 2, "state", { 'writer': "x" } ) )
+        self.assertEqual( None, state_file.read( self.path, 1, "state", { 'writer': "y" } ) )
+
+    def test_update_changes_the_current_content( self ):
+        """ Test that update passes the current content, or None, and writes the returned content
+        """
+        seen = []
+
+        def change( content ):
+            seen.append( content )
+            counter = 0
+            if content != None:
+                counter = content['counter']
+            return { 'counter': counter + 1 }
+
+        state_file.update( self.path, 1, "state", change )
+        state_file.update( self.path, 1, "state", change )
+
+        self.assertEqual( None, seen[0] )
+        self.assertEqual( 2, state_file.read( self.path, 1, "state" )['counter'] )
+
+
+if __name__ == '__main__':
+    unittest.main()
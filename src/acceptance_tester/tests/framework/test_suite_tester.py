@@ -22,6 +22,7 @@ import acceptance_tester.framework.suite_tester
 import acceptance_tester.framework.rst_creator as rst_creator
 import acceptance_tester.framework.job as job
 import acceptance_tester.framework.find_tests as find_tests
+from acceptance_tester.abstract_testsuite_runner.test_runner import TestRunner
 
 
 example_xsd = '''<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema"
@@ -175,6 +176,11 @@ testsuite3 = '''<?xml version="1.0" encoding="UTF-8"?>
                  </testsuite>'''
 
 
+def found_suite( type_name ):
+    """ Returns a testsuite as found by find_tests._find_testsuites, a tuple with the path and the parsed xml """
+    return ( '/path/to/tests/foo.xml', etree.ElementTree( etree.fromstring( '<testsuite xmlns="info:testsuite#" type="%s"/>'%type_name ) ) )
+
+
 def normalize_xml( xml_or_string ):
     parser = etree.XMLParser( remove_blank_text=True, encoding="UTF-8" )
 
@@ -222,7 +228,7 @@ class TestSuiteTester( unittest.TestCase ):
         """ Test whether the suitetester constructor raises if pool size < 1
         """
         arguments = self.arguments
-        arguments[6] = 0
+        arguments[7] = 0
         self.assertRaises( RuntimeError, SuiteTester, *arguments )
 
     def test_suitetester_raises_if_port_range_list_is_bigger_than_2( self ):
@@ -237,27 +243,48 @@ class TestSuiteTester( unittest.TestCase ):
         arguments = self.arguments
         self.assertRaises( RuntimeError, SuiteTester, *arguments, port_range="3000-2000" )
 
+    def test_suitetester_raises_if_shard_index_is_bigger_than_total( self ):
+        """ Test whether the suitetester constructor raises if the shard index is bigger than the number of shards
+        """
+        arguments = self.arguments
+        self.assertRaises( RuntimeError, SuiteTester, *arguments, shard="3/2" )
+
+    def test_suitetester_raises_if_a_cache_is_used_without_state_folder( self ):
+        """ Test whether the suitetester constructor raises if the setup or result cache is used without a state folder
+        """
+        arguments = self.arguments
+        self.assertRaises( RuntimeError, SuiteTester, *arguments, setup_cache_size=10 )
+        self.assertRaises( RuntimeError, SuiteTester, *arguments, result_cache_size=10 )
+
+    def test_suitetester_raises_if_smallest_pool_size_is_bigger_than_largest( self ):
+        """ Test whether the suitetester constructor raises if the range of an automatic pool size is reversed
+        """
+        arguments = self.arguments
+        arguments[7] = 'auto'
+        self.assertRaises( RuntimeError, SuiteTester, *arguments, pool_size_range=( 4, 2 ) )
+
     def test_suite_tester_raises_if_testrunner_is_not_present( self ):
         """ Test whether a runtime error is raised if testrunner is not present for test type
         """
-
-        acceptance_tester.framework.find_tests._find_testsuites = Mock( return_value=['foo'] )
-        acceptance_tester.framework.find_tests._get_test_type = Mock( return_value=( 'unknown-type', {'resource-manager': None } ) )
-        self.assertRaises( RuntimeError, acceptance_tester.framework.suite_tester.SuiteTester, *self.arguments )
+        with patch.object( find_tests, '_find_testsuites', return_value=[ found_suite( 'unknown-type' ) ] ), \
+             patch.dict( find_tests.TYPES, { 'unknown-type': {} } ), \
+             patch.object( acceptance_tester.framework.load_testrunner, 'load_testrunner', return_value={'resource-manager': None } ):
+            self.assertRaises( RuntimeError, acceptance_tester.framework.suite_tester.SuiteTester, *self.arguments )
 
     def test_suite_parser_test_suites_are_filtered_according_to_xsd_if_provided( self ):
         """ Test whether the _filter_non_valid_testsuites is called if xsd is provided
         """
-        acceptance_tester.framework.find_tests._find_testsuites = Mock( return_value=['foo'] )
-        acceptance_tester.framework.find_tests._get_test_type = Mock( return_value=( 'unknown-type', {'test-runner': None, 'resource-manager': None, 'xsd': 'bar' } ) )
+        suite = found_suite( 'unknown-type' )
+        test_type = {'test-runner': None, 'resource-manager': None, 'xsd': 'bar' }
+        with patch.object( find_tests, '_find_testsuites', return_value=[ suite ] ), \
+             patch.object( find_tests, '_get_test_type', return_value=( 'unknown-type', test_type ) ), \
+             patch.object( find_tests, '_get_tests', return_value=[] ), \
+             patch.object( find_tests, '_filter_non_valid_suites', return_value=[] ) as filter_suites:
 
-        acceptance_tester.framework.find_tests._get_tests = Mock( return_value=[] )
-        acceptance_tester.framework.find_tests._filter_non_valid_suites = Mock( return_value=[] )
+            acceptance_tester.framework.suite_tester.SuiteTester( *self.arguments )
 
-        acceptance_tester.framework.suite_tester.SuiteTester( *self.arguments )
-
-        expected = call(['foo'], {'test-runner': None, 'xsd': 'bar', 'resource-manager': None})
-        self.assertEqual( expected, acceptance_tester.framework.find_tests._filter_non_valid_suites.call_args )
+        expected = call([ suite ], {'test-runner': None, 'xsd': 'bar', 'resource-manager': None})
+        self.assertEqual( expected, filter_suites.call_args )
 
     # def test_suite_parser_test_arguments_looks_as_expected( self ):
     #     """ Test whether the test arguments build by the constructor looks as expected
@@ -787,3 +814,108 @@ class TestSuiteTester( unittest.TestCase ):
     #     result = fh.read()
     #     fh.close()
     #     self.assertEqual( "test-line 1\ntest-line 2", result.strip() )
+
+
+class MarkedTestRunner( TestRunner ):
+    """ Test runner failing tests with a fail attribute, and the first attempt of tests with a flaky attribute naming a marker file """
+
+    def run_test( self, test_xml, build_folder, resource_manager ):
+        test = test_xml.xpath( '/wrapping/*[local-name()="test"]' )[0]
+        if test.get( 'fail' ) != None:
+            self.failures.append( "Test failed" )
+        flaky = test.get( 'flaky' )
+        if flaky != None and not os.path.exists( flaky ):
+            open( flaky, 'w' ).close()
+            self.failures.append( "Test failed on the first attempt" )
+
+
+class TestSuiteTesterRun( unittest.TestCase ):
+
+    def setUp( self ):
+        self.test_folder = tempfile.mkdtemp()
+        self.suite_folder = os.path.join( self.test_folder, 'suites' )
+        os.mkdir( self.suite_folder )
+        self.types = patch.dict( find_tests.TYPES, { 'marked': { 'test-runner': __name__ + '.MarkedTestRunner' } } )
+        self.types.start()
+
+    def tearDown( self ):
+        self.types.stop()
+        shutil.rmtree( self.test_folder )
+
+    def write_suite( self, tests ):
+        path = os.path.join( self.suite_folder, 'suite.xml' )
+        fh = open( path, 'w' )
+        fh.write( '<testsuite xmlns="info:testsuite#" type="marked">%s</testsuite>'%"".join( tests ) )
+        fh.close()
+
+    def create_suite_tester( self, pool_size='1', **kwargs ):
+        return SuiteTester( [ self.suite_folder ],
+                            os.path.join( self.test_folder, 'build-folder' ),
+                            os.path.join( self.test_folder, 'resource-folder' ),
+                            os.path.join( self.test_folder, 'test-results' ),
+                            os.path.join( self.test_folder, 'report-file' ),
+                            os.path.join( self.test_folder, 'log-file' ),
+                            None,
+                            pool_size,
+                            False,
+                            None,
+                            True,
+                            **kwargs )
+
+    def run_suite_tester( self, **kwargs ):
+        """ Runs the tests, and returns the results written to xUnit files by test name """
+        suite_tester = self.create_suite_tester( **kwargs )
+        with patch.object( SuiteTester, '_write_junit_file' ) as write_junit_file:
+            suite_tester.run()
+        results = dict()
+        for name, data in [ x[0] for x in write_junit_file.call_args_list ]:
+            results.update( [ ( x['name'], x ) for x in data ] )
+        return results
+
+    def test_cpu_capacity_defaults_to_the_pool_size( self ):
+        """ Test that tests declaring no cpus are not limited to the number of CPUs
+        """
+        self.write_suite( [ '<test name="test"/>' ] )
+        suite_tester = self.create_suite_tester( pool_size=str( 4 * ( os.cpu_count() or 1 ) ) )
+        self.assertEqual( 4.0 * ( os.cpu_count() or 1 ), suite_tester.capacity['cpus'] )
+
+    def test_failed_tests_are_retried( self ):
+        """ Test that retried tests are run again, and their final results are written
+        """
+        self.write_suite( [ '<test name="flaky" flaky="%s"/>'%os.path.join( self.test_folder, 'flaky-mark' ),
+                            '<test name="broken" fail="yes"/>',
+                            '<test name="good"/>' ] )
+        results = self.run_suite_tester( retries=1 )
+
+        self.assertEqual( [ "broken", "flaky", "good" ], sorted( results ) )
+        self.assertEqual( "SUCCESS", results['flaky']['status'] )
+        self.assertEqual( [ "FAILURE", "SUCCESS" ], [ x[0] for x in results['flaky']['attempts'] ] )
+        self.assertEqual( "FAILURE", results['broken']['status'] )
+        self.assertEqual( 2, len( results['broken']['attempts'] ) )
+        self.assertEqual( "SUCCESS", results['good']['status'] )
+
+    def test_remaining_tests_are_skipped_at_max_failures( self ):
+        """ Test that the run is cancelled when the number of failures reaches the maximum
+        """
+        self.write_suite( [ '<test name="test%s" fail="yes"/>'%i for i in range( 10 ) ] )
+        results = self.run_suite_tester( max_failures=1 )
+
+        self.assertEqual( 10, len( results ) )
+        statuses = [ x['status'] for x in results.values() ]
+        self.assertTrue( statuses.count( "SKIPPED" ) >= 5, statuses )
+
+    def test_shards_split_the_same_way_in_every_run( self ):
+        """ Test that shards with their own state folders run the same tests every run, and together run all tests
+        """
+        self.write_suite( [ '<test name="test%s"/>'%i for i in range( 20 ) ] )
+        rounds = []
+        for run in range( 2 ):
+            shards = []
+            for index in [ 1, 2 ]:
+                state_folder = os.path.join( self.test_folder, 'state-%s'%index )
+                shards.append( sorted( self.run_suite_tester( shard="%s/2"%index, state_folder=state_folder ) ) )
+            rounds.append( shards )
+
+        self.assertEqual( rounds[0], rounds[1] )
+        self.assertEqual( sorted( [ "test%s"%i for i in range( 20 ) ] ), sorted( rounds[0][0] + rounds[0][1] ) )
+        self.assertFalse( os.path.exists( os.path.join( self.test_folder, 'state-1', 'test-timings.json' ) ) )
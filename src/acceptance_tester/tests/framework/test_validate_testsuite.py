@@ -148,5 +148,23 @@ class Test_validate_testsuite( unittest.TestCase ):
                           rvalue.xpath( "/ns:testsuite/ns:test",
                                         namespaces = {'ns': 'info:testsuite#'} )[0].get( 'name' ) )
 
+    def test_root_check_only_reads_root_node( self ):
+        """
+        Tests that the root check accepts a testsuite root, even if the rest of the file is broken.
+        """
+        fname = self.write_test_file( '<testsuite xmlns="info:testsuite#" type="fcrepo-solr"><test name="broken">' )
+        self.assertTrue( vt.has_testsuite_root( fname ) )
+        self.assertEqual( None, vt.validate_testsuite_file( fname ) )
+
+    def test_root_check_rejects_other_xml( self ):
+        """
+        Tests that the root check rejects xml files that are not testsuite files.
+        """
+        fname = self.write_test_file( '<fixture><data>' + '<row/>' * 1000 + '</data></fixture>' )
+        self.assertFalse( vt.has_testsuite_root( fname ) )
+        fname = self.write_test_file( '<testsuite xmlns="info:testsuite#"></testsuite>' )
+        self.assertFalse( vt.has_testsuite_root( fname ) )
+        self.assertFalse( vt.has_testsuite_root( os.path.join( self.test_folder, "missing" ) ) )
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+import acceptance_tester.framework.watch as watch
+import acceptance_tester.framework.file_walker as file_walker
+
+
+class TestFileWatcher( unittest.TestCase ):
+
+    def setUp( self ):
+        self.test_folder = tempfile.mkdtemp()
+        self.suites = os.path.join( self.test_folder, "suites" )
+        os.mkdir( self.suites )
+        self.suite = self.write( os.path.join( self.suites, "a.xml" ), "<testsuite/>" )
+        self.config = self.write( os.path.join( self.test_folder, "config.cfg" ), "a=1" )
+        self.watcher = watch.FileWatcher( [ self.suites ], [ self.config ], interval=0.01 )
+
+    def tearDown( self ):
+        self.watcher.close()
+        shutil.rmtree( self.test_folder )
+
+    def write( self, path, content ):
+        fh = open( path, 'w' )
+        fh.write( content )
+        fh.close()
+        return path
+
+    def test_no_changes_are_reported_for_unchanged_files( self ):
+        """ Test that nothing is reported if no watched file changed
+        """
+        self.assertEqual( set(), self.watcher.changes() )
+
+    def test_changed_created_and_removed_files_are_reported( self ):
+        """ Test that changed, new and removed testsuite files are reported
+        """
+        self.write( self.suite, "<testsuite><test/></testsuite>" )
+        new_suite = self.write( os.path.join( self.suites, "b.xml" ), "<testsuite/>" )
+        self.assertEqual( set( [ self.suite, new_suite ] ), self.watcher.changes() )
+        os.remove( new_suite )
+        self.assertEqual( set( [ new_suite ] ), self.watcher.changes() )
+
+    def test_only_xml_files_are_watched_in_test_folders( self ):
+        """ Test that other files in the test folders are not reported
+        """
+        self.write( os.path.join( self.suites, "notes.txt" ), "notes" )
+        self.assertEqual( set(), self.watcher.changes() )
+
+    def test_excluded_folders_are_not_watched( self ):
+        """ Test that files in folders excluded by the file filter are not reported
+        """
+        self.watcher.close()
+        self.watcher = watch.FileWatcher( [ self.suites ], [ self.config ], interval=0.01,
+                                          file_filter=file_walker.FileFilter( exclude=[ "data/" ] ) )
+        os.mkdir( os.path.join( self.suites, "data" ) )
+        self.write( os.path.join( self.suites, "data", "rows.xml" ), "<rows/>" )
+        self.assertEqual( set(), self.watcher.changes() )
+
+    def test_other_paths_are_watched( self ):
+        """ Test that a change to the testrunner configuration is reported
+        """
+        self.write( self.config, "a=2, b=3" )
+        self.assertEqual( set( [ self.config ] ), self.watcher.wait_for_changes() )
+
+
+class TestStatusChanges( unittest.TestCase ):
+
+    def result( self, name, status ):
+        return { 'test-suite': "a.xml", 'name': name, 'status': status }
+
+    def test_changed_and_new_tests_are_listed( self ):
+        """ Test that only tests with a new status, and new tests, are listed
+        """
+        previous = { "a.xml::test1": "FAILURE", "a.xml::test2": "SUCCESS" }
+        results = [ self.result( "test2", "SUCCESS" ), self.result( "test1", "SUCCESS" ), self.result( "test3", "ERROR" ) ]
+        self.assertEqual( [ "  test1 (a.xml): FAILURE -> SUCCESS", "  test3 (a.xml): new, ERROR" ],
+                          watch.status_changes( previous, results ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+import multiprocessing
+import os
+import time
+import unittest
+from mock import patch
+
+import acceptance_tester.framework.scheduler as scheduler
+import acceptance_tester.framework.worker_pool as worker_pool
+
+_initialized = []
+
+
+def initialize( value ):
+    _initialized.append( value )
+
+
+def run_task( task ):
+    if task == 'hang':
+        time.sleep( 60 )
+    elif task == 'crash':
+        os._exit( 3 )
+    elif task == 'raise':
+        raise ValueError( "task raised" )
+    elif task == 'initialized':
+        return list( _initialized )
+    elif task == 'pid':
+        return os.getpid()
+    return task * 2
+
+
+def run_timed( task ):
+    started = time.monotonic()
+    time.sleep( 0.2 )
+    return ( task, started, time.monotonic() )
+
+
+def lost( task, elapsed, message ):
+    return ( 'lost', task, message )
+
+
+class TestWorkerPool( unittest.TestCase ):
+
+    def setUp( self ):
+        self.pool = worker_pool.WorkerPool( 2, initialize, ( 'init', ) )
+
+    def tearDown( self ):
+        self.pool.terminate()
+
+    def test_all_tasks_are_run( self ):
+        """ Test that the results of all tasks are returned
+        """
+        results = self.pool.imap_unordered( run_task, [ 1, 2, 3, 4, 5 ] )
+        self.assertEqual( [ 2, 4, 6, 8, 10 ], sorted( results ) )
+
+    def test_hanging_task_is_reported_as_lost_after_timeout( self ):
+        """ Test that a task running past its timeout is stopped, while the other tasks complete
+        """
+        timeout = lambda task: 0.5
+        results = list( self.pool.imap_unordered( run_task, [ 'hang', 1, 2 ], timeout=timeout, on_lost=lost ) )
+
+        self.assertEqual( 3, len( results ) )
+        self.assertTrue( 2 in results and 4 in results )
+        self.assertTrue( ( 'lost', 'hang', "Test timed out after 0.5 seconds" ) in results )
+
+    def test_replacement_worker_is_initialized( self ):
+        """ Test that a worker replacing a killed worker runs the initializer
+        """
+        timeout = lambda task: 0.5
+        pool = worker_pool.WorkerPool( 1, initialize, ( 'init', ) )
+        try:
+            results = list( pool.imap_unordered( run_task, [ 'hang', 'initialized' ], timeout=timeout, on_lost=lost ) )
+        finally:
+            pool.terminate()
+        self.assertEqual( [ 'init' ], results[1] )
+
+    def test_crashed_worker_is_reported_as_lost( self ):
+        """ Test that the task of a worker that dies is reported as lost
+        """
+        results = list( self.pool.imap_unordered( run_task, [ 'crash', 1 ], on_lost=lost ) )
+        self.assertTrue( 2 in results )
+        self.assertTrue( ( 'lost', 'crash', "Worker running the test died with exit code 3" ) in results )
+
+    def test_tasks_are_lost_when_deadline_is_passed( self ):
+        """ Test that running and pending tasks are reported as lost when the deadline is passed
+        """
+        deadline = time.monotonic() + 0.5
+        results = list( self.pool.imap_unordered( run_task, [ 'hang', 'hang', 1 ], on_lost=lost, deadline=deadline ) )
+        self.assertEqual( [ 'hang', 'hang', 1 ], [ x[1] for x in results ] )
+
+    def test_pending_tasks_are_cancelled( self ):
+        """ Test that no tasks are started after the run is cancelled, while running tasks finish
+        """
+        pool = worker_pool.WorkerPool( 1 )
+        try:
+            results = []
+            for result in pool.imap_unordered( run_task, [ 1, 2, 3 ], on_lost=lost ):
+                results.append( result )
+                pool.cancel()
+        finally:
+            pool.terminate()
+        self.assertEqual( [ 2, ( 'lost', 2, "Test not run, since the run was cancelled" ),
+                               ( 'lost', 3, "Test not run, since the run was cancelled" ) ], results )
+
+    def test_running_tasks_are_stopped_after_grace_period( self ):
+        """ Test that a task still running when the grace period ends is stopped
+        """
+        results = []
+        for result in self.pool.imap_unordered( run_task, [ 1, 'hang' ], on_cancelled=lost ):
+            results.append( result )
+            self.pool.cancel( 0.2 )
+        self.assertEqual( [ 2, ( 'lost', 'hang', "Test stopped, since the run was cancelled" ) ], results )
+
+    def test_tasks_sharing_exclusive_token_do_not_overlap( self ):
+        """ Test that tasks holding the same exclusive token run one at a time, while other tasks run beside them
+        """
+        demand = lambda task: { 'cpus': 1.0, 'exclusive': set( [ 'db' ] ) if task < 2 else set() }
+        budget = scheduler.ResourceBudget( { 'cpus': 2.0 }, demand )
+        results = sorted( self.pool.imap_unordered( run_timed, [ 0, 1, 2 ], budget=budget ) )
+
+        self.assertTrue( results[0][2] <= results[1][1] )
+        self.assertTrue( results[2][1] < results[0][2] )
+        self.assertEqual( 0, budget.running )
+
+    def test_retried_task_runs_on_new_worker( self ):
+        """ Test that a retried task is run again, in another process than the first attempt
+        """
+        pool = worker_pool.WorkerPool( 1 )
+        try:
+            results = []
+            for result in pool.imap_unordered( run_task, [ 'pid' ] ):
+                results.append( result )
+                if len( results ) == 1:
+                    pool.retry( 'pid' )
+        finally:
+            pool.terminate()
+        self.assertEqual( 2, len( results ) )
+        self.assertNotEqual( results[0], results[1] )
+
+    def test_workers_can_be_started_by_forkserver( self ):
+        """ Test that tasks run in workers forked from a preloaded forkserver
+        """
+        context = multiprocessing.get_context( 'forkserver' )
+        context.set_forkserver_preload( [ 'acceptance_tester.framework.job' ] )
+        pool = worker_pool.WorkerPool( 2, initialize, ( 'init', ), context=context )
+        try:
+            results = list( pool.imap_unordered( run_task, [ 1, 'initialized' ] ) )
+        finally:
+            pool.terminate()
+        self.assertTrue( 2 in results and [ 'init' ] in results )
+
+    def test_exception_in_task_is_raised( self ):
+        """ Test that an exception raised by a task is raised by imap_unordered
+        """
+        self.assertRaises( RuntimeError, list, self.pool.imap_unordered( run_task, [ 'raise' ] ) )
+
+
+class TestAdaptivePoolSize( unittest.TestCase ):
+
+    def setUp( self ):
+        self.sizer = worker_pool.AdaptivePoolSize( 1, 3, 1000, interval=0 )
+        self.sizer.cpus = 4
+
+    @patch( 'acceptance_tester.framework.worker_pool.available_memory', return_value=5000 )
+    @patch( 'acceptance_tester.framework.worker_pool._load_average', return_value=1.0 )
+    def test_size_grows_to_ceiling_while_host_is_idle( self, load, memory ):
+        """ Test that a worker is added each interval while tasks are waiting, up to the ceiling
+        """
+        self.assertEqual( [ 2, 3, 3 ], [ self.sizer.update( 10 ) for i in range( 3 ) ] )
+
+    @patch( 'acceptance_tester.framework.worker_pool.available_memory', return_value=5000 )
+    @patch( 'acceptance_tester.framework.worker_pool._load_average', return_value=1.0 )
+    def test_size_does_not_grow_without_waiting_tasks( self, load, memory ):
+        """ Test that no workers are added when all tasks have a worker
+        """
+        self.assertEqual( 1, self.sizer.update( 1 ) )
+
+    @patch( 'acceptance_tester.framework.worker_pool.available_memory', return_value=500 )
+    @patch( 'acceptance_tester.framework.worker_pool._load_average', return_value=1.0 )
+    def test_size_shrinks_to_floor_when_memory_is_low( self, load, memory ):
+        """ Test that workers are removed while less memory than the headroom is available
+        """
+        self.sizer.size = 3
+        self.assertEqual( [ 2, 1, 1 ], [ self.sizer.update( 10 ) for i in range( 3 ) ] )
+
+    @patch( 'acceptance_tester.framework.worker_pool.available_memory', return_value=5000 )
+    @patch( 'acceptance_tester.framework.worker_pool._load_average', return_value=1.0 )
+    def test_pool_starts_workers_when_size_grows( self, load, memory ):
+        """ Test that the pool starts more workers when the sizer allows it
+        """
+        pool = worker_pool.WorkerPool( 1, sizer=self.sizer )
+        try:
+            self.assertEqual( 1, len( pool.workers ) )
+            ### the tasks outlast the interval, so tasks are waiting while the size grows
+            results = list( pool.imap_unordered( run_timed, [ 1, 2, 3, 4 ] ) )
+            self.assertEqual( 3, len( pool.workers ) )
+        finally:
+            pool.terminate()
+        self.assertEqual( [ 1, 2, 3, 4 ], sorted( [ x[0] for x in results ] ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from lxml import etree
+
+import acceptance_tester.framework.xml_slice as xml_slice
+
+SUITE = '''<?xml version="1.0" encoding="UTF-8"?>
+<testsuite xmlns="info:testsuite#" xmlns:fc="http://dbc.dk/xml/namespaces/fcrepo" type="dummy">
+  <!-- comment > with a bracket -->
+  <setup limit="a > b"><fc:fcrepo type="normal"/></setup>
+  <test name="first"><description>Ræv</description><fc:ingest value="x"/></test>
+  <test name="second" xmlns:fc="http://dbc.dk/xml/namespaces/fcrepo"/>
+</testsuite>
+'''
+
+
+def canonical( xml ):
+    parser = etree.XMLParser( remove_blank_text=True )
+    return etree.tostring( etree.fromstring( xml, parser ), method="c14n", exclusive=True )
+
+
+class TestSliceSuite( unittest.TestCase ):
+
+    def setUp( self ):
+        self.test_folder = tempfile.mkdtemp()
+        self.path = os.path.join( self.test_folder, "suite.xml" )
+        self.write( SUITE )
+
+    def tearDown( self ):
+        shutil.rmtree( self.test_folder )
+
+    def write( self, content ):
+        fh = open( self.path, 'wb' )
+        fh.write( content.encode( 'UTF-8' ) )
+        fh.close()
+
+    def parse( self ):
+        return etree.parse( self.path, etree.XMLParser( remove_blank_text=True ) )
+
+    def expected( self, xml, position ):
+        """ Returns the wrapped xml of a test, as made from the parsed testsuite """
+        root = xml.getroot()
+        setup = etree.tostring( root.find( "{info:testsuite#}setup" ), encoding="unicode" )
+        test = etree.tostring( root.findall( "{info:testsuite#}test" )[position], encoding="unicode" )
+        return "<wrapping name=\"%s\">%s%s</wrapping>"%( root.findall( "{info:testsuite#}test" )[position].get( "name" ), setup, test )
+
+    def test_slices_read_the_same_xml_as_the_parsed_testsuite( self ):
+        """ Test that a slice reads the setup and test nodes with their namespaces
+        """
+        xml = self.parse()
+        slices = xml_slice.slice_suite( self.path, xml )
+        self.assertEqual( [ "first", "second" ], [ x.name for x in slices ] )
+        for position, piece in enumerate( slices ):
+            self.assertEqual( canonical( self.expected( xml, position ) ), canonical( piece.read() ) )
+
+    def test_digest_is_hash_of_wrapped_xml( self ):
+        """ Test that the digest of a slice is the hash of the xml it reads
+        """
+        piece = xml_slice.slice_suite( self.path, self.parse() )[0]
+        self.assertEqual( hashlib.sha1( piece.read().encode( 'UTF-8' ) ).hexdigest(), piece.digest )
+
+    def test_slice_survives_pickling( self ):
+        """ Test that a slice sent to a worker reads the same xml
+        """
+        piece = xml_slice.slice_suite( self.path, self.parse() )[1]
+        self.assertEqual( piece.read(), pickle.loads( pickle.dumps( piece ) ).read() )
+        self.assertEqual( piece, xml_slice.XmlSlice.from_list( piece.to_list() ) )
+
+    def test_reading_a_changed_file_raises( self ):
+        """ Test that a slice is not read from a testsuite file changed after it was made
+        """
+        piece = xml_slice.slice_suite( self.path, self.parse() )[0]
+        self.write( SUITE.replace( "first", "1st" ) )
+        self.assertRaises( RuntimeError, piece.read )
+
+    def test_file_with_doctype_is_not_sliced( self ):
+        """ Test that files that may use entities from a document type declaration are not sliced
+        """
+        self.write( SUITE.replace( '<testsuite ', '<!DOCTYPE testsuite [ <!ENTITY e "x"> ]>\n<testsuite ', 1 ) )
+        self.assertEqual( None, xml_slice.slice_suite( self.path, self.parse() ) )
+
+    def test_wrapped_xml_passes_strings_through( self ):
+        """ Test that wrapped xml given as a string is returned as is
+        """
+        self.assertEqual( "<wrapping/>", xml_slice.wrapped_xml( "<wrapping/>" ) )
+
+
+if __name__ == '__main__':
+    unittest.main()